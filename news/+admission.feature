@@ -0,0 +1,5 @@
+Add a frequency based admission policy for the page RAM cache. With the new
+``ramCacheAdmissionThreshold`` setting, pages are only stored once they have
+been requested that many times recently, as estimated by a count-min sketch,
+so that crawlers do not push out frequently requested pages.
+[agent]
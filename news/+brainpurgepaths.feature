@@ -0,0 +1,4 @@
+Add an ``IPurgePaths`` adapter for catalog brains, which computes the paths
+to purge for a content item from catalog metadata without loading it, and
+use it to purge whole sections from the *Purge* control panel tab.
+[agent]
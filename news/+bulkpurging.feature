@@ -0,0 +1,4 @@
+Add the ``bulkPurging`` context manager, which suspends per-object purging
+during bulk operations and bans the changed sections on the caching proxies
+once the transaction is committed.
+[agent]
@@ -0,0 +1,5 @@
+The cache stop request variables are compiled once per configured value
+instead of being compared against every request key. Entries ending in ``*``
+match by prefix and entries starting with ``re:`` are regular expressions, so
+whole families of personalisation parameters can be listed.
+[agent]
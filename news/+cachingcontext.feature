@@ -0,0 +1,6 @@
+Resolve the context, the ``plone_portal_state`` and ``plone_context_state``
+views, the membership tool, the anonymous flag and the authenticated member
+only once per request. They are kept on a ``CachingContext`` object in the
+request annotations, which is shared by the caching operations and the ETag
+components (see ``getCachingContext()`` in ``plone.app.caching.operations.utils``).
+[agent]
@@ -0,0 +1,5 @@
+Classify each request before calculating ETag and Last-Modified values. POST
+requests, requests with cache stop variables and requests by logged-in users
+for rulesets with ``anonOnly`` no longer compute validators that can never be
+used. The decision is made by a pluggable ``IRequestClassifier`` adapter.
+[agent]
@@ -0,0 +1,4 @@
+Add an ``ILastModified`` adapter for Dexterity containers that takes changes to
+direct children into account. The time of the last change is kept in the
+container's annotations by event handlers, so children are never woken up.
+[agent]
@@ -0,0 +1,5 @@
+Optionally record the content shown by each cacheable page while it is
+rendered, and evict the pages that showed changed content from the RAM
+cache of all Zope processes and purge them from the caching proxy.
+Enable it with the ``trackDependencies`` setting.
+[agent]
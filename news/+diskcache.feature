@@ -0,0 +1,4 @@
+Add an optional on-disk second tier for pages cached in RAM, configured with
+``diskcache-directory`` and ``diskcache-size`` in a ``plone.app.caching``
+product-config section. Pages survive eviction from RAM and restarts.
+[agent]
@@ -0,0 +1,7 @@
+Render personalised regions of pages, such as the personal bar or portlet
+columns, as Edge Side Includes when the caching proxy supports them. The
+regions are listed in the new ``esiFragments`` setting, and are rendered by
+the ``@@esi-fragment`` view, which is cached through its own
+``plone.content.fragment`` ruleset. A new ``esi`` ETag component tells
+pages with includes apart.
+[agent]
@@ -0,0 +1,5 @@
+In debug mode, the ``ILastModified`` adapter for filesystem skin objects no
+longer stats the file on every request. Modification times are cached per
+process and refreshed by a background thread that polls the filesystem once a
+second, so edits are still picked up.
+[agent]
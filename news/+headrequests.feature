@@ -0,0 +1,4 @@
+Treat HEAD requests like GET requests in the default caching operations. They
+are answered with "304 Not Modified" responses and from pages cached in RAM,
+without a body, instead of always rendering the full page.
+[agent]
@@ -0,0 +1,5 @@
+Evict RAM cached pages of changed content on every Zope process of a
+cluster. The paths of changed content are recorded in a persistent
+invalidation log, which each process reads before looking up pages in its
+RAM cache. Purging the RAM cache in the control panel purges all processes.
+[agent]
@@ -0,0 +1,4 @@
+Add the ``purgeDebounceWindow`` and ``purgeDebounceMaxDelay`` settings to
+collapse repeated purges of the same URL into one, sent once the URL has not
+been purged again for the window, or at the latest after the maximum delay.
+[agent]
@@ -0,0 +1,5 @@
+Add an optional durable outbox for purge requests, configured with
+``purge-outbox-directory`` in the ``plone.app.caching`` product config.
+Purges are written to a journal at commit and sent by a background thread,
+which retries each caching proxy with exponential backoff.
+[agent]
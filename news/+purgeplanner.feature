@@ -0,0 +1,4 @@
+Add the ``purgeBanThreshold`` setting. When the changes of a request would
+take more purge requests than that, the purges of each changed item are
+replaced by one ``BAN`` request for its path per caching proxy.
+[agent]
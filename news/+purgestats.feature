@@ -0,0 +1,4 @@
+Record the outcome and latency of purges per caching proxy, and show them
+with the number of queued purges in a new *Purge statistics* control panel
+tab and as JSON from ``@@caching-purge-statistics.json``.
+[agent]
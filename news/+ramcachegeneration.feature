@@ -0,0 +1,5 @@
+Purge the page RAM cache in constant time on all Zope processes. Page keys
+now include a generation number stored in the ZODB, which the *Purge* button
+of the RAM cache control panel and changes to the theming or resource
+registry settings increment.
+[agent]
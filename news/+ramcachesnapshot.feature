@@ -0,0 +1,5 @@
+Write the pages with the most hits in the RAM cache to a snapshot file on
+graceful shutdown, and load them back in the background on startup. Configure
+with ``ramcache-snapshot`` and ``ramcache-snapshot-size`` in the
+``plone.app.caching`` product-config section.
+[agent]
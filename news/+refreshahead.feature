@@ -0,0 +1,4 @@
+Add a refresh-ahead mode for the RAM cache: set ``refreshAheadSize`` to have
+the most frequently served pages of each ruleset requested again in the
+background after content has changed.
+[agent]
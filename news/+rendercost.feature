@@ -0,0 +1,5 @@
+Record the render time and response size of each view, and show them in the
+RAM cache control panel. With the new ``ramCacheCostThreshold`` setting,
+views that are expensive to render per kilobyte of output are cached in RAM
+automatically.
+[agent]
@@ -0,0 +1,4 @@
+Optionally request purged pages again after a purge, so that the caching
+proxy and the RAM cache are warm before the next visitor arrives. List the
+content types in the new ``rewarmContentTypes`` setting.
+[agent]
@@ -0,0 +1,5 @@
+Add a ``sectionCounter`` ETag component. It combines a site-wide counter with a
+per-section counter, so that changing content in one section no longer
+invalidates the cached pages of the whole site. The section depth is
+configurable with the new ``sectionCounterDepth`` setting.
+[agent]
@@ -0,0 +1,4 @@
+Look up the roles for the ``roles`` ETag component and the anonymous
+visibility check done by the default caching operations at most once per
+request.
+[agent]
@@ -0,0 +1,6 @@
+Add ``redirectTTL`` and ``notFoundTTL`` parameters to the default caching
+operations, to cache redirects and 404/410 responses for anonymous users with
+their own, usually short, timeout in the caching proxy and the RAM cache.
+The old URLs of moved or renamed content, the URLs of added content and
+the old paths of ``plone.app.redirector`` redirections are now purged as well.
+[agent]
@@ -1,8 +1,13 @@
 from operator import itemgetter
+from plone.app.caching import purgestats
 from plone.app.caching.browser.edit import EditForm
+from plone.app.caching.counters import purgeRAMCache
+from plone.app.caching.diskcache import getDiskCache
 from plone.app.caching.interfaces import _
 from plone.app.caching.interfaces import ICacheProfiles
 from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.operations import rendercost
+from plone.app.caching.outbox import getPurgeOutbox
 from plone.cachepurging.interfaces import ICachePurgingSettings
 from plone.cachepurging.interfaces import IPurger
 from plone.cachepurging.utils import getPathsToPurge
@@ -29,6 +34,7 @@ from zope.publisher.interfaces import NotFound
 from zope.ramcache.interfaces.ram import IRAMCache
 
 import datetime
+import json
 import re
 
 
@@ -558,6 +564,7 @@ class Purge(BaseView):
     def processPurge(self):
         urls = self.request.form.get("urls", [])
         sync = self.request.form.get("synchronous", True)
+        subtree = self.request.form.get("subtree", False)
 
         if not urls:
             self.errors["urls"] = _("No URLs or paths entered.")
@@ -571,11 +578,12 @@ class Purge(BaseView):
         urls = [x.decode("utf8") if isinstance(x, bytes) else x for x in urls]
 
         purger = getUtility(IPurger)
+        outbox = getPurgeOutbox()
         serverURL = self.request["SERVER_URL"]
 
         def purge(url):
             if sync:
-                status, xcache, xerror = purger.purgeSync(url)
+                status, xcache, xerror = purgestats.purgeSync(purger, url)
 
                 log = url
                 if xcache:
@@ -585,6 +593,9 @@ class Purge(BaseView):
                 if not str(status).startswith("2"):
                     log += " -- WARNING status " + str(status)
                 self.purgeLog.append(log)
+            elif outbox is not None:
+                outbox.add([url])
+                self.purgeLog.append(url)
             else:
                 purger.purgeAsync(url)
                 self.purgeLog.append(url)
@@ -620,6 +631,22 @@ class Purge(BaseView):
                 purge(inputURL)
                 continue
 
+            if subtree:
+                # Compute the paths from the catalog, without loading
+                # every object below the given one
+                catalog = getToolByName(self.context, "portal_catalog")
+                brains = catalog.unrestrictedSearchResults(
+                    path="/".join(physicalPath)
+                )
+                if brains:
+                    paths = set()
+                    for brain in brains:
+                        paths.update(getPathsToPurge(brain, self.request))
+                    for path in sorted(paths):
+                        for newURL in getURLsToPurge(path, proxies):
+                            purge(newURL)
+                    continue
+
             obj = portal.unrestrictedTraverse(relativePath, None)
             if obj is None:
                 purge(inputURL)
@@ -630,6 +657,96 @@ class Purge(BaseView):
                     purge(newURL)
 
 
+class PurgeStatistics(BaseView):
+    """The purge statistics control panel"""
+
+    def update(self):
+        if super().update():
+            if "form.button.Reset" in self.request.form:
+                self.processReset()
+
+    def processReset(self):
+        purgestats.statistics.clear()
+        IStatusMessage(self.request).addStatusMessage(_("Statistics reset."), "info")
+
+    def getStatistics(self):
+        """Statistics for each caching proxy, including the number of purges
+        waiting to be sent to it
+        """
+
+        statistics = purgestats.statistics.getStatistics()
+
+        def getProxyStatistics(proxy):
+            stats = statistics.get(proxy)
+            if stats is None:
+                stats = statistics[proxy] = purgestats.emptyStatistics()
+            stats.setdefault("queued", 0)
+            stats.setdefault("retryAt", None)
+            return stats
+
+        registry = queryUtility(IRegistry)
+        if registry is not None:
+            settings = registry.forInterface(ICachePurgingSettings, check=False)
+            for proxy in settings.cachingProxies or ():
+                getProxyStatistics(purgestats.getProxy(proxy))
+
+        outbox = getPurgeOutbox()
+        if outbox is not None:
+            for proxy, status in outbox.getStatus().items():
+                stats = getProxyStatistics(proxy)
+                stats["queued"] += status["pending"]
+                stats["retryAt"] = status["retryAt"] or None
+
+        # The queues of the worker threads of plone.cachepurging's purger
+        purger = queryUtility(IPurger)
+        for (host, scheme), queue in list(getattr(purger, "queues", {}).items()):
+            getProxyStatistics(f"{scheme}://{host}")["queued"] += queue.qsize()
+
+        for proxy in list(statistics):
+            getProxyStatistics(proxy)
+        return statistics
+
+    def proxyStatistics(self):
+        """Statistics for each caching proxy, formatted for display"""
+
+        def formatTime(seconds):
+            return "" if seconds is None else "%.1f" % (seconds * 1000)
+
+        def formatTimestamp(timestamp):
+            if not timestamp:
+                return ""
+            return datetime.datetime.fromtimestamp(timestamp).isoformat(" ", "seconds")
+
+        proxies = []
+        for proxy, stats in sorted(self.getStatistics().items()):
+            proxies.append(
+                {
+                    "proxy": proxy,
+                    "successes": stats["successes"],
+                    "failures": stats["failures"],
+                    "queued": stats["queued"],
+                    "retryAt": formatTimestamp(stats["retryAt"]),
+                    "averageTime": formatTime(stats["averageTime"]),
+                    "maxTime": formatTime(stats["maxTime"]),
+                    "histogram": [bucket["count"] for bucket in stats["histogram"]],
+                    "lastError": stats["lastError"] or "",
+                    "lastErrorTime": formatTimestamp(stats["lastErrorTime"]),
+                }
+            )
+        return proxies
+
+    def latencyBuckets(self):
+        """Labels of the latency histogram buckets"""
+        labels = ["≤ %g ms" % (bound * 1000) for bound in purgestats.LATENCY_BUCKETS]
+        labels.append("> %g ms" % (purgestats.LATENCY_BUCKETS[-1] * 1000))
+        return labels
+
+    def json(self):
+        """The statistics in JSON format"""
+        self.request.response.setHeader("Content-Type", "application/json")
+        return json.dumps(self.getStatistics(), sort_keys=True)
+
+
 class RAMCache(BaseView):
     """The RAM cache control panel"""
 
@@ -638,6 +755,40 @@ class RAMCache(BaseView):
             if "form.button.Purge" in self.request.form:
                 self.processPurge()
 
+    def diskCacheStatistics(self):
+        """Statistics for the disk tier of the RAM cache, or None if it is
+        not configured
+        """
+        diskCache = getDiskCache()
+        if diskCache is None:
+            return None
+        return {
+            "path": diskCache.path,
+            "entries": len(diskCache),
+            "size": diskCache.size(),
+        }
+
+    def renderCostStatistics(self):
+        """Render time and response size per view, most expensive first"""
+        threshold = rendercost.getCostThreshold()
+        statistics = []
+        for stats in rendercost.statistics.getStatistics():
+            statistics.append(
+                {
+                    "view": stats["view"],
+                    "renders": stats["renders"],
+                    "time": "%.1f" % stats["time"],
+                    "size": stats["size"],
+                    "cost": "%.2f" % stats["cost"],
+                    "cached": bool(
+                        threshold
+                        and stats["renders"] >= rendercost.MIN_RENDERS
+                        and stats["cost"] >= threshold
+                    ),
+                }
+            )
+        return statistics
+
     def processPurge(self):
 
         if self.ramCache is None:
@@ -651,5 +802,8 @@ class RAMCache(BaseView):
             )
             return
 
-        self.ramCache.invalidateAll()
+        # Make the cached pages unreachable on all Zope processes at once,
+        # rather than walking the cache
+        purgeRAMCache()
+
         IStatusMessage(self.request).addStatusMessage(_("Cache purged."), "info")
@@ -0,0 +1,65 @@
+from Acquisition.interfaces import IAcquirer
+from plone.app.caching.esi import getConfiguredFragments
+from plone.app.caching.esi import renderFragmentsInline
+from plone.app.caching.interfaces import IESIFragment
+from Products.Five import BrowserView
+from zExceptions import NotFound
+from zope.component import queryMultiAdapter
+from zope.contentprovider.interfaces import IContentProvider
+from zope.interface import implementer
+from zope.viewlet.interfaces import IViewlet
+
+
+@implementer(IESIFragment)
+class ESIFragment(BrowserView):
+    """Render a fragment of a page that the caching proxy includes through
+    Edge Side Includes (see ``plone.app.caching.esi``). The ``name`` request
+    parameter gives the name of a viewlet or portlet manager, or of a viewlet
+    manager and one of its viewlets separated by a ``/``.
+    """
+
+    @property
+    def fragmentName(self):
+        name = self.request.form.get("name", None)
+        return name if isinstance(name, str) else None
+
+    def __call__(self):
+        name = self.fragmentName
+        if not name or name not in getConfiguredFragments():
+            raise NotFound(self.context, name, self.request)
+
+        # Render the fragment itself rather than an include of it
+        renderFragmentsInline(self.request)
+
+        managerName, _, viewletName = name.partition("/")
+        provider = queryMultiAdapter(
+            (self.context, self.request, self), IContentProvider, name=managerName
+        )
+        if provider is None:
+            raise NotFound(self.context, name, self.request)
+        if IAcquirer.providedBy(provider):
+            provider = provider.__of__(self.context)
+
+        if viewletName:
+            provider = self.getViewlet(provider, viewletName)
+            if provider is None:
+                return ""
+
+        provider.update()
+        return provider.render()
+
+    def getViewlet(self, manager, name):
+        """Return the viewlet with the given name, or None if it is hidden or
+        not accessible
+        """
+
+        viewlet = queryMultiAdapter(
+            (self.context, self.request, self, manager), IViewlet, name=name
+        )
+        if viewlet is None:
+            return None
+
+        viewlets = manager.filter([(name, viewlet)])
+        if not viewlets:
+            return None
+        return viewlets[0][1]
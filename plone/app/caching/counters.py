@@ -0,0 +1,230 @@
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.registry.interfaces import IRecordModifiedEvent
+from plone.registry.interfaces import IRegistry
+from Products.CMFCore.interfaces import IActionSucceededEvent
+from Products.CMFCore.interfaces import IContentish
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import queryUtility
+from zope.component.hooks import getSite
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
+
+
+COUNTERS_KEY = "plone.app.caching.counters"
+
+# Name of the counter for site-level changes, i.e. registry settings and
+# content directly in the site root
+SITE_COUNTER = "site"
+
+# Prefix for the counters of individual sections
+SECTION_COUNTER_PREFIX = "section:"
+
+# Name of the counter for the generation of the page RAM cache, which is part
+# of the key of every cached page
+RAM_CACHE_GENERATION_COUNTER = "ramcache"
+
+# Registry records whose changes affect the rendering of every page
+THEME_RECORD_PREFIXES = (
+    "plone.app.theming.",
+    "plone.bundles/",
+    "plone.resources/",
+)
+
+
+def getCounters(site=None, create=False):
+    """Get the mapping of persistent counters stored in the annotations of the
+    given site (by default, the current site), or None if there is none.
+
+    Counters are ``BTrees.Length.Length`` objects, which resolve concurrent
+    increments without raising ``ConflictError``.
+
+    If ``create`` is True, the mapping will be created if necessary.
+    """
+
+    if site is None:
+        site = getSite()
+    if site is None:
+        return None
+
+    annotations = IAnnotations(site, None)
+    if annotations is None:
+        return None
+
+    counters = annotations.get(COUNTERS_KEY, None)
+    if counters is None and create:
+        counters = annotations[COUNTERS_KEY] = OOBTree()
+
+    return counters
+
+
+def getCounter(name, site=None):
+    """Return the current value of the named counter, or 0 if it has never
+    been incremented.
+    """
+
+    counters = getCounters(site)
+    if counters is None:
+        return 0
+
+    counter = counters.get(name, None)
+    if counter is None:
+        return 0
+
+    return counter()
+
+
+def incrementCounter(name, site=None):
+    """Increment the named counter and return its new value."""
+
+    counters = getCounters(site, create=True)
+    if counters is None:
+        return 0
+
+    counter = counters.get(name, None)
+    if counter is None:
+        counter = counters[name] = Length()
+
+    counter.change(1)
+    return counter()
+
+
+#
+# Section counters
+#
+
+
+def getSectionCounterDepth():
+    """Return the number of path elements below the site root that make up a
+    section, as configured in the registry.
+    """
+
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return 1
+
+    settings = registry.forInterface(IPloneCacheSettings, check=False)
+    return settings.sectionCounterDepth or 1
+
+
+def getRelativePath(path, site):
+    """Return the given physical path relative to the site, as a tuple, or
+    None if it is not inside the site.
+    """
+
+    sitePath = site.getPhysicalPath()
+    if tuple(path[: len(sitePath)]) != tuple(sitePath):
+        return None
+    return tuple(path[len(sitePath) :])
+
+
+def getSectionCounterName(relativePath, depth):
+    """Return the name of the counter for the section containing the given
+    site-relative path.
+    """
+
+    return SECTION_COUNTER_PREFIX + "/".join(relativePath[:depth])
+
+
+def getSectionCounterValue(context, site=None, depth=None):
+    """Return the value of the ``sectionCounter`` ETag component for the
+    given context, combining the site counter and the counter for the
+    section the context lives in.
+    """
+
+    if site is None:
+        site = getSite()
+    if site is None:
+        return None
+
+    relativePath = getRelativePath(context.getPhysicalPath(), site)
+    if relativePath is None:
+        return None
+
+    if depth is None:
+        depth = getSectionCounterDepth()
+
+    return "{}.{}".format(
+        getCounter(SITE_COUNTER, site),
+        getCounter(getSectionCounterName(relativePath, depth), site),
+    )
+
+
+def incrementSectionCounters(path, site=None, depth=None):
+    """Record a change to the content item at the given physical path.
+
+    The counters of every section on the ancestor chain of the item are
+    incremented, down to the configured depth. This includes the (empty)
+    section for the site root, which therefore counts every change. Changes
+    to content directly in the site root also increment the site counter,
+    since they usually show up in the global navigation.
+    """
+
+    if site is None:
+        site = getSite()
+    if site is None:
+        return
+
+    relativePath = getRelativePath(path, site)
+    if relativePath is None:
+        return
+
+    if depth is None:
+        depth = getSectionCounterDepth()
+
+    for i in range(min(depth, len(relativePath)) + 1):
+        incrementCounter(getSectionCounterName(relativePath, i), site)
+
+    if len(relativePath) <= 1:
+        incrementCounter(SITE_COUNTER, site)
+
+
+@adapter(IContentish, IObjectModifiedEvent)
+def contentModified(object, event):
+    incrementSectionCounters(object.getPhysicalPath())
+
+
+@adapter(IContentish, IActionSucceededEvent)
+def contentTransitioned(object, event):
+    incrementSectionCounters(object.getPhysicalPath())
+
+
+@adapter(IContentish, IObjectMovedEvent)
+def contentMoved(object, event):
+    # Covers additions and removals as well
+    if event.oldParent is not None:
+        oldPath = event.oldParent.getPhysicalPath() + (event.oldName,)
+        incrementSectionCounters(oldPath)
+    if event.newParent is not None:
+        newPath = event.newParent.getPhysicalPath() + (event.newName,)
+        incrementSectionCounters(newPath)
+
+
+@adapter(IRecordModifiedEvent)
+def settingsModified(event):
+    incrementCounter(SITE_COUNTER)
+
+
+#
+# RAM cache generation
+#
+
+
+def purgeRAMCache(site=None):
+    """Make all pages in the RAM cache unreachable, on all Zope processes.
+
+    This increments the generation that is part of the key of every cached
+    page, so it takes constant time. The pages of older generations are
+    evicted from the cache as usual, when they are no longer used.
+    """
+
+    return incrementCounter(RAM_CACHE_GENERATION_COUNTER, site)
+
+
+@adapter(IRecordModifiedEvent)
+def themeSettingsModified(event):
+    if event.record.__name__.startswith(THEME_RECORD_PREFIXES):
+        purgeRAMCache()
+
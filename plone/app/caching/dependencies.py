@@ -0,0 +1,280 @@
+"""Tracking of the content shown by cached pages.
+
+Listings, collections, navigation and search results show content from many
+objects. Their ETags usually rely on the site-wide ``catalogCounter``, so
+that they go stale with every change anywhere in the site, or they are only
+cached for a short time.
+
+If the ``trackDependencies`` setting is on, the UIDs of the content a
+cacheable page shows are recorded while it is rendered: the UID of the
+published content item, and the UIDs of all catalog brains read by the page.
+When the page is stored in the RAM cache, it is tracked for each of these
+UIDs, and its path is remembered for purging it from the caching proxies.
+When content is changed, the pages that showed it are evicted from the RAM
+cache on all Zope processes, through the invalidation log (see
+``plone.app.caching.invalidation``).
+
+The paths for purging the caching proxies are only kept in memory by the
+process that rendered the pages. The process that changes the content only
+purges the pages it rendered itself, up to ``MAX_PATHS_PER_UID`` per UID.
+Pages rendered by other processes stay in the caching proxies until they
+expire, or until one of their regular purge paths is purged.
+
+Catalog brains are recorded through a hook installed into ZCatalog the
+first time dependencies are tracked. ZCatalog offers no other way to see
+the brains a page reads; outside of tracking, the hook only checks a
+thread-local. Code that shows content without querying the catalog can
+call ``recordDependency()``.
+"""
+
+from collections import OrderedDict
+from plone.app.caching.invalidation import dependentPages
+from plone.app.caching.invalidation import invalidateOnCommit
+from plone.app.caching.invalidation import MAX_PAGES_PER_UID
+from plone.app.caching.invalidation import UID_PREFIX
+from plone.app.caching.purge import isBulkPurging
+from plone.cachepurging.hooks import KEY
+from plone.cachepurging.interfaces import IPurgePathRewriter
+from plone.cachepurging.utils import isCachePurgingEnabled
+from plone.registry.interfaces import IRegistry
+from plone.uuid.interfaces import IUUID
+from Products.CMFCore.interfaces import IActionSucceededEvent
+from Products.CMFCore.interfaces import IContentish
+from Products.ZCatalog.Catalog import Catalog
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import queryUtility
+from zope.globalrequest import getRequest
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
+
+import threading
+
+
+TRACK_DEPENDENCIES_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.trackDependencies"
+)
+
+# Maximum number of UIDs for which the paths of dependent pages are kept
+MAX_UIDS = 10000
+
+# Maximum number of dependent page paths kept per UID
+MAX_PATHS_PER_UID = MAX_PAGES_PER_UID
+
+
+class DependentPaths:
+    """Keeps track of the paths of the pages that show the content with a
+    given UID, for purging them from the caching proxies.
+
+    When more than ``maxUIDs`` UIDs are tracked, the UIDs that were recorded
+    least recently are forgotten. Only the pages rendered by this process
+    are known.
+    """
+
+    def __init__(self, maxUIDs=MAX_UIDS, maxPaths=MAX_PATHS_PER_UID):
+        self.maxUIDs = maxUIDs
+        self.maxPaths = maxPaths
+        self._uids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, uid, path):
+        with self._lock:
+            paths = self._uids.pop(uid, None) or set()
+            if len(paths) < self.maxPaths:
+                paths.add(path)
+            self._uids[uid] = paths
+            while len(self._uids) > self.maxUIDs:
+                self._uids.popitem(last=False)
+
+    def pop(self, uid):
+        """Forget the given UID, and return the paths of the pages that
+        showed its content
+        """
+        with self._lock:
+            return self._uids.pop(uid, None) or set()
+
+    def clear(self):
+        with self._lock:
+            self._uids.clear()
+
+
+dependentPaths = DependentPaths()
+
+
+def isTrackingEnabled():
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return False
+    return bool(registry.get(TRACK_DEPENDENCIES_RECORD, None))
+
+
+#
+# Recording dependencies while rendering
+#
+
+_tracking = threading.local()
+
+
+def startTracking(request, context=None):
+    """Start recording the content shown by the response to the given
+    request, which is rendered in the current thread. The given content
+    item is recorded right away.
+    """
+
+    installCatalogHook()
+    _tracking.request = request
+    _tracking.uids = set()
+    if context is not None:
+        recordDependency(IUUID(context, None))
+
+
+def recordDependency(uid):
+    """Record that the response rendered in the current thread shows the
+    content with the given UID
+    """
+
+    uids = getattr(_tracking, "uids", None)
+    if uids is None or not uid or not isinstance(uid, str):
+        return
+
+    if _tracking.request is not getRequest():
+        # Left over from a request that was not rendered to the end
+        stopTracking()
+        return
+
+    uids.add(uid)
+
+
+def stopTracking(request=None):
+    """Stop recording, and return the UIDs recorded for the given request"""
+
+    uids = getattr(_tracking, "uids", None)
+    trackedRequest = getattr(_tracking, "request", None)
+    _tracking.uids = _tracking.request = None
+
+    if uids is None or (request is not None and request is not trackedRequest):
+        return set()
+    return uids
+
+
+def finishTracking(request, success, globalKey=None, key=None):
+    """Stop recording, and remember the page for the recorded UIDs, if the
+    response was successful. ``globalKey`` and ``key`` identify the page in
+    the RAM cache, if it was stored there.
+    """
+
+    uids = stopTracking(request)
+    if not uids or not success:
+        return
+
+    if key:
+        for uid in uids:
+            dependentPages.record(UID_PREFIX + uid, globalKey, key)
+
+    path = getPurgePath(request)
+    if path:
+        for uid in uids:
+            dependentPaths.record(uid, path)
+
+
+def getPurgePath(request):
+    """Get the path of the given request relative to the virtual host root,
+    as used for purging, or None if it cannot be purged
+    """
+
+    if request.get("REQUEST_METHOD", "GET") != "GET":
+        return None
+
+    url = request.get("ACTUAL_URL", None)
+    serverURL = request.get("SERVER_URL", None)
+    if not url or not serverURL or not url.startswith(serverURL):
+        return None
+
+    path = url[len(serverURL) :] or "/"
+    query = request.get("QUERY_STRING", None)
+    if query:
+        path += "?" + query
+    return path
+
+
+_catalogHookLock = threading.Lock()
+
+
+def installCatalogHook():
+    """Make ZCatalog record the UIDs of the brains it creates while
+    dependencies are tracked in the current thread
+    """
+
+    if getattr(Catalog.instantiate, "recordsDependencies", False):
+        return
+
+    with _catalogHookLock:
+        if getattr(Catalog.instantiate, "recordsDependencies", False):
+            return
+
+        instantiate = Catalog.instantiate
+
+        def instantiateAndRecord(self, record, score_data=None):
+            brain = instantiate(self, record, score_data=score_data)
+            if getattr(_tracking, "uids", None) is not None:
+                recordDependency(getattr(brain, "UID", None))
+            return brain
+
+        instantiateAndRecord.recordsDependencies = True
+        Catalog.instantiate = instantiateAndRecord
+
+
+#
+# Invalidating dependent pages
+#
+
+
+def invalidateDependents(object):
+    """Evict the pages that show the given content from the RAM cache on all
+    Zope processes, and purge those rendered by this process from the
+    caching proxies, once the transaction is committed
+    """
+
+    if not isTrackingEnabled():
+        return
+
+    uid = IUUID(object, None)
+    if not uid:
+        return
+
+    invalidateOnCommit([(UID_PREFIX + uid, False)])
+
+    paths = dependentPaths.pop(uid)
+    if not paths or isBulkPurging() or not isCachePurgingEnabled():
+        return
+
+    request = getRequest()
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return
+
+    rewriter = IPurgePathRewriter(request, None)
+    queued = annotations.setdefault(KEY, set())
+    for path in paths:
+        if rewriter is None:
+            queued.add(path)
+        else:
+            queued.update(rewriter(path) or [])
+
+
+@adapter(IContentish, IObjectModifiedEvent)
+def contentModified(object, event):
+    invalidateDependents(object)
+
+
+@adapter(IContentish, IActionSucceededEvent)
+def contentTransitioned(object, event):
+    invalidateDependents(object)
+
+
+@adapter(IContentish, IObjectMovedEvent)
+def contentMoved(object, event):
+    # Pages listing new content are invalidated through their other
+    # dependencies, if at all
+    if event.oldParent is not None:
+        invalidateDependents(object)
@@ -0,0 +1,469 @@
+"""Optional on-disk second tier for the page RAM cache.
+
+Pages cached in RAM are lost when they are evicted and on every restart. If a
+directory is configured, pages stored in the RAM cache are also written to an
+append-only segment file in that directory. A page that cannot be found in
+RAM is then looked up on disk, and copied back into RAM if it is found. Pages
+are written by a background thread.
+
+The tier is configured in ``zope.conf``::
+
+    <product-config plone.app.caching>
+        diskcache-directory /var/cache/plone/instance1
+        diskcache-size 256
+    </product-config>
+
+``diskcache-size`` is the maximum size of the segment file in megabytes. When
+it is reached, the file is compacted, keeping the most recently stored pages.
+Each process needs its own directory: the segment file is locked while in use.
+
+The keys of the cached pages contain the ETag and last-modified date of the
+page, so pages are never updated in place. Entries for outdated keys are
+simply not read anymore, and dropped when the file is compacted.
+"""
+
+from App.config import getConfiguration
+
+import logging
+import marshal
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger("plone.app.caching")
+
+PRODUCT_CONFIG_NAME = "plone.app.caching"
+SEGMENT_FILENAME = "pagecache.dat"
+DEFAULT_MAX_SIZE = 256  # megabytes
+
+# Every record consists of this header, the key and the marshalled value. The
+# header holds a magic string, the lengths of the key and of the value, and a
+# CRC32 checksum of both.
+MAGIC = b"PACd"
+HEADER = struct.Struct(">4sIII")
+
+
+class DiskCache:
+    """A persistent mapping from string keys to cached pages, as stored by
+    ``storeResponseInRAMCache()``, backed by an append-only segment file.
+
+    Pages are written by a background thread, so that storing a page does
+    not wait for the disk; until then, they are served from memory. Reads go
+    through a memory map of the file. Records with a wrong checksum are
+    ignored. A truncated record at the end of the file, e.g. after a crash,
+    is cut off when the file is opened.
+    """
+
+    def __init__(self, directory, maxSize=DEFAULT_MAX_SIZE * 1024 * 1024):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.path = os.path.join(directory, SEGMENT_FILENAME)
+        self._lock = threading.RLock()
+        self._condition = threading.Condition(self._lock)
+        self._writeLock = threading.Lock()
+        self._index = {}
+        self._pending = {}
+        self._end = 0
+        self._file = None
+        self._map = None
+        self._writer = None
+        self._stopping = False
+        self._open()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is not None:
+                value = entry[1]
+                if value is None:
+                    return default
+            else:
+                position = self._index.get(key)
+                if position is None:
+                    return default
+
+                value = self._read(position)
+                if value is None:
+                    del self._index[key]
+                    return default
+
+        # Drop expired entries, see ``cacheInRAM()``
+        if len(value) > 4 and value[4] < time.time():
+            return default
+        return value
+
+    def __getitem__(self, key):
+        marker = object()
+        value = self.get(key, marker)
+        if value is marker:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        try:
+            record = makeRecord(key, value)
+        except ValueError:
+            logger.warning("Cannot store page %s on disk", key)
+            return
+
+        with self._condition:
+            self._pending[key] = (record, value)
+            self._condition.notify()
+        self.start()
+
+    def discard(self, key):
+        """Remove the given key, if present. A record without a value is
+        appended, so that the key stays removed when the file is opened
+        again.
+        """
+
+        with self._condition:
+            if key not in self:
+                return
+            self._index.pop(key, None)
+            self._pending[key] = (makeRecord(key, None), None)
+            self._condition.notify()
+        self.start()
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is not None:
+                return entry[1] is not None
+            return key in self._index
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index) + sum(
+                1
+                for key, (record, value) in self._pending.items()
+                if value is not None and key not in self._index
+            )
+
+    def size(self):
+        """The size of the segment file, in bytes."""
+        with self._lock:
+            return self._end
+
+    def clear(self):
+        with self._writeLock, self._lock:
+            self._closeMap()
+            self._file.seek(0)
+            self._file.truncate()
+            self._index.clear()
+            self._pending.clear()
+            self._end = 0
+
+    def close(self):
+        self.stop()
+        self.flush()
+        with self._writeLock, self._lock:
+            self._closeMap()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def start(self):
+        """Start the thread writing pages to the segment file, if necessary"""
+        with self._condition:
+            if self._writer is not None or not self._pending or self._file is None:
+                return
+            self._stopping = False
+            self._writer = threading.Thread(
+                target=self._run, name="plone.app.caching disk cache writer"
+            )
+            self._writer.daemon = True
+            self._writer.start()
+
+    def stop(self):
+        with self._condition:
+            writer = self._writer
+            self._stopping = True
+            self._condition.notify()
+        if writer is not None:
+            writer.join(5)
+
+    def flush(self):
+        """Write the pages waiting to be stored to the segment file"""
+
+        with self._writeLock:
+            while self._file is not None:
+                with self._lock:
+                    batch = list(self._pending.items())
+                if not batch:
+                    return
+
+                for key, entry in batch:
+                    record, value = entry
+                    if len(record) > self.maxSize:
+                        # Remove the page stored before, if any, instead
+                        logger.warning("Page %s is too large to store on disk", key)
+                        record, value = makeRecord(key, None), None
+                    if self._end + len(record) > self.maxSize:
+                        self._compact(max(self.maxSize // 2 - len(record), 0))
+
+                    # Only this method and _compact() write to the file, and
+                    # readers do not look beyond ``_end``
+                    position = self._end
+                    self._file.write(record)
+                    self._file.flush()
+
+                    with self._lock:
+                        self._end = position + len(record)
+                        if self._pending.get(key) is entry:
+                            del self._pending[key]
+                            if value is None:
+                                self._index.pop(key, None)
+                            else:
+                                self._index[key] = position
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    while not self._pending and not self._stopping:
+                        self._condition.wait()
+                    if self._stopping:
+                        return
+
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Cannot write pages to %s", self.path)
+                    with self._lock:
+                        self._pending.clear()
+        finally:
+            with self._condition:
+                self._writer = None
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = lockFile(open(self.path, "a+b"))
+
+        # Rebuild the index, stopping at the first damaged record
+        self._file.seek(0, os.SEEK_END)
+        end = self._file.tell()
+        position = 0
+        while position < end:
+            record = self._readRecord(position, end)
+            if record is None:
+                break
+            key, length = record
+            self._index[key] = position
+            position += length
+
+        if position < end:
+            logger.warning("Truncating damaged page cache file %s", self.path)
+            self._closeMap()
+            self._file.truncate(position)
+        self._file.seek(0, os.SEEK_END)
+        self._end = position
+
+    def _getMap(self, end):
+        if self._map is None or len(self._map) < end:
+            self._closeMap()
+            self._map = mmap.mmap(self._file.fileno(), end, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _closeMap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _readRecord(self, position, end, data=None):
+        """Return the key and total length of the record at ``position``,
+        or None if there is no valid record there.
+        """
+
+        if position + HEADER.size > end:
+            return None
+
+        if data is None:
+            data = self._getMap(end)
+        magic, keyLength, valueLength, checksum = HEADER.unpack_from(data, position)
+        length = HEADER.size + keyLength + valueLength
+        if magic != MAGIC or position + length > end:
+            return None
+
+        payload = data[position + HEADER.size : position + length]
+        if zlib.crc32(payload) != checksum:
+            return None
+
+        try:
+            key = payload[:keyLength].decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+        return key, length
+
+    def _read(self, position, end=None, data=None):
+        if end is None:
+            end = self._end
+        if self._readRecord(position, end, data) is None:
+            return None
+
+        if data is None:
+            data = self._getMap(end)
+        magic, keyLength, valueLength, checksum = HEADER.unpack_from(data, position)
+        start = position + HEADER.size + keyLength
+        try:
+            return marshal.loads(data[start : start + valueLength])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def _compact(self, size):
+        """Rewrite the segment file with the most recently stored entries,
+        up to ``size`` bytes.
+
+        The entries are copied from a snapshot of the index into a new file
+        without holding the lock, which is only taken to replace the file.
+        """
+
+        with self._lock:
+            index = dict(self._index)
+            end = self._end
+
+        now = time.time()
+        path = self.path + ".compact"
+        newFile = lockFile(open(path, "a+b"))
+        newFile.truncate(0)
+        positions = {}
+
+        if end:
+            data = mmap.mmap(self._file.fileno(), end, access=mmap.ACCESS_READ)
+            try:
+                records = []
+                total = 0
+                for key, position in sorted(
+                    index.items(), key=lambda item: item[1], reverse=True
+                ):
+                    value = self._read(position, end, data)
+                    if value is None or (len(value) > 4 and value[4] < now):
+                        continue
+                    length = self._readRecord(position, end, data)[1]
+                    if total + length > size:
+                        break
+                    records.append((key, position, length))
+                    total += length
+
+                for key, position, length in reversed(records):
+                    positions[key] = newFile.tell()
+                    newFile.write(data[position : position + length])
+                newFile.flush()
+            finally:
+                data.close()
+
+        with self._lock:
+            self._closeMap()
+            os.replace(path, self.path)
+            self._file.close()
+            self._file = newFile
+            self._end = newFile.tell()
+            # Entries dropped from the index in the meantime stay dropped
+            self._index = {
+                key: positions[key]
+                for key, position in index.items()
+                if key in positions and self._index.get(key) == position
+            }
+
+
+def makeRecord(key, value):
+    """Return the record storing the given value under the given key. Raises
+    ``ValueError`` if the value cannot be marshalled.
+    """
+
+    encodedKey = key.encode("utf-8")
+    data = marshal.dumps(value)
+    return (
+        HEADER.pack(
+            MAGIC,
+            len(encodedKey),
+            len(data),
+            zlib.crc32(encodedKey + data),
+        )
+        + encodedKey
+        + data
+    )
+
+
+def lockFile(file):
+    """Lock the given open file for this process, or close it and raise
+    ``OSError`` if another process holds the lock
+    """
+
+    if fcntl is not None:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            file.close()
+            raise
+    return file
+
+
+def getDiskCacheKey(globalKey, key):
+    """Calculate the key for a page in the disk tier of the RAM cache. The
+    disk tier is shared by all global cache keys.
+    """
+    return globalKey + "||" + key
+
+
+# The disk cache of this process, ``_NOT_CONFIGURED`` if there is none, or
+# None if the configuration has not been read yet
+_NOT_CONFIGURED = object()
+_diskCache = None
+_diskCacheLock = threading.Lock()
+
+
+def getDiskCache():
+    """Return the disk cache configured for this process, or None if there
+    is none.
+    """
+
+    global _diskCache
+
+    if _diskCache is None:
+        with _diskCacheLock:
+            if _diskCache is None:
+                cache = _createDiskCache()
+                _diskCache = _NOT_CONFIGURED if cache is None else cache
+
+    if _diskCache is _NOT_CONFIGURED:
+        return None
+    return _diskCache
+
+
+def setDiskCache(cache):
+    """Replace the disk cache of this process. Passing ``None`` means the
+    configuration is read again on the next lookup.
+    """
+
+    global _diskCache
+    _diskCache = cache
+
+
+def _createDiskCache():
+    productConfig = getattr(getConfiguration(), "product_config", None) or {}
+    config = productConfig.get(PRODUCT_CONFIG_NAME) or {}
+
+    directory = config.get("diskcache-directory")
+    if not directory:
+        return None
+
+    try:
+        maxSize = int(config.get("diskcache-size", DEFAULT_MAX_SIZE))
+    except ValueError:
+        maxSize = DEFAULT_MAX_SIZE
+
+    try:
+        return DiskCache(directory, maxSize * 1024 * 1024)
+    except OSError:
+        logger.exception("Cannot open the page cache in %s", directory)
+        return None
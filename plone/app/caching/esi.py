@@ -0,0 +1,227 @@
+"""Edge Side Includes for the personalised regions of pages.
+
+Pages seen by authenticated users differ from user to user in a few regions
+only, such as the personal bar or user-specific portlets. If the
+``esiFragments`` setting names these regions, and the caching proxy
+announces that it processes Edge Side Includes (ESI) through the
+``Surrogate-Capability`` request header, they are rendered as ESI includes
+instead. The rest of the page, the shell, is then the same for many users,
+and is cached through the caching operations as usual. The proxy requests
+each fragment from the ``@@esi-fragment`` view, which has a ruleset, ETag
+and RAM cache entry of its own.
+
+A fragment is either a whole viewlet or portlet manager, e.g.
+``plone.rightcolumn``, or a single viewlet of a viewlet manager, e.g.
+``plone.portaltop/plone.personal_bar``. Managers are substituted through
+hooks installed into the viewlet and portlet manager classes when the
+process starts.
+"""
+
+from functools import wraps
+from html import escape
+from plone.app.caching.interfaces import IESIFragment
+from plone.registry.interfaces import IRegistry
+from Products.Five.viewlet.manager import ViewletManagerBase as FiveViewletManagerBase
+from urllib.parse import urlencode
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import queryUtility
+from zope.processlifetime import IProcessStarting
+from zope.viewlet.manager import ViewletManagerBase
+
+
+try:
+    from plone.app.viewletmanager.interfaces import IViewletManagementView
+    from plone.app.viewletmanager.manager import BaseOrderedViewletManager
+except ImportError:  # pragma: no cover
+    IViewletManagementView = BaseOrderedViewletManager = None
+
+try:
+    from plone.portlets.manager import PortletManagerRenderer
+except ImportError:  # pragma: no cover
+    PortletManagerRenderer = None
+
+
+ESI_FRAGMENTS_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.esiFragments"
+)
+
+# Request annotation for the fragments to render as ESI includes
+FRAGMENTS_ANNOTATION_KEY = "plone.app.caching.esi.fragments"
+
+# The view rendering the fragments
+FRAGMENT_VIEW = "esi-fragment"
+
+# The ruleset of fragments that are not in the page template mapping
+FRAGMENT_RULESET = "plone.content.fragment"
+
+
+def getConfiguredFragments():
+    """Return the names of the fragments in the ``esiFragments`` setting"""
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return frozenset()
+    return frozenset(registry.get(ESI_FRAGMENTS_RECORD, None) or ())
+
+
+def acceptsESI(request):
+    """Tell whether the caching proxy processes ESI in the response to the
+    given request
+    """
+    capability = request.getHeader("Surrogate-Capability", None) or ""
+    return "ESI/1.0" in capability
+
+
+def getFragments(request):
+    """Return the names of the fragments to render as ESI includes in the
+    response to the given request. This is empty if the caching proxy does
+    not process ESI, or when a fragment itself is rendered.
+    """
+
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return frozenset()
+
+    fragments = annotations.get(FRAGMENTS_ANNOTATION_KEY, None)
+    if fragments is None:
+        fragments = frozenset()
+        if acceptsESI(request):
+            fragments = getConfiguredFragments()
+        annotations[FRAGMENTS_ANNOTATION_KEY] = fragments
+    return fragments
+
+
+def isShell(published, request):
+    """Tell whether the given published object renders a page whose
+    personalised regions are ESI includes, rather than a fragment
+    """
+    if IESIFragment.providedBy(published):
+        return False
+    return bool(getFragments(request))
+
+
+def renderFragmentsInline(request):
+    """Render all fragments of the response to the given request in place"""
+    annotations = IAnnotations(request, None)
+    if annotations is not None:
+        annotations[FRAGMENTS_ANNOTATION_KEY] = frozenset()
+
+
+def getFragmentURL(context, name):
+    return "{}/@@{}?{}".format(
+        context.absolute_url(), FRAGMENT_VIEW, urlencode({"name": name})
+    )
+
+
+class ESIInclude:
+    """Stands in for a viewlet or manager that is rendered as an ESI
+    fragment
+    """
+
+    def __init__(self, context, request, fragment, name=None):
+        self.context = context
+        self.request = request
+        self.fragment = fragment
+        self.__name__ = name or fragment
+
+    def update(self):
+        pass
+
+    def render(self):
+        self.request.response.setHeader("Surrogate-Control", 'content="ESI/1.0"')
+        return '<esi:include src="{}" />'.format(
+            escape(getFragmentURL(self.context, self.fragment))
+        )
+
+
+def getProviderName(provider):
+    """Return the name of a viewlet manager or portlet manager renderer"""
+    manager = getattr(provider, "manager", None)
+    if manager is None:
+        manager = provider
+    return getattr(manager, "__name__", None)
+
+
+def isManaging(provider):
+    """Tell whether the given manager is rendered for managing viewlets"""
+    if IViewletManagementView is None:
+        return False
+    parent = getattr(provider, "__parent__", None)
+    while parent is not None:
+        if IViewletManagementView.providedBy(parent):
+            return True
+        parent = getattr(parent, "__parent__", None)
+    return False
+
+
+def substituteViewlets(manager, viewlets):
+    """Replace the viewlets of the given manager that are rendered as ESI
+    fragments. ``viewlets`` is a list of (name, viewlet) tuples.
+    """
+
+    fragments = getFragments(manager.request)
+    if not fragments or isManaging(manager):
+        return viewlets
+
+    prefix = getProviderName(manager) + "/"
+    result = []
+    for name, viewlet in viewlets:
+        fragment = prefix + name
+        if fragment in fragments:
+            viewlet = ESIInclude(manager.context, manager.request, fragment, name)
+        result.append((name, viewlet))
+    return result
+
+
+#
+# Hooks into the managers
+#
+
+
+def filterAndSubstitute(filter):
+    @wraps(filter)
+    def wrapper(self, viewlets):
+        return substituteViewlets(self, filter(self, viewlets))
+
+    return wrapper
+
+
+def updateOrSubstitute(update):
+    @wraps(update)
+    def wrapper(self):
+        name = getProviderName(self)
+        if name in getFragments(self.request) and not isManaging(self):
+            self.render = ESIInclude(self.context, self.request, name).render
+            return
+        return update(self)
+
+    return wrapper
+
+
+def installHook(class_, name, wrap):
+    method = class_.__dict__.get(name, None)
+    if method is None or getattr(method, "substitutesFragments", False):
+        return
+
+    wrapper = wrap(method)
+    wrapper.substitutesFragments = True
+    setattr(class_, name, wrapper)
+
+
+def installManagerHooks():
+    """Make viewlet and portlet managers render the configured fragments as
+    ESI includes
+    """
+
+    installHook(ViewletManagerBase, "filter", filterAndSubstitute)
+    installHook(ViewletManagerBase, "update", updateOrSubstitute)
+    installHook(FiveViewletManagerBase, "filter", filterAndSubstitute)
+    if BaseOrderedViewletManager is not None:
+        installHook(BaseOrderedViewletManager, "filter", filterAndSubstitute)
+    if PortletManagerRenderer is not None:
+        installHook(PortletManagerRenderer, "update", updateOrSubstitute)
+
+
+@adapter(IProcessStarting)
+def processStarting(event):
+    installManagerHooks()
@@ -0,0 +1,108 @@
+"""Process-wide cache of filesystem modification times.
+
+Filesystem-based skin objects (``FSObject``) re-check their file with an
+``os.stat()`` call on every access when Zope runs in debug mode. The
+``FSObjectLastModified`` adapter is called for every resource request, so
+this means one system call per hit. Instead, the watcher in this module keeps
+the modification times of all files it has seen in memory and refreshes them
+periodically from a background thread. Request threads only look at the
+cached value and re-read a file when its modification time has changed.
+"""
+
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger("plone.app.caching")
+
+# Number of seconds between two polls of the filesystem
+POLL_INTERVAL = 1.0
+
+
+class MTimeWatcher:
+    """Keeps the modification times of a set of files, refreshed by a
+    daemon thread polling the filesystem.
+
+    The thread is started lazily when the first file is watched.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self._mtimes = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def getMTime(self, filepath):
+        """Return the cached modification time of the given file.
+
+        Files that are not watched yet are stat'ed once and added to the set
+        of watched files. Missing files have a modification time of 0.0,
+        like in ``FSObject._updateFromFS()``.
+        """
+
+        mtime = self._mtimes.get(filepath, None)
+        if mtime is None:
+            mtime = self._mtimes[filepath] = self._stat(filepath)
+            self._start()
+        return mtime
+
+    def poll(self):
+        """Refresh the modification times of all watched files.
+
+        Returns the paths of the files that have changed.
+        """
+
+        changed = []
+        for filepath in list(self._mtimes):
+            mtime = self._stat(filepath)
+            if mtime != self._mtimes.get(filepath):
+                self._mtimes[filepath] = mtime
+                changed.append(filepath)
+        return changed
+
+    def clear(self):
+        self._mtimes.clear()
+
+    def stop(self):
+        """Stop the watcher thread, if it is running."""
+
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._stopped.set()
+
+        if thread is not None:
+            thread.join()
+
+    def _start(self):
+        if self._thread is not None or self.interval is None:
+            return
+
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name="plone.app.caching mtime watcher",
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Error polling filesystem modification times")
+
+    def _stat(self, filepath):
+        try:
+            return os.stat(filepath).st_mtime
+        except Exception:
+            return 0.0
+
+
+watcher = MTimeWatcher()
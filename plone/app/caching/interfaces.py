@@ -63,7 +63,12 @@ class IPloneCacheSettings(Interface):
 
     cacheStopRequestVariables = schema.Tuple(
         title=_("Request variables that prevent caching"),
-        description=_("Variables in the request that prevent caching if present"),
+        description=_(
+            "Variables in the request that prevent caching if present. "
+            "End a name with '*' to match all form variables and cookies "
+            "starting with it, or start it with 're:' to give a regular "
+            "expression."
+        ),
         value_type=schema.ASCIILine(title=_("Request variables")),
         default=(
             "statusmessages",
@@ -71,6 +76,135 @@ class IPloneCacheSettings(Interface):
         ),
     )
 
+    sectionCounterDepth = schema.Int(
+        title=_("Section counter depth"),
+        description=_(
+            "Number of path elements below the site root that make up a "
+            "section for the 'sectionCounter' ETag component"
+        ),
+        default=1,
+        min=1,
+    )
+
+    rewarmContentTypes = schema.Tuple(
+        title=_("Content types to re-warm"),
+        description=_(
+            "List content types whose pages should be requested again after "
+            "they have been purged, so that the next visitor gets a cached "
+            "page. The types must be purged as well."
+        ),
+        value_type=schema.ASCIILine(title=_("Content type name")),
+        default=(),
+        missing_value=(),
+        required=False,
+    )
+
+    rewarmDelay = schema.Int(
+        title=_("Re-warm delay"),
+        description=_(
+            "Number of seconds to wait after a purge before requesting the "
+            "purged pages again. Not used for purges sent through the purge "
+            "outbox, which requests the pages once their purge succeeded."
+        ),
+        default=2,
+        min=0,
+    )
+
+    purgeDebounceWindow = schema.Int(
+        title=_("Purge debounce window"),
+        description=_(
+            "Number of seconds to wait for further changes before purging a "
+            "URL from the caching proxies. Repeated purges of the same URL "
+            "within this window are sent as one. Set to 0 to purge at the "
+            "end of every request."
+        ),
+        default=0,
+        min=0,
+    )
+
+    purgeDebounceMaxDelay = schema.Int(
+        title=_("Maximum purge delay"),
+        description=_(
+            "Maximum number of seconds a purge can be delayed by repeated "
+            "changes within the debounce window"
+        ),
+        default=60,
+        min=0,
+    )
+
+    purgeBanThreshold = schema.Int(
+        title=_("Purge ban threshold"),
+        description=_(
+            "Maximum number of purge requests sent to the caching proxies "
+            "for the changes of a single request. Above this, the purges of "
+            "each moved or renamed item are replaced by one BAN request per "
+            "caching proxy, which must support them. Set to 0 to always purge "
+            "individual URLs."
+        ),
+        default=0,
+        min=0,
+    )
+
+    ramCacheAdmissionThreshold = schema.Int(
+        title=_("RAM cache admission threshold"),
+        description=_(
+            "Minimum number of recent requests for a page before it is "
+            "stored in the RAM cache. Set to 2 or more to keep pages that "
+            "are requested only once, e.g. by crawlers, out of the cache. "
+            "Set to 0 or 1 to store every page."
+        ),
+        default=1,
+        min=0,
+    )
+
+    ramCacheCostThreshold = schema.Float(
+        title=_("RAM cache render cost threshold"),
+        description=_(
+            "Views that take at least this many milliseconds to render per "
+            "kilobyte of output, on average, are cached in RAM even if their "
+            "ruleset does not turn on RAM caching, provided that it uses "
+            "ETags or Last-Modified validation. Set to 0 to disable."
+        ),
+        default=0.0,
+        min=0.0,
+    )
+
+    trackDependencies = schema.Bool(
+        title=_("Track dependencies"),
+        description=_(
+            "Record which content is shown by each cacheable page while it "
+            "is rendered, so that the page is evicted from the RAM cache and "
+            "purged from the caching proxies when any of that content is "
+            "changed."
+        ),
+        default=False,
+        required=False,
+    )
+
+    refreshAheadSize = schema.Int(
+        title=_("Number of pages to refresh ahead"),
+        description=_(
+            "Number of pages per ruleset, among those most often served "
+            "from the RAM cache, to request again after content has been "
+            "changed. Set to 0 to disable."
+        ),
+        default=0,
+        min=0,
+    )
+
+    esiFragments = schema.Tuple(
+        title=_("ESI fragments"),
+        description=_(
+            "Personalised regions of pages to render as Edge Side Includes "
+            "when the caching proxy supports them. Give the name of a "
+            "viewlet or portlet manager, or the name of a viewlet manager "
+            "and of one of its viewlets, separated by '/'."
+        ),
+        value_type=schema.ASCIILine(title=_("Fragment name")),
+        default=(),
+        required=False,
+    )
+
 
 class IETagValue(Interface):
     """ETag component builder
@@ -85,6 +219,34 @@ class IETagValue(Interface):
         """Return the ETag component, as a string."""
 
 
+class IRequestClassifier(Interface):
+    """Early decision on whether a request can be cached
+
+    A multi-adapter from ``(published, request)`` to this interface is
+    consulted by the caching operations before any ETag or Last-Modified
+    value is calculated, so that requests which can never be served from a
+    cache or revalidated do not pay for them. Register a more specific
+    adapter (e.g. for a browser layer) to change the decision.
+    """
+
+    def __call__(rulename, anonOnly=False):
+        """Classify the request for the given ruleset.
+
+        ``anonOnly`` is the ``anonOnly`` option of the caching operation.
+
+        Return one of the constants in ``plone.app.caching.operations.
+        classifier``: ``CACHEABLE``, ``STOP`` (the request has cache stop
+        request variables or a method other than GET) or ``PRIVATE`` (the
+        response is specific to the current user).
+        """
+
+
+class IESIFragment(Interface):
+    """Marker interface for views that render a fragment of a page, which
+    the caching proxy includes through Edge Side Includes.
+    """
+
+
 class IRAMCached(Interface):
     """Marker interface applied to the request if it should be RAM cached.
 
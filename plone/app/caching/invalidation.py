@@ -0,0 +1,409 @@
+"""Cluster-wide targeted invalidation of the page RAM cache.
+
+Every Zope process has its own RAM cache. Most pages are keyed by ETags that
+change along with the content, but pages whose ETags do not capture every
+change would be served from the other processes until they expire.
+
+Therefore, the physical paths of changed content are appended to a small
+invalidation log, stored in the annotations of the site when the
+transaction is committed. ZODB invalidations carry the new entries to all
+other ZEO or RelStorage clients. Before looking up a page in the RAM cache,
+every process reads the entries it has not seen yet, and evicts the pages
+it cached for the given paths, which it keeps track of when it stores them.
+
+Entries are kept for at least ``RETENTION`` seconds. Entries timestamped
+up to ``CLOCK_SKEW`` seconds before the last one seen are read again, to
+allow for clocks that are not in sync and transactions that take time to
+commit.
+
+Entries for a path starting with ``UID_PREFIX`` evict the pages that show
+the content with that UID, see ``plone.app.caching.dependencies``. If the
+content is shown on more than ``MAX_PAGES_PER_UID`` pages, all pages are
+evicted.
+
+Pages that were stored before the process was started, i.e. preloaded from a
+snapshot or copied from the disk tier, are not tracked, and are only
+invalidated through their ETags.
+"""
+
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from collections import OrderedDict
+from plone.app.caching.diskcache import getDiskCache
+from plone.app.caching.diskcache import getDiskCacheKey
+from plone.memoize.interfaces import ICacheChooser
+from Products.CMFCore.interfaces import IActionSucceededEvent
+from Products.CMFCore.interfaces import IContentish
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import queryUtility
+from zope.component.hooks import getSite
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
+from zope.ramcache.interfaces.ram import IRAMCache
+
+import threading
+import time
+import transaction
+import uuid
+
+
+INVALIDATIONS_KEY = "plone.app.caching.invalidations"
+INVALIDATIONS_COUNT_KEY = "plone.app.caching.invalidations.count"
+
+# Number of seconds invalidation log entries are kept
+RETENTION = 3600
+
+# Number of seconds to look back for entries committed late
+CLOCK_SKEW = 60
+
+# Maximum number of paths for which cached pages are tracked
+MAX_PATHS = 10000
+
+# Maximum number of pages tracked for the content with a given UID. When
+# content shown on more pages, e.g. in the navigation, changes, the whole
+# RAM cache is evicted.
+MAX_PAGES_PER_UID = 100
+
+# Prefix of the invalidation log entries for the pages that depend on the
+# content with a given UID
+UID_PREFIX = "uid:"
+
+
+class CachedPages:
+    """Keeps track of the RAM cache entries stored for each physical path.
+
+    When more than ``maxPaths`` paths are tracked, the paths that were
+    stored least recently are forgotten. If ``maxKeys`` is given, further
+    entries for a path that already has that many are not tracked, and the
+    path is marked as incomplete instead.
+    """
+
+    def __init__(self, maxPaths=MAX_PATHS, maxKeys=None):
+        self.maxPaths = maxPaths
+        self.maxKeys = maxKeys
+        self._paths = OrderedDict()
+        self._incomplete = set()
+        self._lock = threading.Lock()
+
+    def record(self, path, globalKey, key):
+        """Track a RAM cache entry for the given path. The entries of the
+        paths that are forgotten to make room are evicted, since they could
+        not be invalidated any more.
+        """
+
+        forgotten = set()
+        incomplete = False
+        with self._lock:
+            keys = self._paths.pop(path, None) or set()
+            if self.maxKeys is None or len(keys) < self.maxKeys:
+                keys.add((globalKey, key))
+            elif (globalKey, key) not in keys:
+                self._incomplete.add(path)
+            self._paths[path] = keys
+            while len(self._paths) > self.maxPaths:
+                oldest, oldestKeys = self._paths.popitem(last=False)
+                forgotten.update(oldestKeys)
+                if oldest in self._incomplete:
+                    self._incomplete.discard(oldest)
+                    incomplete = True
+
+        if incomplete:
+            evictAll()
+            return
+        for forgottenGlobalKey, forgottenKey in forgotten:
+            evictCachedPage(forgottenGlobalKey, forgottenKey)
+
+    def isComplete(self, path):
+        """Tell whether all pages stored for the given path are tracked"""
+        with self._lock:
+            return path not in self._incomplete
+
+    def pop(self, path, recursive=False):
+        """Forget the given path, and return the ``(globalKey, key)`` pairs
+        of the pages cached for it. If ``recursive`` is True, this includes
+        the pages cached for all paths below it.
+        """
+
+        with self._lock:
+            paths = [path]
+            if recursive:
+                prefix = path.rstrip("/") + "/"
+                paths += [p for p in self._paths if p.startswith(prefix)]
+
+            keys = set()
+            for p in paths:
+                keys.update(self._paths.pop(p, ()))
+                self._incomplete.discard(p)
+            return keys
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+            self._incomplete.clear()
+
+
+cachedPages = CachedPages()
+
+# The RAM cache entries stored for pages that show the content with a given
+# UID, tracked under ``UID_PREFIX`` + UID
+dependentPages = CachedPages(maxKeys=MAX_PAGES_PER_UID)
+
+
+def recordCachedPage(path, globalKey, key):
+    """Record that the page with the given RAM cache key belongs to the
+    content at the given physical path.
+    """
+
+    if path:
+        cachedPages.record(path, globalKey, key)
+
+
+def evictCachedPage(globalKey, key):
+    """Remove a page from the RAM cache and the disk tier, if any"""
+
+    chooser = queryUtility(ICacheChooser)
+    if chooser is not None:
+        cache = chooser(globalKey)
+        ramcache = getattr(cache, "ramcache", None)
+        makeKey = getattr(cache, "_make_key", None)
+        if ramcache is not None and makeKey is not None:
+            # plone.memoize's RAMCacheAdapter stores values by key hash
+            ramcache.invalidate(cache.globalkey, dict(key=makeKey(key)))
+        elif cache is not None:
+            cache.pop(key, None)
+
+    diskCache = getDiskCache()
+    if diskCache is not None:
+        diskCache.discard(getDiskCacheKey(globalKey, key))
+
+
+def evictAll():
+    """Remove all pages from the RAM cache and the disk tier, if any"""
+
+    ramCache = queryUtility(IRAMCache)
+    if ramCache is not None:
+        ramCache.invalidateAll()
+
+    diskCache = getDiskCache()
+    if diskCache is not None:
+        diskCache.clear()
+
+    cachedPages.clear()
+    dependentPages.clear()
+
+
+#
+# The persistent invalidation log
+#
+
+
+def getInvalidationLog(site=None, create=False):
+    """Get the invalidation log of the given site (by default, the current
+    site) and the counter of log entries, or ``(None, None)`` if there is no
+    log.
+
+    The log maps ``(timestamp, unique id)`` keys to a tuple of
+    ``(path, recursive)`` pairs. Since keys are unique, concurrent additions
+    to the log do not conflict.
+
+    If ``create`` is True, the log will be created if necessary.
+    """
+
+    if site is None:
+        site = getSite()
+    if site is None:
+        return None, None
+
+    annotations = IAnnotations(site, None)
+    if annotations is None:
+        return None, None
+
+    log = annotations.get(INVALIDATIONS_KEY, None)
+    if log is None:
+        if not create:
+            return None, None
+        log = annotations[INVALIDATIONS_KEY] = OOBTree()
+        annotations[INVALIDATIONS_COUNT_KEY] = Length()
+
+    return log, annotations[INVALIDATIONS_COUNT_KEY]
+
+
+def logInvalidation(paths, site=None):
+    """Add an entry for the given ``(path, recursive)`` pairs to the
+    invalidation log.
+    """
+
+    log, count = getInvalidationLog(site, create=True)
+    if log is None:
+        return
+
+    now = time.time()
+    log[(now, uuid.uuid4().hex)] = tuple(paths)
+    count.change(1)
+
+    # Drop old entries, but only about once per ``RETENTION`` seconds:
+    # deleting them changes the first buckets of the log, so that other
+    # transactions doing the same at the same time conflict.
+    if log.minKey()[0] < now - 2 * RETENTION:
+        for key in list(log.keys(max=(now - RETENTION,))):
+            del log[key]
+
+
+class _PendingInvalidations:
+    """Key for the paths to invalidate when the current transaction is
+    committed
+    """
+
+
+_pendingKey = _PendingInvalidations()
+
+
+def invalidateOnCommit(paths):
+    """Add the given ``(path, recursive)`` pairs to the entry written to
+    the invalidation log when the current transaction is committed, so that
+    all changes of a transaction end up in a single entry.
+    """
+
+    site = getSite()
+    if site is None:
+        return
+
+    txn = transaction.get()
+    try:
+        pending = txn.data(_pendingKey)
+    except KeyError:
+        pending = {}
+        txn.set_data(_pendingKey, pending)
+        txn.addBeforeCommitHook(_logPendingInvalidations, (txn, site))
+
+    for path, recursive in paths:
+        pending[path] = pending.get(path, False) or recursive
+
+
+def _logPendingInvalidations(txn, site):
+    pending = txn.data(_pendingKey)
+    if pending:
+        logInvalidation(sorted(pending.items()), site)
+
+
+#
+# Reading the log
+#
+
+
+class _ProcessState:
+    """What this process has read from the invalidation log of a site"""
+
+    def __init__(self, count):
+        self.count = count
+        self.lastSeen = time.time()
+        self.seen = {}
+
+
+_processStates = {}
+_processStatesLock = threading.Lock()
+
+
+def applyInvalidations(site=None):
+    """Evict the pages invalidated by log entries this process has not seen
+    yet. The first time a site is seen, older entries are ignored.
+    """
+
+    if site is None:
+        site = getSite()
+    if site is None:
+        return
+
+    log, count = getInvalidationLog(site)
+    if log is None:
+        return
+
+    sitePath = "/".join(site.getPhysicalPath())
+    currentCount = count()
+
+    with _processStatesLock:
+        state = _processStates.get(sitePath)
+        if state is None:
+            _processStates[sitePath] = _ProcessState(currentCount)
+            return
+        if state.count == currentCount:
+            return
+        state.count = currentCount
+
+        evictions = []
+        for key, paths in log.items(min=(state.lastSeen - CLOCK_SKEW,)):
+            if key in state.seen:
+                continue
+            state.seen[key] = True
+            state.lastSeen = max(state.lastSeen, key[0])
+            evictions.append(paths)
+
+        state.seen = {
+            key: True
+            for key in state.seen
+            if key[0] >= state.lastSeen - CLOCK_SKEW
+        }
+
+    for paths in evictions:
+        for path, recursive in paths:
+            if path.startswith(UID_PREFIX):
+                if not dependentPages.isComplete(path):
+                    # The content is shown on more pages than are tracked
+                    evictAll()
+                    break
+                keys = dependentPages.pop(path)
+            else:
+                keys = cachedPages.pop(path, recursive)
+            for globalKey, key in keys:
+                evictCachedPage(globalKey, key)
+
+
+#
+# Event handlers
+#
+
+
+def getPath(object):
+    return "/".join(object.getPhysicalPath())
+
+
+def getParentPath(object):
+    parent = getattr(object, "__parent__", None)
+    if parent is None or not hasattr(parent, "getPhysicalPath"):
+        return None
+    return getPath(parent)
+
+
+def invalidateContent(object):
+    # The pages of the item and everything below it (which shows it in the
+    # breadcrumbs and navigation), and the listing of its parent
+    paths = [(getPath(object), True)]
+    parentPath = getParentPath(object)
+    if parentPath is not None:
+        paths.append((parentPath, False))
+    invalidateOnCommit(paths)
+
+
+@adapter(IContentish, IObjectModifiedEvent)
+def contentModified(object, event):
+    invalidateContent(object)
+
+
+@adapter(IContentish, IActionSucceededEvent)
+def contentTransitioned(object, event):
+    invalidateContent(object)
+
+
+@adapter(IContentish, IObjectMovedEvent)
+def contentMoved(object, event):
+    # Covers additions and removals as well
+    paths = []
+    if event.oldParent is not None:
+        oldParentPath = getPath(event.oldParent)
+        paths.append((oldParentPath + "/" + event.oldName, True))
+        paths.append((oldParentPath, False))
+    if event.newParent is not None:
+        paths.append((getPath(event.newParent), False))
+    if paths:
+        invalidateOnCommit(paths)
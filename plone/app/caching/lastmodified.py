@@ -1,17 +1,31 @@
 from Acquisition import aq_base
+from Acquisition import aq_inner
+from Acquisition import aq_parent
+from App.config import getConfiguration
 from datetime import datetime
 from dateutil.tz import tzlocal
 from OFS.Image import File
+from persistent import Persistent
+from plone.app.caching.fsmtime import watcher
+from plone.dexterity.interfaces import IDexterityContainer
 from Products.CMFCore.FSObject import FSObject
 from Products.CMFCore.FSPageTemplate import FSPageTemplate
+from Products.CMFCore.interfaces import IActionSucceededEvent
 from Products.CMFCore.interfaces import ICatalogableDublinCore
+from Products.CMFCore.interfaces import IContentish
 from z3c.caching.interfaces import ILastModified
+from zope.annotation.interfaces import IAnnotations
 from zope.browserresource.interfaces import IResource
 from zope.component import adapter
+from zope.container.interfaces import IContainerModifiedEvent
 from zope.interface import implementer
 from zope.interface import Interface
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from zope.pagetemplate.interfaces import IPageTemplate
 
+import time
+
 
 try:
     from zope.dublincore.interfaces import IDCTimes
@@ -21,6 +35,9 @@ except ImportError:
         pass
 
 
+CHILDREN_MODIFIED_KEY = "plone.app.caching.lastmodified.childrenModified"
+
+
 @implementer(ILastModified)
 @adapter(IPageTemplate)
 def PageTemplateDelegateLastModified(template):
@@ -75,8 +92,17 @@ class FSObjectLastModified:
         self.context = context
 
     def __call__(self):
-        # Update from filesystem if we are in debug mode (only)
-        self.context._updateFromFS()
+        # Update from filesystem if we are in debug mode (only). Rather than
+        # letting the object stat its file on each request, we only ask it to
+        # update when the background watcher has seen the file change.
+        context = self.context
+        filepath = getattr(context, "_filepath", None)
+        if filepath is not None and getConfiguration().debug_mode:
+            mtime = watcher.getMTime(filepath)
+            if not context._parsed or mtime != context._file_mod_time:
+                context._updateFromFS()
+        else:
+            context._updateFromFS()
         # we do this instead of getModTime() to avoid having to convert from
         # a DateTime
         mtime = self.context._file_mod_time
@@ -100,6 +126,41 @@ class CatalogableDublinCoreLastModified:
         return modified.asdatetime()
 
 
+@adapter(IDexterityContainer)
+class ContainerLastModified(CatalogableDublinCoreLastModified):
+    """ILastModified adapter for Dexterity containers. Returns the newer of
+    the container's own modification date and the last time one of its direct
+    children was added, modified, transitioned, moved or removed.
+
+    The latter is maintained incrementally by the ``childModified``,
+    ``childTransitioned`` and ``childMoved`` event handlers, so that the
+    children never have to be woken up to compute it.
+    """
+
+    def __call__(self):
+        modified = super().__call__()
+
+        annotations = IAnnotations(self.context, None)
+        if annotations is None:
+            return modified
+
+        timestamp = getTimestamp(annotations.get(CHILDREN_MODIFIED_KEY, None))
+        if timestamp is None:
+            return modified
+
+        childrenModified = datetime.fromtimestamp(timestamp, tzlocal())
+        if modified is None:
+            return childrenModified
+
+        # Naive dates are assumed to be local time, as in getLastModified()
+        if modified.tzinfo is None:
+            if childrenModified > modified.replace(tzinfo=tzlocal()):
+                return childrenModified
+        elif childrenModified > modified:
+            return childrenModified
+        return modified
+
+
 @implementer(ILastModified)
 @adapter(IDCTimes)
 class DCTimesLastModified:
@@ -124,3 +185,76 @@ class ResourceLastModified:
         lmt = getattr(self.context.context, "lmt", None)
         if lmt is not None:
             return datetime.fromtimestamp(lmt, tzlocal())
+
+
+class Timestamp(Persistent):
+    """A timestamp that only moves forward. Concurrent changes are resolved
+    to the latest one instead of raising a ``ConflictError``.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def _p_resolveConflict(self, oldState, savedState, newState):
+        state = dict(newState)
+        state["value"] = max(savedState["value"], newState["value"])
+        return state
+
+
+def getTimestamp(value):
+    """Return the time stored as a ``Timestamp``, or as a plain number by
+    earlier versions
+    """
+    return getattr(value, "value", value)
+
+
+def touchContainer(container, now=None):
+    """Record that a direct child of ``container`` has changed.
+
+    The value is only written if it moved on to a later second, which is
+    the resolution of the ``Last-Modified`` header, to avoid writing the
+    container's annotations over and over during batch edits. It is stored
+    in a ``Timestamp`` of its own, so that changes to several children in
+    concurrent transactions do not conflict.
+    """
+
+    if not IDexterityContainer.providedBy(container):
+        return
+
+    annotations = IAnnotations(container, None)
+    if annotations is None:
+        return
+
+    if now is None:
+        now = time.time()
+    stored = annotations.get(CHILDREN_MODIFIED_KEY, None)
+    if int(now) <= int(getTimestamp(stored) or 0):
+        return
+    if isinstance(stored, Timestamp):
+        stored.value = now
+    else:
+        annotations[CHILDREN_MODIFIED_KEY] = Timestamp(now)
+
+
+@adapter(IContentish, IObjectModifiedEvent)
+def childModified(object, event):
+    # The container itself is notified when items are added or removed,
+    # which is handled in childMoved() below
+    if IContainerModifiedEvent.providedBy(event):
+        return
+    touchContainer(aq_parent(aq_inner(object)))
+
+
+@adapter(IContentish, IActionSucceededEvent)
+def childTransitioned(object, event):
+    # Publishing or retracting an item changes the listings of its container
+    touchContainer(aq_parent(aq_inner(object)))
+
+
+@adapter(IContentish, IObjectMovedEvent)
+def childMoved(object, event):
+    # Covers additions and removals as well
+    if event.oldParent is not None:
+        touchContainer(event.oldParent)
+    if event.newParent is not None and event.newParent is not event.oldParent:
+        touchContainer(event.newParent)
@@ -1,4 +1,5 @@
 from Acquisition import aq_base
+from plone.app.caching.esi import FRAGMENT_RULESET
 from plone.app.caching.interfaces import IPloneCacheSettings
 from plone.app.caching.utils import getObjectDefaultView
 from plone.caching.interfaces import IRulesetLookup
@@ -111,3 +112,30 @@ class ContentItemLookup:
         ruleset = lookup(parent)
         if ruleset is not None:
             return ruleset
+
+
+@implementer(IRulesetLookup)
+class FragmentLookup:
+    """Lookup for the ESI fragments of pages (see ``plone.app.caching.esi``).
+
+    The name of the fragment is looked up in the page template mapping, so
+    that each fragment can be cached differently. Other fragments use the
+    ``plone.content.fragment`` ruleset.
+    """
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def __call__(self):
+        name = self.published.fragmentName
+        registry = queryUtility(IRegistry)
+        if name and registry is not None:
+            ploneCacheSettings = registry.forInterface(IPloneCacheSettings, check=False)
+            ruleset = (
+                ploneCacheSettings.templateRulesetMapping
+                and ploneCacheSettings.templateRulesetMapping.get(name, None)
+            ) or None
+            if ruleset is not None:
+                return ruleset
+        return FRAGMENT_RULESET
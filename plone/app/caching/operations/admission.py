@@ -0,0 +1,109 @@
+"""Frequency based admission to the page RAM cache.
+
+Crawlers and link checkers request lots of pages exactly once. If all of them
+were stored in the RAM cache, they would push out the pages that real
+visitors request over and over. Instead, the number of recent requests for
+each page is estimated with a count-min sketch, and a page is only stored if
+it was requested at least ``ramCacheAdmissionThreshold`` times (in the spirit
+of TinyLFU).
+
+The sketch uses a few small arrays of saturating counters, so its size does
+not depend on the number of pages. All counters are halved periodically, so
+that the estimates reflect recent traffic.
+"""
+
+from plone.registry.interfaces import IRegistry
+from zope.component import queryUtility
+
+import threading
+
+
+ADMISSION_THRESHOLD_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.ramCacheAdmissionThreshold"
+)
+
+SKETCH_WIDTH = 8192
+SKETCH_DEPTH = 4
+MAX_COUNT = 15
+
+
+class CountMinSketch:
+    """Estimates how often keys have been seen recently.
+
+    Estimates are never lower than the real count (up to ``MAX_COUNT``), but
+    may be higher because of hash collisions. After ``sampleSize``
+    increments, all counters are halved.
+    """
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH, sampleSize=None):
+        self.width = width
+        self.depth = depth
+        self.sampleSize = sampleSize or 10 * width
+        self._rows = [bytearray(width) for i in range(depth)]
+        self._additions = 0
+        self._lock = threading.Lock()
+
+    def increment(self, key):
+        """Count the key, and return its new estimated count"""
+
+        with self._lock:
+            estimate = MAX_COUNT
+            for row, index in self._indexes(key):
+                count = row[index]
+                if count < MAX_COUNT:
+                    count += 1
+                    row[index] = count
+                estimate = min(estimate, count)
+
+            self._additions += 1
+            if self._additions >= self.sampleSize:
+                self._age()
+            return estimate
+
+    def estimate(self, key):
+        return min(row[index] for row, index in self._indexes(key))
+
+    def clear(self):
+        with self._lock:
+            for row in self._rows:
+                row[:] = bytes(self.width)
+            self._additions = 0
+
+    def _indexes(self, key):
+        for seed, row in enumerate(self._rows):
+            yield row, hash((seed, key)) % self.width
+
+    def _age(self):
+        for row in self._rows:
+            row[:] = bytes(count >> 1 for count in row)
+        self._additions //= 2
+
+
+sketch = CountMinSketch()
+
+
+def getAdmissionThreshold():
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return 0
+    return registry.get(ADMISSION_THRESHOLD_RECORD, None) or 0
+
+
+def recordRequest(key):
+    """Count a request for the page with the given key. The key should not
+    depend on the version of the page, e.g. its ETag.
+    """
+
+    if getAdmissionThreshold() > 1:
+        sketch.increment(key)
+
+
+def admit(key):
+    """Tell whether the page with the given key should be stored in the RAM
+    cache.
+    """
+
+    threshold = getAdmissionThreshold()
+    if threshold <= 1:
+        return True
+    return sketch.estimate(key) >= threshold
@@ -0,0 +1,73 @@
+from plone.app.caching.interfaces import IRequestClassifier
+from plone.app.caching.operations.utils import cacheStop
+from plone.app.caching.operations.utils import getCachingContext
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import queryMultiAdapter
+from zope.interface import implementer
+from zope.interface import Interface
+
+
+CLASSIFICATION_ANNOTATION_KEY = "plone.app.caching.operations.classification"
+
+# The response may be cached and conditional requests may be answered
+CACHEABLE = "cacheable"
+
+# The request must not be served from or stored in a cache, e.g. because of a
+# POST request or a cache stop request variable
+STOP = "stop"
+
+# The response is specific to the current user, who is not anonymous, and
+# the ruleset is configured for anonymous users only
+PRIVATE = "private"
+
+
+@implementer(IRequestClassifier)
+@adapter(Interface, Interface)
+class RequestClassifier:
+    """Default request classifier, combining the request method, the cache
+    stop request variables and the authentication state.
+    """
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def __call__(self, rulename, anonOnly=False):
+        if cacheStop(self.request, rulename):
+            return STOP
+
+        if anonOnly:
+            if not getCachingContext(self.published, self.request).anonymous:
+                return PRIVATE
+
+        return CACHEABLE
+
+
+def classifyRequest(published, request, rulename, anonOnly=False):
+    """Classify the request using the ``IRequestClassifier`` adapter.
+
+    The result is stored in the request annotations, so that the decision is
+    only made once for both ``interceptResponse()`` and ``modifyResponse()``.
+    Returns ``CACHEABLE`` if no classifier can be found.
+    """
+
+    annotations = IAnnotations(request, None)
+    key = (rulename, bool(anonOnly))
+
+    classifications = None
+    if annotations is not None:
+        classifications = annotations.setdefault(CLASSIFICATION_ANNOTATION_KEY, {})
+        if key in classifications:
+            return classifications[key]
+
+    classifier = queryMultiAdapter((published, request), IRequestClassifier)
+    if classifier is None:
+        classification = CACHEABLE
+    else:
+        classification = classifier(rulename, anonOnly=anonOnly)
+
+    if classifications is not None:
+        classifications[key] = classification
+
+    return classification
@@ -1,22 +1,34 @@
+from plone.app.caching.dependencies import isTrackingEnabled
+from plone.app.caching.dependencies import startTracking
+from plone.app.caching.esi import isShell
 from plone.app.caching.interfaces import _
+from plone.app.caching.operations.classifier import CACHEABLE
+from plone.app.caching.operations.classifier import classifyRequest
+from plone.app.caching.operations.classifier import STOP
+from plone.app.caching.operations.rendercost import isExpensive
+from plone.app.caching.operations.rendercost import markRenderStart
+from plone.app.caching.operations.rendercost import RENDER_START_ANNOTATION_KEY
 from plone.app.caching.operations.utils import cachedResponse
+from plone.app.caching.operations.utils import cacheInProxy
 from plone.app.caching.operations.utils import cacheInRAM
-from plone.app.caching.operations.utils import cacheStop
 from plone.app.caching.operations.utils import doNotCache
 from plone.app.caching.operations.utils import fetchFromRAMCache
-from plone.app.caching.operations.utils import getContext
+from plone.app.caching.operations.utils import getCachingContext
 from plone.app.caching.operations.utils import getETagAnnotation
 from plone.app.caching.operations.utils import getLastModifiedAnnotation
 from plone.app.caching.operations.utils import isModified
+from plone.app.caching.operations.utils import NOT_FOUND_STATUSES
 from plone.app.caching.operations.utils import notModified
 from plone.app.caching.operations.utils import parseDateTime
+from plone.app.caching.operations.utils import REDIRECT_STATUSES
 from plone.app.caching.operations.utils import setCacheHeaders
 from plone.app.caching.operations.utils import visibleToRole
+from plone.app.caching.refresh import recordHit
 from plone.caching.interfaces import ICachingOperation
 from plone.caching.interfaces import ICachingOperationType
 from plone.caching.utils import lookupOptions
+from zope.annotation.interfaces import IAnnotations
 from zope.component import adapter
-from zope.component import getMultiAdapter
 from zope.interface import implementer
 from zope.interface import Interface
 from zope.interface import provider
@@ -55,9 +67,20 @@ class BaseCaching:
         is a boolean indicating whether to turn on RAM caching for this item.
         Etags are only required if the URL is not specific enough to ensure
         uniqueness.
+        Views that are expensive to render are cached in RAM even if this is
+        not set, see ``ramCacheCostThreshold``.
 
     ``vary``
         is a string to add as a Vary header value in the response.
+
+    ``redirectTTL``
+        is the time, in seconds, to cache redirect responses for anonymous
+        users in the caching proxy and, if ``ramCache`` is set, in RAM. If 0,
+        redirects are not cached at all. If not set, redirects are treated
+        like any other response.
+
+    ``notFoundTTL``
+        is the same as ``redirectTTL``, for 404 and 410 responses.
     """
 
     title = _("Generic caching")
@@ -77,17 +100,21 @@ class BaseCaching:
         "ramCache",
         "vary",
         "anonOnly",
+        "redirectTTL",
+        "notFoundTTL",
     )
 
     # Default option values
     maxage = smaxage = etags = vary = None
     lastModified = ramCache = anonOnly = False
+    redirectTTL = notFoundTTL = None
 
     def __init__(self, published, request):
         self.published = published
         self.request = request
 
     def interceptResponse(self, rulename, response, class_=None):
+        markRenderStart(self.request)
         options = lookupOptions(class_ or self.__class__, rulename)
 
         etags = options.get("etags") or self.etags
@@ -95,12 +122,27 @@ class BaseCaching:
         ramCache = options.get("ramCache", self.ramCache)
         lastModified = options.get("lastModified", self.lastModified)
 
+        # Views that are expensive to render are cached in RAM automatically,
+        # provided that the ETag or Last-Modified date tells versions apart
+        if not ramCache and (etags or lastModified):
+            ramCache = self.cacheExpensiveInRAM()
+
         # Add the ``anonymousOrRandom`` etag if we are anonymous only
         if anonOnly:
             if etags is None:
                 etags = ["anonymousOrRandom"]
             elif "anonymousOrRandom" not in etags:
                 etags = tuple(etags) + ("anonymousOrRandom",)
+        etags = self.getShellETags(etags)
+
+        # Decide whether the request can be cached at all before calculating
+        # any validators. They are then only needed to evaluate If-Range.
+        classification = classifyRequest(
+            self.published, self.request, rulename, anonOnly=anonOnly
+        )
+        cacheable = classification == CACHEABLE and (etags or lastModified or ramCache)
+        if not cacheable and "HTTP_IF_RANGE" not in self.request.environ:
+            return None
 
         etag = getETagAnnotation(self.published, self.request, keys=etags)
         lastModified = getLastModifiedAnnotation(
@@ -122,8 +164,7 @@ class BaseCaching:
             # If-Range check is done here so we could remove it from the request
             del self.request.environ["HTTP_IF_RANGE"]
 
-        # Check for cache stop request variables
-        if cacheStop(self.request, rulename):
+        if not cacheable:
             return None
 
         # Check if this should be a 304 response
@@ -138,22 +179,58 @@ class BaseCaching:
 
         # Check if this is in the ram cache
         if ramCache:
-            context = getContext(self.published)
-            portal_state = getMultiAdapter(
-                (context, self.request), name="plone_portal_state"
-            )
+            cachingContext = getCachingContext(self.published, self.request)
 
-            if portal_state.anonymous():
+            if cachingContext.anonymous:
                 cached = fetchFromRAMCache(
                     self.request, etag=etag, lastModified=lastModified
                 )
                 if cached is not None:
+                    recordHit(self.request, rulename)
+                    IAnnotations(self.request).pop(RENDER_START_ANNOTATION_KEY, None)
                     return cachedResponse(
                         self.published, self.request, response, *cached
                     )
 
+        # The page is rendered: record the content it shows, if configured
+        if isTrackingEnabled():
+            cachingContext = getCachingContext(self.published, self.request)
+            startTracking(self.request, cachingContext.context)
+
         return None
 
+    def getShellETags(self, etags):
+        """Drop the ``userid`` component from the given ETag components if
+        the personalised regions of the page are rendered as ESI fragments.
+        The rest of the page, the shell, can then be shared between users,
+        while the fragments are cached per user through their own ruleset.
+        """
+
+        if etags and "userid" in etags and isShell(self.published, self.request):
+            etags = tuple(name for name in etags if name != "userid")
+        return etags
+
+    def cacheExpensiveInRAM(self, response=None):
+        """Tell whether the response should be cached in RAM because the
+        published view is expensive to render, although the ruleset does not
+        turn on RAM caching. The ETags of such rulesets need not tell users
+        apart, so only responses for anonymous users qualify, and only if
+        they set no cookies and are not private.
+        """
+
+        cachingContext = getCachingContext(self.published, self.request)
+        if not cachingContext.anonymous:
+            return False
+
+        if response is not None:
+            if response.cookies:
+                return False
+            cacheControl = response.getHeader("Cache-Control") or ""
+            if "private" in cacheControl or "no-store" in cacheControl:
+                return False
+
+        return isExpensive(self.published)
+
     def modifyResponse(self, rulename, response, class_=None):
         options = lookupOptions(class_ or self.__class__, rulename)
 
@@ -171,14 +248,13 @@ class BaseCaching:
                 etags = ["anonymousOrRandom"]
             elif "anonymousOrRandom" not in etags:
                 etags = tuple(etags) + ("anonymousOrRandom",)
-
-        etag = getETagAnnotation(self.published, self.request, etags)
-        lastModified = getLastModifiedAnnotation(
-            self.published, self.request, options["lastModified"]
-        )
+        etags = self.getShellETags(etags)
 
         # Check for cache stop request variables
-        if cacheStop(self.request, rulename):
+        classification = classifyRequest(
+            self.published, self.request, rulename, anonOnly=anonOnly
+        )
+        if classification == STOP:
             # only stop with etags if configured
             if etags:
                 etag = "{}{}".format(time.time(), random.randint(0, 1000))
@@ -188,9 +264,42 @@ class BaseCaching:
                     response,
                     etag=etag,
                 )
-            # XXX: should there be an else here? Last modified works without
-            #      extra headers.
-            #      Are there other config options?
+            # Otherwise keep the response out of all caches, without
+            # computing validators that would not be used
+            return doNotCache(self.published, self.request, response)
+
+        etag = getETagAnnotation(self.published, self.request, etags)
+        lastModified = getLastModifiedAnnotation(
+            self.published, self.request, options["lastModified"]
+        )
+
+        if not ramCache and (etags or options["lastModified"]):
+            ramCache = self.cacheExpensiveInRAM(response)
+
+        # Redirects and not found responses have their own timeout, if set
+        status = response.getStatus()
+        ttl = None
+        if status in REDIRECT_STATUSES:
+            ttl = options.get("redirectTTL", self.redirectTTL)
+        elif status in NOT_FOUND_STATUSES:
+            ttl = options.get("notFoundTTL", self.notFoundTTL)
+        if ttl is not None:
+            cachingContext = getCachingContext(self.published, self.request)
+            if ttl <= 0 or classification != CACHEABLE or not cachingContext.anonymous:
+                doNotCache(self.published, self.request, response)
+                return
+
+            cacheInProxy(self.published, self.request, response, smaxage=ttl, vary=vary)
+            if ramCache:
+                cacheInRAM(
+                    self.published,
+                    self.request,
+                    response,
+                    etag=etag,
+                    lastModified=lastModified,
+                    expires=time.time() + ttl,
+                )
+            return
 
         # Do the maxage/smaxage settings allow for proxy caching?
         proxyCache = smaxage or (maxage and smaxage is None)
@@ -204,12 +313,8 @@ class BaseCaching:
                     or "anonymousOrRandom" in etags
                     or "roles" in etags
                 ):
-                    context = getContext(self.published)
-                    portal_state = getMultiAdapter(
-                        (context, self.request),
-                        name="plone_portal_state",
-                    )
-                    public = portal_state.anonymous()
+                    cachingContext = getCachingContext(self.published, self.request)
+                    public = bool(cachingContext.anonymous)
             public = public and visibleToRole(self.published, role="Anonymous")
 
         if proxyCache and not public:
@@ -227,6 +332,12 @@ class BaseCaching:
             vary=vary,
         )
 
+        # Only pages for anonymous users are looked up in the RAM cache, and
+        # shells for authenticated users must not be served to them
+        if ramCache and public and isShell(self.published, self.request):
+            cachingContext = getCachingContext(self.published, self.request)
+            ramCache = cachingContext.anonymous
+
         if ramCache and public:
             cacheInRAM(
                 self.published,
@@ -257,12 +368,21 @@ class WeakCaching(BaseCaching):
     sort = 3
 
     # Configurable options
-    options = ("etags", "lastModified", "ramCache", "vary", "anonOnly")
+    options = (
+        "etags",
+        "lastModified",
+        "ramCache",
+        "vary",
+        "anonOnly",
+        "redirectTTL",
+        "notFoundTTL",
+    )
 
     # Default option values
     maxage = 0
     smaxage = etags = vary = None
     lastModified = ramCache = anonOnly = False
+    redirectTTL = notFoundTTL = None
 
 
 @provider(ICachingOperationType)
@@ -284,13 +404,23 @@ class ModerateCaching(BaseCaching):
     sort = 2
 
     # Configurable options
-    options = ("smaxage", "etags", "lastModified", "ramCache", "vary", "anonOnly")
+    options = (
+        "smaxage",
+        "etags",
+        "lastModified",
+        "ramCache",
+        "vary",
+        "anonOnly",
+        "redirectTTL",
+        "notFoundTTL",
+    )
 
     # Default option values
     maxage = 0
     smaxage = 86400
     etags = vary = None
     lastModified = ramCache = anonOnly = False
+    redirectTTL = notFoundTTL = None
 
 
 @provider(ICachingOperationType)
@@ -318,12 +448,15 @@ class StrongCaching(BaseCaching):
         "ramCache",
         "vary",
         "anonOnly",
+        "redirectTTL",
+        "notFoundTTL",
     )
 
     # Default option values
     maxage = 86400
     smaxage = etags = vary = None
     lastModified = ramCache = anonOnly = False
+    redirectTTL = notFoundTTL = None
 
 
 @provider(ICachingOperationType)
@@ -352,6 +485,8 @@ class TerseCaching(BaseCaching):
         "ramCache",
         "vary",
         "anonOnly",
+        "redirectTTL",
+        "notFoundTTL",
     )
 
     # Default option values
@@ -360,6 +495,7 @@ class TerseCaching(BaseCaching):
     vary = "Accept"
     etags = None
     lastModified = ramCache = anonOnly = False
+    redirectTTL = notFoundTTL = None
 
 
 @implementer(ICachingOperation)
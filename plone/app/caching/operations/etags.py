@@ -1,16 +1,17 @@
 from Acquisition import aq_base
 from Acquisition import aq_inner
+from plone.app.caching.counters import getSectionCounterValue
+from plone.app.caching.esi import getFragments
 from plone.app.caching.interfaces import IETagValue
-from plone.app.caching.operations.utils import getContext
+from plone.app.caching.operations.utils import getCachingContext
 from plone.app.caching.operations.utils import getLastModifiedAnnotation
+from plone.app.caching.operations.utils import getRolesInContext
 from Products.CMFCore.interfaces import ICatalogTool
-from Products.CMFCore.interfaces import IMembershipTool
 from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.resources.browser.combine import get_override_directory
 from Products.CMFPlone.resources.browser.combine import PRODUCTION_RESOURCE_DIRECTORY
 from Products.CMFPlone.utils import safe_hasattr
 from zope.component import adapter
-from zope.component import queryMultiAdapter
 from zope.component import queryUtility
 from zope.interface import implementer
 from zope.interface import Interface
@@ -29,11 +30,7 @@ class UserID:
         self.request = request
 
     def __call__(self):
-        tool = queryUtility(IMembershipTool)
-        if tool is None:
-            return None
-
-        member = tool.getAuthenticatedMember()
+        member = getCachingContext(self.published, self.request).member
         if member is None:
             return None
 
@@ -52,18 +49,18 @@ class Roles:
         self.request = request
 
     def __call__(self):
-        tool = queryUtility(IMembershipTool)
-        if tool is None:
+        cachingContext = getCachingContext(self.published, self.request)
+        if cachingContext.membership is None:
             return None
 
-        if bool(tool.isAnonymousUser()):
+        if cachingContext.anonymous:
             return "Anonymous"
 
-        member = tool.getAuthenticatedMember()
+        member = cachingContext.member
         if member is None:
             return None
 
-        return ";".join(sorted(member.getRolesInContext(getContext(self.published))))
+        return ";".join(sorted(getRolesInContext(member, cachingContext.context)))
 
 
 @implementer(IETagValue)
@@ -96,13 +93,11 @@ class UserLanguage:
         language = self.request.get("LANGUAGE", None)
         if language:
             return language
-        context = getContext(self.published)
-        language = aq_inner(context).Language()
+        cachingContext = getCachingContext(self.published, self.request)
+        language = aq_inner(cachingContext.context).Language()
         if language:
             return language
-        portal_state = queryMultiAdapter(
-            (context, self.request), name="plone_portal_state"
-        )
+        portal_state = cachingContext.portal_state
         if portal_state is None:
             return None
         return portal_state.default_language()
@@ -144,6 +139,28 @@ class CatalogCounter:
         return str(catalog.getCounter())
 
 
+@implementer(IETagValue)
+@adapter(Interface, Interface)
+class SectionCounter:
+    """The ``sectionCounter`` etag component, returning a counter which is
+    incremented each time content in the section of the current context is
+    updated, combined with a counter for site-level changes.
+
+    Unlike ``catalogCounter``, changes elsewhere in the site do not change
+    this value. The depth of a section is set in the registry.
+    """
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def __call__(self):
+        context = getCachingContext(self.published, self.request).context
+        if context is None:
+            return None
+        return getSectionCounterValue(context)
+
+
 @implementer(IETagValue)
 @adapter(Interface, Interface)
 class ObjectLocked:
@@ -156,10 +173,7 @@ class ObjectLocked:
         self.request = request
 
     def __call__(self):
-        context = getContext(self.published)
-        context_state = queryMultiAdapter(
-            (context, self.request), name="plone_context_state"
-        )
+        context_state = getCachingContext(self.published, self.request).context_state
         if context_state is None:
             return None
         return "1" if context_state.is_locked() else "0"
@@ -175,7 +189,7 @@ class Skin:
         self.request = request
 
     def __call__(self):
-        context = getContext(self.published)
+        context = getCachingContext(self.published, self.request).context
 
         portal_skins = getToolByName(context, "portal_skins", None)
         if portal_skins is None:
@@ -202,10 +216,8 @@ class AnonymousOrRandom:
         self.request = request
 
     def __call__(self):
-        tool = queryUtility(IMembershipTool)
-        if tool is None:
-            return None
-        if bool(tool.isAnonymousUser()):
+        anonymous = getCachingContext(self.published, self.request).anonymous
+        if anonymous is None or anonymous:
             return None
         return "{}{}".format(time.time(), random.randint(0, 1000))
 
@@ -239,7 +251,7 @@ class ResourceRegistries(object):
         self.request = request
 
     def __call__(self):
-        context = getContext(self.published)
+        context = getCachingContext(self.published, self.request).context
         container = get_override_directory(context)
         if PRODUCTION_RESOURCE_DIRECTORY not in container:
             return ""
@@ -267,7 +279,23 @@ class Layout(object):
         self.request = request
 
     def __call__(self):
-        context = getContext(self.published)
+        context = getCachingContext(self.published, self.request).context
         if not safe_hasattr(aq_base(context), "getLayout"):
             return
         return context.getLayout()
+
+
+@implementer(IETagValue)
+@adapter(Interface, Interface)
+class EdgeSideIncludes:
+    """The ``esi`` etag component, returning 1 or 0 depending on whether
+    personalised regions of the page are rendered as ESI includes (see
+    ``plone.app.caching.esi``).
+    """
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    def __call__(self):
+        return "1" if getFragments(self.request) else "0"
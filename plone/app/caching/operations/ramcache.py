@@ -1,6 +1,14 @@
+from plone.app.caching.dependencies import finishTracking
 from plone.app.caching.interfaces import IRAMCached
+from plone.app.caching.operations.rendercost import recordRenderCost
+from plone.app.caching.operations.rendercost import RENDER_START_ANNOTATION_KEY
+from plone.app.caching.operations.utils import NOT_FOUND_STATUSES
+from plone.app.caching.operations.utils import PAGE_CACHE_ANNOTATION_KEY
+from plone.app.caching.operations.utils import PAGE_CACHE_KEY
+from plone.app.caching.operations.utils import REDIRECT_STATUSES
 from plone.app.caching.operations.utils import storeResponseInRAMCache
 from plone.transformchain.interfaces import ITransform
+from zope.annotation.interfaces import IAnnotations
 from zope.component import adapter
 from zope.interface import implementer
 from zope.interface import Interface
@@ -17,6 +25,9 @@ class Store:
     This is registered for the ``IRAMCached`` request marker, which is set by
     the ``cacheInRAM()`` helper method. Thus, the transform is only used if
     the caching operation requested it.
+
+    It also records the render cost of successful responses, and the
+    content the page depends on, if it was tracked.
     """
 
     order = 90000
@@ -26,25 +37,62 @@ class Store:
         self.request = request
 
     def transformUnicode(self, result, encoding):
-        if self.responseIsSuccess() and IRAMCached.providedBy(self.request):
-            storeResponseInRAMCache(
-                self.request, self.request.response, result.encode(encoding)
-            )
+        # Pages that are neither cached nor measured are not encoded here
+        if IRAMCached.providedBy(self.request) or self.isRenderTimed():
+            result = result.encode(encoding)
+            self.recordRenderCost(result)
+            if self.responseIsSuccess() and IRAMCached.providedBy(self.request):
+                storeResponseInRAMCache(self.request, self.request.response, result)
+        self.recordDependencies()
         return None
 
     def transformBytes(self, result, encoding):
+        self.recordRenderCost(result)
         if self.responseIsSuccess() and IRAMCached.providedBy(self.request):
             storeResponseInRAMCache(self.request, self.request.response, result)
+        self.recordDependencies()
         return None
 
     def transformIterable(self, result, encoding):
         if self.responseIsSuccess() and IRAMCached.providedBy(self.request):
             result = b"".join(result)
+            # Streamed responses are only measured if they are cached anyway
+            self.recordRenderCost(result)
             storeResponseInRAMCache(self.request, self.request.response, result)
+            self.recordDependencies()
             # ITransform contract allows to return an "encoded string" aka bytes
             return result
+        self.recordDependencies()
         return None
 
+    def isRenderTimed(self):
+        annotations = IAnnotations(self.request, None)
+        return annotations is not None and RENDER_START_ANNOTATION_KEY in annotations
+
+    def recordRenderCost(self, result):
+        if self.request.response.getStatus() == 200:
+            recordRenderCost(self.published, self.request, len(result))
+
+    def recordDependencies(self):
+        success = self.request.response.getStatus() == 200
+        key = None
+        if success and IRAMCached.providedBy(self.request):
+            annotations = IAnnotations(self.request, None)
+            if annotations is not None:
+                key = annotations.get(PAGE_CACHE_ANNOTATION_KEY)
+        finishTracking(self.request, success, PAGE_CACHE_KEY, key)
+
     def responseIsSuccess(self):
         status = self.request.response.getStatus()
-        return status == 200
+        if status == 200:
+            return True
+
+        # Redirects and not found responses are only stored if the caching
+        # operation gave them an expiry time
+        if status in REDIRECT_STATUSES or status in NOT_FOUND_STATUSES:
+            annotations = IAnnotations(self.request, None)
+            if annotations is not None:
+                expires = annotations.get(PAGE_CACHE_ANNOTATION_KEY + ".expires")
+                return expires is not None
+
+        return False
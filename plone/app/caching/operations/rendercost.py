@@ -0,0 +1,157 @@
+"""Render cost statistics, and automatic RAM caching of expensive views.
+
+The caching operations note the time when a request reaches them, before the
+published view is called. When the response passes through the RAM cache
+transform, the time it took to render and the size of the response are added
+to the statistics of the view.
+
+If ``ramCacheCostThreshold`` is set, views whose average render time per
+kilobyte of output is above it are cached in RAM by the default caching
+operations, even for rulesets that do not have the ``ramCache`` parameter
+set. This only applies to rulesets that use ETags or Last-Modified
+validation, since these make up the key of the cached pages.
+"""
+
+from Acquisition import aq_base
+from plone.registry.interfaces import IRegistry
+from zope.annotation.interfaces import IAnnotations
+from zope.component import queryUtility
+
+import threading
+import time
+
+
+RENDER_START_ANNOTATION_KEY = "plone.app.caching.operations.renderstart"
+COST_THRESHOLD_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.ramCacheCostThreshold"
+)
+
+# Number of renders of a view before its cost is trusted
+MIN_RENDERS = 3
+
+# Maximum number of views to keep statistics for
+MAX_VIEWS = 500
+
+
+class RenderCostStatistics:
+    """Render times and response sizes, per view"""
+
+    def __init__(self, maxViews=MAX_VIEWS):
+        self.maxViews = maxViews
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def record(self, view, seconds, size):
+        with self._lock:
+            stats = self._views.get(view)
+            if stats is None:
+                if len(self._views) >= self.maxViews:
+                    # Forget the least rendered view
+                    leastRendered = min(
+                        self._views, key=lambda name: self._views[name][0]
+                    )
+                    del self._views[leastRendered]
+                stats = self._views[view] = [0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += size
+
+    def getCost(self, view):
+        """Return the average render time, in milliseconds, per kilobyte of
+        output of the given view, or None if it has not been rendered often
+        enough yet. Responses smaller than a kilobyte count as one kilobyte.
+        """
+
+        stats = self._views.get(view)
+        if stats is None or stats[0] < MIN_RENDERS:
+            return None
+        renders, seconds, size = stats
+        return seconds * 1000.0 / max(size / 1024.0, renders)
+
+    def getStatistics(self):
+        """Return a list of dictionaries with the statistics of each view,
+        most expensive first.
+        """
+
+        with self._lock:
+            views = {view: list(stats) for view, stats in self._views.items()}
+
+        statistics = []
+        for view, (renders, seconds, size) in views.items():
+            statistics.append(
+                {
+                    "view": view,
+                    "renders": renders,
+                    "time": seconds * 1000.0 / renders,
+                    "size": size // renders,
+                    "cost": seconds * 1000.0 / max(size / 1024.0, renders),
+                }
+            )
+        statistics.sort(key=lambda stats: stats["cost"], reverse=True)
+        return statistics
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+statistics = RenderCostStatistics()
+
+
+def getViewName(published):
+    """Return the name under which the render cost of ``published`` is
+    recorded.
+    """
+
+    published = aq_base(published)
+    name = getattr(published, "__name__", None)
+    if not isinstance(name, str) or not name:
+        getId = getattr(published, "getId", None)
+        name = getId() if getId is not None else None
+    if not isinstance(name, str) or not name:
+        name = published.__class__.__name__
+    return name
+
+
+def getCostThreshold():
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return 0
+    return registry.get(COST_THRESHOLD_RECORD, None) or 0
+
+
+def markRenderStart(request):
+    """Note the time when the rendering of the response starts"""
+
+    annotations = IAnnotations(request, None)
+    if annotations is not None:
+        annotations.setdefault(RENDER_START_ANNOTATION_KEY, time.time())
+
+
+def recordRenderCost(published, request, size):
+    """Add the render time of the current response, which is ``size`` bytes
+    long, to the statistics of the published view.
+    """
+
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return
+
+    start = annotations.get(RENDER_START_ANNOTATION_KEY)
+    if start is None:
+        return
+
+    statistics.record(getViewName(published), time.time() - start, size)
+
+
+def isExpensive(published):
+    """Tell whether the published view is expensive enough to be cached in
+    RAM automatically.
+    """
+
+    threshold = getCostThreshold()
+    if threshold <= 0:
+        return False
+
+    cost = statistics.getCost(getViewName(published))
+    return cost is not None and cost >= threshold
@@ -1,17 +1,26 @@
 from _thread import allocate_lock
 from AccessControl.PermissionRole import rolesForPermissionOn
+from plone.app.caching.counters import getCounter
+from plone.app.caching.counters import RAM_CACHE_GENERATION_COUNTER
+from plone.app.caching.diskcache import getDiskCache
+from plone.app.caching.diskcache import getDiskCacheKey
 from plone.app.caching.interfaces import IETagValue
-from plone.app.caching.interfaces import IPloneCacheSettings
 from plone.app.caching.interfaces import IRAMCached
+from plone.app.caching.invalidation import applyInvalidations
+from plone.app.caching.invalidation import recordCachedPage
+from plone.app.caching.operations.admission import admit
+from plone.app.caching.operations.admission import recordRequest
+from plone.memoize.instance import memoize
 from plone.memoize.interfaces import ICacheChooser
 from plone.registry.interfaces import IRegistry
 from Products.CMFCore.interfaces import IContentish
+from Products.CMFCore.interfaces import IMembershipTool
 from Products.CMFCore.interfaces import ISiteRoot
 from z3c.caching.interfaces import ILastModified
 from zope.annotation.interfaces import IAnnotations
-from zope.component import getUtility
 from zope.component import queryMultiAdapter
 from zope.component import queryUtility
+from zope.globalrequest import getRequest
 from zope.interface import alsoProvides
 
 import datetime
@@ -27,6 +36,18 @@ PAGE_CACHE_KEY = "plone.app.caching.operations.ramcache"
 PAGE_CACHE_ANNOTATION_KEY = "plone.app.caching.operations.ramcache.key"
 ETAG_ANNOTATION_KEY = "plone.app.caching.operations.etag"
 LASTMODIFIED_ANNOTATION_KEY = "plone.app.caching.operations.lastmodified"
+SECURITY_CACHE_KEY = "plone.app.caching.operations.security"
+CACHING_CONTEXT_ANNOTATION_KEY = "plone.app.caching.operations.cachingcontext"
+# Responses with these statuses are only cached if the caching operation sets
+# an explicit timeout for them
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+NOT_FOUND_STATUSES = (404, 410)
+
+CACHEABLE_METHODS = ("GET", "HEAD")
+
+CACHE_STOP_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.cacheStopRequestVariables"
+)
 _marker = object()
 
 logger = logging.getLogger("plone.app.caching")
@@ -230,6 +251,7 @@ def cacheInRAM(
     etag=None,
     lastModified=None,
     annotationsKey=PAGE_CACHE_ANNOTATION_KEY,
+    expires=None,
 ):
     """Set a flag indicating that the response for the given request
     should be cached in RAM.
@@ -247,6 +269,13 @@ def cacheInRAM(
     ``annotationsKey`` is the key used by the transform to look up the
     caching key when storing the response in the cache. It should match that
     passed to ``storeResponseInRAMCache()``.
+
+    ``expires`` is an optional timestamp (as returned by ``time.time()``)
+    after which the cached response must no longer be used. This is required
+    for caching redirects and not found responses.
+
+    The page is evicted when the content it belongs to is changed on any
+    Zope process, see ``plone.app.caching.invalidation``.
     """
 
     annotations = IAnnotations(request, None)
@@ -256,6 +285,13 @@ def cacheInRAM(
     key = getRAMCacheKey(request, etag=etag, lastModified=lastModified)
 
     annotations[annotationsKey] = key
+    if expires is not None:
+        annotations[annotationsKey + ".expires"] = expires
+
+    # Remember the content the page belongs to, for targeted invalidation
+    context = getCachingContext(published, request).context
+    if context is not None:
+        annotations[annotationsKey + ".path"] = "/".join(context.getPhysicalPath())
     alsoProvides(request, IRAMCached)
 
 
@@ -275,6 +311,8 @@ def cachedResponse(
     ``headers`` is a dictionary of cached HTTP headers
     ``body`` is a cached response body
     ``gzip`` should be set to True if the response is to be gzipped
+
+    ``HEAD`` requests get the cached status and headers, but no body.
     """
 
     response.setStatus(status)
@@ -288,6 +326,12 @@ def cachedResponse(
     response.setHeader("X-RAMCache", PAGE_CACHE_KEY, literal=1)
     response.enableHTTPCompression(request, disable=not gzip)
 
+    if request.get("REQUEST_METHOD") == "HEAD":
+        # Announce the length of the body a GET request would get
+        if isinstance(body, str):
+            body = body.encode(response.charset)
+        response.setHeader("Content-Length", str(len(body)))
+        return ""
     return body
 
 
@@ -334,8 +378,9 @@ def notModified(published, request, response, etag=None, lastModified=None):
 def cacheStop(request, rulename):
     """Check for any cache stop variables in the request."""
 
-    # Only cache GET requests
-    if request.get("REQUEST_METHOD") != "GET":
+    # Only cache GET requests. HEAD requests are answered from the same
+    # cache entries.
+    if request.get("REQUEST_METHOD") not in CACHEABLE_METHODS:
         return True
 
     # rss_search also uses the SearchableText variable
@@ -343,13 +388,89 @@ def cacheStop(request, rulename):
     if rulename == "plone.content.feed":
         return False
 
-    registry = getUtility(IRegistry)
+    registry = queryUtility(IRegistry)
     if registry is None:
         return False
 
-    ploneSettings = registry.forInterface(IPloneCacheSettings)
-    variables = ploneSettings.cacheStopRequestVariables
-    return set(variables) & set(request.keys())
+    variables = registry.get(CACHE_STOP_RECORD, None)
+    if not variables:
+        return False
+
+    return getCacheStopMatcher(variables)(request)
+
+
+class CacheStopMatcher:
+    """Compiled form of the ``cacheStopRequestVariables`` setting.
+
+    Plain names are looked up in the request directly. Names ending in ``*``
+    match any form variable or cookie starting with the given prefix, and
+    names starting with ``re:`` are regular expressions matched against the
+    names of form variables and cookies.
+    """
+
+    def __init__(self, variables):
+        names = set()
+        prefixes = []
+        patterns = []
+
+        for variable in variables:
+            if variable.startswith("re:"):
+                patterns.append(variable[3:])
+            elif variable.endswith("*"):
+                prefixes.append(variable[:-1])
+            else:
+                names.add(variable)
+
+        self.names = frozenset(names)
+        self.prefixes = tuple(prefixes)
+        self.pattern = None
+        if patterns:
+            self.pattern = re.compile("|".join(f"(?:{p})" for p in patterns))
+
+    def __call__(self, request):
+        for name in self.names:
+            if request.get(name, _marker) is not _marker:
+                return True
+
+        if not self.prefixes and self.pattern is None:
+            return False
+
+        for source in (request.form, request.cookies):
+            for key in source:
+                if self.prefixes and key.startswith(self.prefixes):
+                    return True
+                if self.pattern is not None and self.pattern.match(key):
+                    return True
+
+        return False
+
+
+_cacheStopMatchers = {}
+
+
+def getCacheStopMatcher(variables):
+    """Get the compiled ``CacheStopMatcher`` for the given sequence of cache
+    stop variables.
+
+    Matchers are kept per process, keyed by the configured value, so that
+    sites with different settings and changes made in other processes are
+    taken into account. The cache is cleared when the record is modified.
+    """
+
+    key = tuple(variables)
+    matcher = _cacheStopMatchers.get(key, None)
+    if matcher is None:
+        matcher = _cacheStopMatchers[key] = CacheStopMatcher(key)
+    return matcher
+
+
+def cacheStopVariablesModified(event):
+    """Event handler clearing the compiled cache stop matchers when the
+    ``cacheStopRequestVariables`` record changes.
+    """
+
+    if event.record.__name__ == CACHE_STOP_RECORD:
+        _cacheStopMatchers.clear()
 
 
 def isModified(request, etag=None, lastModified=None):
@@ -432,8 +553,58 @@ def visibleToRole(published, role, permission="View"):
 
     ``role`` is a role name, e.g. ``Anonymous``.
     ``permission`` is the permission to check for.
+
+    The result is memoized for the current request, see
+    ``getSecurityCache()``.
+    """
+
+    cache = getSecurityCache()
+    if cache is None:
+        return role in rolesForPermissionOn(permission, published)
+
+    key = ("permission", permission, id(published))
+    roles = cache.get(key, _marker)
+    if roles is _marker:
+        roles = cache[key] = tuple(rolesForPermissionOn(permission, published))
+    return role in roles
+
+
+def getRolesInContext(member, context):
+    """Return the roles of the given member in the given context, as returned
+    by ``member.getRolesInContext()``.
+
+    The result is memoized for the current request, see
+    ``getSecurityCache()``.
+    """
+
+    cache = getSecurityCache()
+    if context is None or cache is None:
+        return member.getRolesInContext(context)
+
+    key = ("roles", member.getId(), id(context))
+    roles = cache.get(key, _marker)
+    if roles is _marker:
+        roles = cache[key] = tuple(member.getRolesInContext(context))
+    return roles
+
+
+def getSecurityCache():
+    """Return the dictionary the results of security checks are memoized in
+    for the current request, or None if there is no request.
+
+    Results are not kept across requests: local roles and permission
+    settings can change without any event, and checking whether they did
+    costs as much as the checks themselves.
     """
-    return role in rolesForPermissionOn(permission, published)
+
+    request = getRequest()
+    if request is None:
+        return None
+
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return None
+    return annotations.setdefault(SECURITY_CACHE_KEY, {})
 
 
 #
@@ -484,6 +655,91 @@ def getContext(
     return published
 
 
+class CachingContext:
+    """Lookups needed by several caching operations and ETag components
+    during the same request, each resolved at most once.
+
+    Use ``getCachingContext()`` to get the instance for the current request.
+    """
+
+    def __init__(self, published, request):
+        self.published = published
+        self.request = request
+
+    @property
+    @memoize
+    def context(self):
+        """The content item or site root the published object belongs to,
+        as returned by ``getContext()``
+        """
+        return getContext(self.published)
+
+    @property
+    @memoize
+    def portal_state(self):
+        """The ``plone_portal_state`` view for the context, or None"""
+        if self.context is None:
+            return None
+        return queryMultiAdapter(
+            (self.context, self.request), name="plone_portal_state"
+        )
+
+    @property
+    @memoize
+    def context_state(self):
+        """The ``plone_context_state`` view for the context, or None"""
+        if self.context is None:
+            return None
+        return queryMultiAdapter(
+            (self.context, self.request), name="plone_context_state"
+        )
+
+    @property
+    @memoize
+    def membership(self):
+        """The membership tool, or None"""
+        return queryUtility(IMembershipTool)
+
+    @property
+    @memoize
+    def anonymous(self):
+        """Whether the current user is anonymous, or None if this cannot be
+        determined
+        """
+        if self.membership is not None:
+            return bool(self.membership.isAnonymousUser())
+        if self.portal_state is not None:
+            return bool(self.portal_state.anonymous())
+        return None
+
+    @property
+    @memoize
+    def member(self):
+        """The authenticated member, or None"""
+        if self.membership is None:
+            return None
+        return self.membership.getAuthenticatedMember()
+
+
+def getCachingContext(published, request):
+    """Get the ``CachingContext`` for the given published object and request.
+
+    The instance is stored in the request annotations, so that operations and
+    ETag components share the same lookups.
+    """
+
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return CachingContext(published, request)
+
+    cachingContext = annotations.get(CACHING_CONTEXT_ANNOTATION_KEY, None)
+    if cachingContext is None or cachingContext.published is not published:
+        cachingContext = CachingContext(published, request)
+        annotations[CACHING_CONTEXT_ANNOTATION_KEY] = cachingContext
+
+    return cachingContext
+
+
 def formatDateTime(dt):
     """Format a Python datetime object as an RFC1123 date.
 
@@ -745,6 +1001,10 @@ def getRAMCacheKey(request, etag=None, lastModified=None):
     and the last-modified date. Both the etag and last=modified are
     optional but in most cases that are worth caching in RAM, the etag
     is needed to ensure the key changes when the resource view changes.
+
+    Once the RAM cache has been purged (see
+    ``plone.app.caching.counters.purgeRAMCache()``), the key also includes
+    the current generation of the cache.
     """
 
     resourceKey = "{}{}?{}".format(
@@ -756,6 +1016,9 @@ def getRAMCacheKey(request, etag=None, lastModified=None):
         resourceKey = "|" + etag + "||" + resourceKey
     if lastModified:
         resourceKey = "|" + str(lastModified) + "||" + resourceKey
+    generation = getCounter(RAM_CACHE_GENERATION_COUNTER)
+    if generation:
+        resourceKey = "|generation:" + str(generation) + "||" + resourceKey
     return resourceKey
 
 
@@ -799,15 +1062,43 @@ def storeResponseInRAMCache(
     This does mean that any resources will not be cached in ram. There is
     potentially another fix but I doubt long term it's ever the right thing to
     do.
+
+    Responses with an expiry time (see ``cacheInRAM()``) are the exception:
+    these are typically redirects, which have no body.
+
+    Responses to ``HEAD`` requests are never stored, since they may not have
+    a body either. They are answered from the entries stored for ``GET``.
+
+    If ``ramCacheAdmissionThreshold`` is set, pages that have been requested
+    fewer times recently (see ``fetchFromRAMCache()``) are not stored either.
     """
-    if not result:
+    if request.get("REQUEST_METHOD") == "HEAD":
+        return
+
+    # Only store pages that are requested often enough
+    if not admit(getRAMCacheKey(request)):
+        return
+
+    expires = annotations.get(annotationsKey + ".expires")
+    if not result and expires is None:
         return
 
     status = response.getStatus()
     headers = dict(request.response.headers)
     gzipFlag = response.enableHTTPCompression(query=True)
 
-    cache[key] = (status, headers, result, gzipFlag)
+    if expires is None:
+        cached = (status, headers, result, gzipFlag)
+    else:
+        cached = (status, headers, result, gzipFlag, expires)
+    cache[key] = cached
+    recordCachedPage(annotations.get(annotationsKey + ".path"), globalKey, key)
+
+    # Keep a copy in the disk tier, if configured, so that the page survives
+    # eviction from RAM and restarts
+    diskCache = getDiskCache()
+    if diskCache is not None:
+        diskCache[getDiskCacheKey(globalKey, key)] = cached
 
 
 def fetchFromRAMCache(
@@ -819,7 +1110,17 @@ def fetchFromRAMCache(
 ):
     """Return a page cached in RAM, or None if it cannot be found.
 
-    The return value is a tuple as stored by ``storeResponseInRAMCache()``.
+    The return value is a tuple as stored by ``storeResponseInRAMCache()``,
+    without the expiry time, if any. Expired responses are ignored.
+
+    Every call counts as a request for the page for the admission policy of
+    ``storeResponseInRAMCache()``.
+
+    Pages for content that has been changed are evicted first, see
+    ``plone.app.caching.invalidation``.
+
+    Pages that are not in RAM are looked up in the disk tier, if configured
+    (see ``plone.app.caching.diskcache``), and copied back into RAM.
 
     ``etag`` is an ETag for the content, and is usually used as a basis for
     the cache key.
@@ -839,8 +1140,30 @@ def fetchFromRAMCache(
     if cache is None:
         return None
 
+    # Evict pages for content changed since the last lookup, on any process
+    applyInvalidations()
+
+    # Count the request for the admission policy, for all versions of the page
+    recordRequest(getRAMCacheKey(request))
+
     key = getRAMCacheKey(request, etag=etag, lastModified=lastModified)
     if key is None:
         return None
 
-    return cache.get(key, default)
+    cached = cache.get(key, default)
+    if cached is default:
+        diskCache = getDiskCache()
+        if diskCache is None:
+            return default
+        cached = diskCache.get(getDiskCacheKey(globalKey, key), default)
+        if cached is default:
+            return default
+        cache[key] = cached
+
+    if len(cached) < 5:
+        return cached
+
+    # Responses stored with an expiry time
+    if cached[4] < time.time():
+        return default
+    return cached[:4]
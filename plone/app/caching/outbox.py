@@ -0,0 +1,465 @@
+"""Durable outbox for purge requests.
+
+By default, ``plone.cachepurging`` hands the URLs to purge to worker threads
+once the request has been committed. If a caching proxy cannot be reached for
+a while, or the process is restarted, these purges are lost, and the proxy
+serves stale pages until they expire.
+
+If a directory is configured, purges are written to a journal file in that
+directory instead, when the transaction is committed. A background thread
+sends them to the caching proxies, and removes them from the journal once the
+proxy has accepted them. When a proxy fails, all purges for it are retried
+later, waiting twice as long after every failure, up to ``MAX_DELAY``
+seconds. A URL that is already waiting to be purged is not added again::
+
+    <product-config plone.app.caching>
+        purge-outbox-directory /var/cache/plone/instance1
+    </product-config>
+
+Purges still waiting when the process stops are sent after the next start.
+Each process needs its own directory.
+
+URLs of pages to re-warm are requested again once their purge has been
+accepted by the caching proxy. They are not kept in the journal.
+
+The outbox also collapses repeated purges of the same URL, if a debounce
+window is set in the ``purgeDebounceWindow`` setting. Without a directory,
+such purges are then kept in memory.
+"""
+
+from App.config import getConfiguration
+from plone.app.caching.diskcache import PRODUCT_CONFIG_NAME
+from plone.app.caching.purgestats import getProxy
+from plone.app.caching.purgestats import isSuccess
+from plone.app.caching.purgestats import purgeSync
+from plone.app.caching.rewarm import KEY as REWARM_KEY
+from plone.app.caching.rewarm import scheduleRewarm
+from plone.cachepurging.hooks import KEY
+from plone.cachepurging.interfaces import ICachePurgingSettings
+from plone.cachepurging.interfaces import IPurger
+from plone.cachepurging.utils import getURLsToPurge
+from plone.cachepurging.utils import isCachePurgingEnabled
+from plone.registry.interfaces import IRegistry
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import queryUtility
+from ZPublisher.interfaces import IPubBeforeCommit
+
+import logging
+import os
+import threading
+import time
+import transaction
+
+
+logger = logging.getLogger("plone.app.caching")
+
+JOURNAL_FILENAME = "purges.log"
+
+DEBOUNCE_WINDOW_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.purgeDebounceWindow"
+)
+DEBOUNCE_MAX_DELAY_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.purgeDebounceMaxDelay"
+)
+
+# Number of seconds to wait before retrying after the first failure, and at
+# most after repeated failures
+INITIAL_DELAY = 1.0
+MAX_DELAY = 300.0
+
+# Rewrite the journal once it holds this many lines more than purges pending
+COMPACT_THRESHOLD = 1000
+
+
+class ProxyState:
+    """The failures of a caching proxy"""
+
+    def __init__(self):
+        self.failures = 0
+        self.retryAt = 0.0
+        self.lastError = None
+
+
+class PurgeOutbox:
+    """Purges waiting to be sent to the caching proxies, in order.
+
+    If ``directory`` is given, pending purges are kept in a journal file, to
+    which every added and completed purge is appended as a line. Otherwise,
+    they are only kept in memory.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        initialDelay=INITIAL_DELAY,
+        maxDelay=MAX_DELAY,
+        purger=None,
+    ):
+        self.directory = directory
+        self.initialDelay = initialDelay
+        self.maxDelay = maxDelay
+        self._purger = purger
+        self._pending = {}
+        self._rewarm = set()
+        self._proxies = {}
+        self._journal = None
+        self._journalLines = 0
+        self._condition = threading.Condition()
+        self._worker = None
+        self._stopping = False
+        if directory is not None:
+            self._open()
+
+    @property
+    def purger(self):
+        if self._purger is not None:
+            return self._purger
+        return queryUtility(IPurger)
+
+    def add(self, urls, window=0, maxDelay=None, now=None, rewarm=()):
+        """Queue the given URLs for purging, and start the worker thread if
+        necessary.
+
+        If ``window`` is given, a URL is only purged once it has not been
+        added again for that many seconds, but no later than ``maxDelay``
+        seconds after it was first added. Otherwise, URLs that are already
+        pending are left as they are.
+
+        The URLs in ``rewarm`` are requested again once they have been
+        purged.
+        """
+
+        if now is None:
+            now = time.time()
+        if maxDelay is None or maxDelay < window:
+            maxDelay = window
+
+        with self._condition:
+            for url in urls:
+                entry = self._pending.get(url)
+                if entry is None:
+                    self._pending[url] = [now + window, now + maxDelay]
+                    self._write("+", url)
+                else:
+                    # Collapse repeated purges of the same URL. The entry is
+                    # replaced, so that a purge already being sent for it
+                    # does not remove it.
+                    self._pending[url] = [
+                        min(max(entry[0], now + window), entry[1]),
+                        entry[1],
+                    ]
+            self._rewarm.update(url for url in rewarm if url in self._pending)
+            self._condition.notify()
+
+        self.start()
+
+    def pending(self):
+        """Return the URLs waiting to be purged"""
+        with self._condition:
+            return list(self._pending)
+
+    def getStatus(self):
+        """Return a dictionary with the number of pending purges, the number
+        of consecutive failures, the time of the next attempt and the last
+        error for each caching proxy with pending purges.
+        """
+
+        with self._condition:
+            status = {}
+            for url in self._pending:
+                proxy = getProxy(url)
+                if proxy not in status:
+                    state = self._proxies.get(proxy) or ProxyState()
+                    status[proxy] = {
+                        "pending": 0,
+                        "failures": state.failures,
+                        "retryAt": state.retryAt,
+                        "lastError": state.lastError,
+                    }
+                status[proxy]["pending"] += 1
+            return status
+
+    def process(self, now=None):
+        """Send the purges whose proxies are not waiting for a retry. Returns
+        the number of seconds until the next purge is due, or None if nothing
+        is pending.
+        """
+
+        if now is None:
+            now = time.time()
+
+        purger = self.purger
+        if purger is None:
+            return self.maxDelay if self._pending else None
+
+        failed = set()
+        for url, entry in self._due(now):
+            proxy = getProxy(url)
+            state = self._proxies.get(proxy)
+            if proxy in failed or (state is not None and state.retryAt > now):
+                continue
+
+            status, xcache, xerror = purgeSync(purger, url)
+            if isSuccess(status):
+                self._done(url, entry, proxy)
+            else:
+                self._failed(proxy, now, f"{status} {xerror}".strip())
+                failed.add(proxy)
+
+        with self._condition:
+            if not self._pending:
+                return None
+            nextAttempt = None
+            for url, (notBefore, deadline) in self._pending.items():
+                state = self._proxies.get(getProxy(url))
+                if state is not None:
+                    notBefore = max(notBefore, state.retryAt)
+                if nextAttempt is None or notBefore < nextAttempt:
+                    nextAttempt = notBefore
+            return max(nextAttempt - now, 0.0)
+
+    def _due(self, now):
+        with self._condition:
+            return [
+                (url, entry) for url, entry in self._pending.items() if entry[0] <= now
+            ]
+
+    def start(self):
+        with self._condition:
+            if self._worker is not None or not self._pending:
+                return
+            self._stopping = False
+            self._worker = threading.Thread(
+                target=self._run, name="plone.app.caching purge outbox"
+            )
+            self._worker.daemon = True
+            self._worker.start()
+
+    def stop(self):
+        with self._condition:
+            worker = self._worker
+            self._stopping = True
+            self._condition.notify()
+        if worker is not None:
+            worker.join(5)
+
+    def close(self):
+        self.stop()
+        with self._condition:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    delay = self.process()
+                except Exception:
+                    logger.exception("Error while processing the purge outbox")
+                    delay = self.maxDelay
+
+                with self._condition:
+                    if self._stopping:
+                        return
+                    if delay is None:
+                        if not self._pending:
+                            self._condition.wait()
+                    elif delay > 0:
+                        self._condition.wait(delay)
+                    if self._stopping:
+                        return
+        finally:
+            with self._condition:
+                self._worker = None
+
+    def _done(self, url, entry, proxy):
+        rewarm = False
+        with self._condition:
+            # Keep the URL if it was added again while it was being purged
+            if self._pending.get(url) is entry:
+                del self._pending[url]
+                self._write("-", url)
+                if url in self._rewarm:
+                    self._rewarm.discard(url)
+                    rewarm = True
+            self._proxies.pop(proxy, None)
+            if self._journalLines > len(self._pending) + COMPACT_THRESHOLD:
+                self._compact()
+
+        if rewarm:
+            scheduleRewarm([url])
+
+    def _failed(self, proxy, now, error):
+        with self._condition:
+            state = self._proxies.setdefault(proxy, ProxyState())
+            state.failures += 1
+            state.lastError = error
+            delay = min(self.initialDelay * 2 ** (state.failures - 1), self.maxDelay)
+            state.retryAt = now + delay
+
+        logger.warning(
+            "Purging through %s failed (%s), retrying in %d seconds",
+            proxy,
+            error,
+            delay,
+        )
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, JOURNAL_FILENAME)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as journal:
+                for line in journal:
+                    # Ignore an incomplete last line, e.g. after a crash
+                    if not line.endswith("\n") or line[1:2] != " ":
+                        continue
+                    operation, url = line[0], line[2:-1]
+                    if operation == "+":
+                        self._pending[url] = [0.0, 0.0]
+                    elif operation == "-":
+                        self._pending.pop(url, None)
+
+        self._journal = open(path, "a", encoding="utf-8")
+        self._compact()
+
+    def _write(self, operation, url):
+        if self._journal is None:
+            return
+        self._journal.write(f"{operation} {url}\n")
+        self._journal.flush()
+        self._journalLines += 1
+
+    def _compact(self):
+        if self._journal is None:
+            return
+        self._journal.seek(0)
+        self._journal.truncate()
+        self._journalLines = 0
+        for url in self._pending:
+            self._write("+", url)
+
+
+# The purge outbox of this process, ``_NOT_CONFIGURED`` if there is none, or
+# None if the configuration has not been read yet
+_NOT_CONFIGURED = object()
+_outbox = None
+_outboxLock = threading.Lock()
+
+# The in-memory outbox of this process, used for debouncing purges if there
+# is no purge outbox directory
+_memoryOutbox = None
+
+
+def getPurgeOutbox(create=False):
+    """Return the purge outbox configured for this process, or None if there
+    is none.
+
+    If ``create`` is True and no directory is configured, an outbox that is
+    only kept in memory is returned instead.
+    """
+
+    global _outbox, _memoryOutbox
+
+    if _outbox is None:
+        with _outboxLock:
+            if _outbox is None:
+                outbox = _createPurgeOutbox()
+                _outbox = _NOT_CONFIGURED if outbox is None else outbox
+                if outbox is not None:
+                    # Send the purges left over from the last run
+                    outbox.start()
+
+    if _outbox is not _NOT_CONFIGURED:
+        return _outbox
+
+    if not create:
+        return None
+
+    if _memoryOutbox is None:
+        with _outboxLock:
+            if _memoryOutbox is None:
+                _memoryOutbox = PurgeOutbox()
+    return _memoryOutbox
+
+
+def setPurgeOutbox(outbox):
+    """Replace the purge outbox of this process. Passing ``None`` means the
+    configuration is read again on the next lookup.
+    """
+
+    global _outbox, _memoryOutbox
+    _outbox = outbox
+    _memoryOutbox = None
+
+
+def _createPurgeOutbox():
+    productConfig = getattr(getConfiguration(), "product_config", None) or {}
+    config = productConfig.get(PRODUCT_CONFIG_NAME) or {}
+
+    directory = config.get("purge-outbox-directory")
+    if not directory:
+        return None
+
+    try:
+        return PurgeOutbox(directory)
+    except OSError:
+        logger.exception("Cannot open the purge outbox in %s", directory)
+        return None
+
+
+@adapter(IPubBeforeCommit)
+def queueInOutbox(event):
+    """Take the paths queued for purging by ``plone.cachepurging`` and add
+    their URLs to the outbox once the transaction is committed.
+
+    ``plone.cachepurging`` purges the paths after the commit, so nothing is
+    left for it to do.
+
+    If ``purgeDebounceWindow`` is set, repeated purges of the same URL
+    within that many seconds are collapsed into one.
+
+    Pages queued for re-warming whose URLs are purged are requested again by
+    the outbox once their purge has been sent, instead of after a delay.
+    """
+
+    annotations = IAnnotations(event.request, None)
+    if annotations is None:
+        return
+
+    paths = annotations.get(KEY, None)
+    if not paths:
+        return
+
+    registry = queryUtility(IRegistry)
+    if registry is None or not isCachePurgingEnabled(registry=registry):
+        return
+
+    # Debounced purges need the outbox, even if it is not configured
+    window = registry.get(DEBOUNCE_WINDOW_RECORD, None) or 0
+    maxDelay = registry.get(DEBOUNCE_MAX_DELAY_RECORD, None) or 0
+    outbox = getPurgeOutbox(create=window > 0)
+    if outbox is None:
+        return
+
+    settings = registry.forInterface(ICachePurgingSettings, check=False)
+    if not settings.cachingProxies:
+        return
+
+    urls = []
+    for path in sorted(paths):
+        urls.extend(getURLsToPurge(path, settings.cachingProxies))
+    del annotations[KEY]
+
+    rewarm = []
+    rewarmURLs = annotations.get(REWARM_KEY, None)
+    if rewarmURLs:
+        rewarm = [url for url in urls if url in rewarmURLs]
+        rewarmURLs.difference_update(rewarm)
+
+    def addToOutbox(success):
+        if success:
+            outbox.add(urls, window=window, maxDelay=maxDelay, rewarm=rewarm)
+
+    transaction.get().addAfterCommitHook(addToOutbox)
@@ -1,7 +1,15 @@
 from Acquisition import aq_parent
+from contextlib import contextmanager
+from OFS.Traversable import path2url
 from plone.app.caching.utils import getObjectDefaultView
 from plone.app.caching.utils import isPurged
+from plone.app.caching.utils import stripLeadingCharacters
+from plone.cachepurging.hooks import KEY
+from plone.cachepurging.interfaces import ICachePurgingSettings
 from plone.cachepurging.interfaces import IPurgePathRewriter
+from plone.cachepurging.interfaces import IPurger
+from plone.cachepurging.utils import getURLsToPurge
+from plone.cachepurging.utils import isCachePurgingEnabled
 from plone.dexterity.content import get_assignable
 from plone.dexterity.interfaces import IDexteritySchema
 from plone.dexterity.schema import SCHEMA_CACHE
@@ -12,12 +20,17 @@ from plone.registry.interfaces import IRegistry
 from Products.CMFCore.interfaces import IContentish
 from Products.CMFCore.interfaces import IDiscussionResponse
 from Products.CMFCore.interfaces import IDynamicType
+from Products.CMFCore.interfaces import ISiteRoot
 from Products.CMFCore.utils import getToolByName
+from Products.ZCatalog.interfaces import ICatalogBrain
 from z3c.caching.interfaces import IPurgePaths
 from z3c.caching.purge import Purge
+from zope.annotation.interfaces import IAnnotations
 from zope.component import adapter
 from zope.component import getAdapters
 from zope.component import getUtility
+from zope.component import queryUtility
+from zope.component.hooks import getSite
 from zope.event import notify
 from zope.globalrequest import getRequest
 from zope.interface import implementer
@@ -25,9 +38,13 @@ from zope.lifecycleevent.interfaces import IObjectAddedEvent
 from zope.lifecycleevent.interfaces import IObjectModifiedEvent
 from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from zope.lifecycleevent.interfaces import IObjectRemovedEvent
+from zope.processlifetime import IProcessStarting
 from zope.schema import getFieldsInOrder
+from ZPublisher.interfaces import IPubBeforeCommit
 
 import pkg_resources
+import threading
+import transaction
 
 
 try:
@@ -36,6 +53,18 @@ try:
 except pkg_resources.DistributionNotFound:
     HAS_RESTAPI = False
 
+try:
+    from plone.app.redirector.storage import RedirectionStorage
+except ImportError:  # pragma: no cover
+    RedirectionStorage = None
+
+BAN_THRESHOLD_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.purgeBanThreshold"
+)
+
+# Request annotation for the paths of the objects purged in the request
+PURGED_OBJECTS_KEY = "plone.app.caching.purgedObjects"
+
 CONTENT_PATHS_POSTFIXES = [
     "/view",
 ]
@@ -173,6 +202,12 @@ class DiscussionItemPurgePaths:
         return thread[0]
 
 
+def getAllowedSizes():
+    """Get the names of the image scales"""
+    reg_list = getUtility(IRegistry)["plone.allowed_sizes"]
+    return [i.split(" ", 1)[0] for i in reg_list]
+
+
 @implementer(IPurgePaths)
 @adapter(IDexteritySchema)
 class ScalesPurgePaths:
@@ -183,8 +218,7 @@ class ScalesPurgePaths:
 
     def getScales(self):
         if getattr(self, "_sizes", None) is None:
-            reg_list = getUtility(IRegistry)["plone.allowed_sizes"]
-            self._sizes = [i.split(" ", 1)[0] for i in reg_list]
+            self._sizes = getAllowedSizes()
         return self._sizes
 
     def getRelativePaths(self):
@@ -222,18 +256,142 @@ class ScalesPurgePaths:
         return []
 
 
+@implementer(IPurgePaths)
+@adapter(ICatalogBrain)
+class CatalogBrainPurgePaths:
+    """Paths to purge for a content item, computed from its catalog brain
+    without loading the object, e.g. when purging a whole subtree.
+
+    These are the paths of ``ContentPurgePaths`` and ``ScalesPurgePaths``.
+    Where the catalog metadata does not tell, more paths are included:
+
+    * The default view is read from the ``getDefaultPage`` or ``getLayout``
+      metadata columns, if the catalog has them. Otherwise, all views
+      available for the content type are included.
+
+    * The parent's paths are included unless the ``is_default_page``
+      metadata column says the item is not the default page of its parent.
+
+    * Image fields and their file names are read from the ``image_scales``
+      metadata. For file fields, the download paths without the file name
+      are included.
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    def getRelativePaths(self):
+        brain = self.context
+        prefix = "/" + getVirtualPath(brain.getPath())
+        paths = [prefix + "/", prefix + "/view"]
+
+        for view in self.getViews():
+            path = prefix + "/" + view
+            if path not in paths:
+                paths.append(path)
+
+        isDefaultPage = getattr(brain, "is_default_page", None)
+        if prefix != "/" and isDefaultPage is not False:
+            parentPrefix = prefix.rsplit("/", 1)[0] or "/"
+            paths.append(parentPrefix)
+            if parentPrefix == "/":
+                # See ContentPurgePaths
+                paths.append("")
+                _append_paths(paths)
+            else:
+                paths.append(parentPrefix + "/")
+                _append_paths(paths, prefix=parentPrefix)
+
+        paths.extend(self.getFieldPaths(prefix))
+        return paths
+
+    def getAbsolutePaths(self):
+        return []
+
+    def getViews(self):
+        """Get the possible default views of the item"""
+
+        for name in ("getDefaultPage", "getLayout"):
+            view = getattr(self.context, name, None)
+            if isinstance(view, str) and view:
+                return [stripLeadingCharacters(view)]
+
+        portal_types = getToolByName(self.context, "portal_types", None)
+        if portal_types is None:
+            return []
+        fti = portal_types.getTypeInfo(self.context.portal_type)
+        if fti is None:
+            return []
+
+        views = [getattr(fti, "default_view", None)]
+        views.extend(getattr(fti, "view_methods", None) or ())
+        return [stripLeadingCharacters(view) for view in views if view]
+
+    def getFieldPaths(self, prefix):
+        imageScales = getattr(self.context, "image_scales", None)
+        if not isinstance(imageScales, dict):
+            imageScales = {}
+
+        for field_name, scales in sorted(imageScales.items()):
+            filenames = {scale.get("filename") for scale in scales or ()}
+            for size in getAllowedSizes():
+                yield f"{prefix}/images/{field_name}/{size}"
+                yield f"{prefix}/@@images/{field_name}/{size}"
+            yield f"{prefix}/download/{field_name}"
+            yield f"{prefix}/@@download/{field_name}"
+            for filename in sorted(filter(None, filenames)):
+                yield f"{prefix}/download/{field_name}/{filename}"
+                yield f"{prefix}/@@download/{field_name}/{filename}"
+
+        portal_type = self.context.portal_type
+        schemas = [SCHEMA_CACHE.get(portal_type)]
+        schemas.extend(SCHEMA_CACHE.behavior_schema_interfaces(portal_type))
+        for schema in schemas:
+            if schema is None:
+                continue
+            for field_name, field in getFieldsInOrder(schema):
+                if INamedBlobFileField.providedBy(field):
+                    yield f"{prefix}/download/{field_name}"
+                    yield f"{prefix}/@@download/{field_name}"
+
+
+def getVirtualPath(physicalPath):
+    """Get the path for the given physical path string relative to the
+    virtual host root, like ``virtual_url_path()``
+    """
+
+    path = physicalPath.split("/")
+    request = getRequest()
+    toVirtual = getattr(request, "physicalPathToVirtualPath", None)
+    if toVirtual is None:
+        return path2url(path[1:])
+    return path2url(toVirtual(path))
+
+
 # Event redispatch for content items - we check the list of content items
 # instead of the marker interface
 
 
 @adapter(IContentish, IObjectModifiedEvent)
 def purgeOnModified(object, event):
+    if isBulkPurging():
+        recordBulkPurge("/" + object.virtual_url_path())
+        return
     if isPurged(object):
         notify(Purge(object))
 
 
 @adapter(IContentish, IObjectMovedEvent)
 def purgeOnMovedOrRemoved(object, event):
+    if isBulkPurging():
+        if event.oldParent is not None:
+            oldParentPath = "/" + event.oldParent.virtual_url_path()
+            recordBulkPurge(oldParentPath.rstrip("/") + "/" + event.oldName)
+            recordBulkPurge(oldParentPath)
+        if event.newParent is not None:
+            recordBulkPurge("/" + event.newParent.virtual_url_path())
+        return
+
     request = getRequest()
     confirmed_delete = (
         request is not None
@@ -245,11 +403,366 @@ def purgeOnMovedOrRemoved(object, event):
     if not confirmed_delete and IObjectRemovedEvent.providedBy(event):
         # ignore extra delete events
         return
-    # Don't purge when added
-    if IObjectAddedEvent.providedBy(event):
+    # Added content is purged as well, since the caching proxy may hold a
+    # not found response or a redirect for its URLs
+    if IObjectAddedEvent.providedBy(event) and not isPurged(object):
         return
-    if isPurged(object) and "portal_factory" not in request.URL:
+    if isPurged(object) and "portal_factory" not in getattr(request, "URL", ""):
         notify(Purge(object))
+        # The old URLs now give a redirect or a not found response
+        if event.oldParent is not None and event.newParent is not None:
+            purgeOldPaths(object, event.oldParent, event.oldName)
+            recordMovedObject(object, event.oldParent, event.oldName)
     parent = object.getParentNode()
     if parent:
         notify(Purge(parent))
+
+
+def purgeOldPaths(object, oldParent, oldName):
+    """Queue the paths the given object had before it was moved or renamed
+    for purging, along with the paths for its new location.
+
+    The paths are calculated from the object's ``IPurgePaths`` adapters by
+    replacing the new path prefix with the old one.
+    """
+
+    request = getRequest()
+    if request is None:
+        return
+
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return
+
+    if not isCachePurgingEnabled():
+        return
+
+    newPrefix = "/" + object.virtual_url_path()
+    oldPrefix = "/" + "/".join(
+        filter(None, (oldParent.virtual_url_path(), oldName))
+    )
+    if oldPrefix == newPrefix:
+        return
+
+    oldPaths = {oldPrefix}
+    for _name, pathProvider in getAdapters((object,), IPurgePaths):
+        for path in pathProvider.getRelativePaths() or ():
+            if path == newPrefix or path.startswith(newPrefix + "/"):
+                oldPaths.add(oldPrefix + path[len(newPrefix) :])
+
+    rewriter = IPurgePathRewriter(request, None)
+    paths = annotations.setdefault(KEY, set())
+    for path in oldPaths:
+        if rewriter is None:
+            paths.add(path)
+        else:
+            paths.update(rewriter(path) or [])
+
+
+#
+# Redirections
+#
+
+
+def purgeRedirectedPath(physicalPath):
+    """Queue the given physical path for purging, since the caching proxy
+    may hold a not found response or a redirect for it that is now wrong
+    """
+
+    request = getRequest()
+    if request is None:
+        return
+
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return
+
+    if isBulkPurging() or not isCachePurgingEnabled():
+        return
+
+    path = "/" + getVirtualPath(physicalPath)
+    rewriter = IPurgePathRewriter(request, None)
+    paths = annotations.setdefault(KEY, set())
+    if rewriter is None:
+        paths.add(path)
+    else:
+        paths.update(rewriter(path) or [])
+
+
+def purgesRedirectedPath(method):
+    def wrapper(self, old_path, *args, **kwargs):
+        result = method(self, old_path, *args, **kwargs)
+        purgeRedirectedPath(self._canonical(old_path))
+        return result
+
+    wrapper.purgesRedirectedPath = True
+    return wrapper
+
+
+def installRedirectionHooks():
+    """Make the redirection storage of ``plone.app.redirector`` purge the
+    old paths of the redirections that are added or removed, e.g. aliases
+    managed through the control panel. The storage sends no events that
+    could be subscribed to instead.
+    """
+
+    if RedirectionStorage is None:
+        return
+
+    for name in ("add", "__setitem__", "remove", "__delitem__"):
+        method = RedirectionStorage.__dict__.get(name, None)
+        if method is None or getattr(method, "purgesRedirectedPath", False):
+            continue
+        setattr(RedirectionStorage, name, purgesRedirectedPath(method))
+
+
+@adapter(IProcessStarting)
+def processStarting(event):
+    installRedirectionHooks()
+
+
+#
+# Bulk operations
+#
+
+# Number of subtrees above which a bulk operation bans the whole site
+BULK_MAX_ROOTS = 20
+
+_bulk = threading.local()
+
+
+def isBulkPurging():
+    """Tell whether purging is suspended by ``bulkPurging()`` in the current
+    thread
+    """
+    return getattr(_bulk, "roots", None) is not None
+
+
+def recordBulkPurge(path):
+    """Record a path affected by the current bulk operation. The paths
+    recorded in a transaction are banned when that transaction is committed.
+    """
+
+    txn = transaction.get()
+    roots = _bulk.roots.get(txn)
+    if roots is None:
+        roots = _bulk.roots[txn] = set()
+        txn.addAfterCommitHook(
+            banBulkPurgeRoots, (roots, _bulk.site, _bulk.maxRoots)
+        )
+    roots.add(path)
+
+
+def banBulkPurgeRoots(success, roots, site, maxRoots):
+    """Ban the subtrees changed in a committed transaction of a bulk
+    operation
+    """
+
+    if not success or not roots:
+        return
+
+    roots = getBulkPurgeRoots(roots)
+    if site is not None and len(roots) > maxRoots:
+        roots = ["/" + site.virtual_url_path()]
+    banPaths(roots)
+
+
+def getBulkPurgeRoots(paths):
+    """Return the given paths without those inside any of the others"""
+
+    paths = set(paths)
+    roots = []
+    for path in sorted(paths):
+        parts = path.rstrip("/").split("/")
+        ancestors = {"/".join(parts[:i]) or "/" for i in range(1, len(parts))}
+        if not ancestors & paths:
+            roots.append(path)
+    return roots
+
+
+@contextmanager
+def bulkPurging(site=None, maxRoots=BULK_MAX_ROOTS):
+    """Suspend purging of individual content items while importing, migrating
+    or otherwise changing lots of content in the current thread::
+
+        with bulkPurging(portal):
+            ...
+
+    Instead, the paths of changed, moved and removed items are recorded, and
+    when a transaction with such changes is committed, inside the block or
+    after it, each caching proxy receives one ``BAN`` request per subtree
+    containing changes in that transaction. If
+    there are more than ``maxRoots`` subtrees, or no site can be found, a
+    single ``BAN`` for the site root is sent to each proxy instead.
+
+    Items are recorded whatever their content type, so that the purge
+    settings need not be looked up for each of them. Nested calls have no
+    further effect.
+    """
+
+    if isBulkPurging():
+        yield
+        return
+
+    if site is None:
+        site = getSite()
+
+    # The paths recorded in each transaction
+    _bulk.roots = {}
+    _bulk.site = site
+    _bulk.maxRoots = maxRoots
+    try:
+        yield
+    finally:
+        del _bulk.roots, _bulk.site, _bulk.maxRoots
+
+
+def banPaths(paths, rewrite=True):
+    """Send a ``BAN`` request for each of the given paths to each caching
+    proxy. The caching proxy is expected to ban all URLs starting with the
+    path.
+
+    Unless ``rewrite`` is False, the paths are rewritten for virtual hosting
+    first, like purge paths.
+    """
+
+    registry = queryUtility(IRegistry)
+    if registry is None or not isCachePurgingEnabled(registry=registry):
+        return
+
+    settings = registry.forInterface(ICachePurgingSettings, check=False)
+    if not settings.cachingProxies:
+        return
+
+    purger = queryUtility(IPurger)
+    if purger is None:
+        return
+
+    rewriter = None
+    if rewrite:
+        request = getRequest()
+        if request is not None:
+            rewriter = IPurgePathRewriter(request, None)
+
+    for path in paths:
+        rewrittenPaths = [path] if rewriter is None else rewriter(path) or []
+        for rewrittenPath in rewrittenPaths:
+            for url in getURLsToPurge(rewrittenPath, settings.cachingProxies):
+                purger.purgeAsync(url, httpVerb="BAN")
+
+
+#
+# Purge planning
+#
+
+
+def planPurges(paths, prefixes):
+    """Plan the requests for purging the given paths from a caching proxy.
+
+    All paths inside one of the given prefixes, usually the old and new paths
+    of moved or renamed objects, are replaced by a single ban of the prefix,
+    if that saves requests. The site root is never banned. Returns the set of
+    paths still to purge, and the list of prefixes to ban.
+    """
+
+    paths = set(paths)
+    bans = []
+    # Banning the site root would empty the whole cache
+    prefixes = [prefix for prefix in prefixes if prefix.strip("/")]
+    for prefix in getBulkPurgeRoots(prefixes):
+        subtree = prefix.rstrip("/") + "/"
+        covered = {path for path in paths if path == prefix or path.startswith(subtree)}
+        if len(covered) > 1:
+            bans.append(prefix)
+            paths -= covered
+    return paths, bans
+
+
+def getBanThreshold(registry):
+    return registry.get(BAN_THRESHOLD_RECORD, None) or 0
+
+
+def recordMovedObject(object, oldParent, oldName):
+    """Remember the new and old paths of a moved or renamed object, so that
+    the purges of its subtree can be replaced by bans if there are too many.
+
+    Only moved or renamed objects are recorded: the paths of modified
+    objects and of containers purged for their listings are purged as usual.
+    The site root is never banned.
+    """
+
+    request = getRequest()
+    if request is None:
+        return
+
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return
+
+    registry = queryUtility(IRegistry)
+    if registry is None or not getBanThreshold(registry):
+        return
+
+    if ISiteRoot.providedBy(object):
+        return
+
+    virtualURLPath = getattr(object, "virtual_url_path", None)
+    if virtualURLPath is None or oldParent is None:
+        return
+
+    newPrefix = "/" + virtualURLPath()
+    oldPrefix = "/" + "/".join(
+        filter(None, (oldParent.virtual_url_path(), oldName))
+    )
+    prefixes = {
+        prefix for prefix in (newPrefix, oldPrefix) if prefix.strip("/")
+    }
+    if prefixes:
+        annotations.setdefault(PURGED_OBJECTS_KEY, set()).update(prefixes)
+
+
+@adapter(IPubBeforeCommit)
+def planPurgeRequests(event):
+    """Replace the purges queued by ``plone.cachepurging`` with bans of the
+    moved or renamed objects, if they would take more than ``purgeBanThreshold``
+    requests. The bans are sent once the transaction is committed.
+    """
+
+    annotations = IAnnotations(event.request, None)
+    if annotations is None:
+        return
+
+    objectPaths = annotations.get(PURGED_OBJECTS_KEY, None)
+    paths = annotations.get(KEY, None)
+    if not objectPaths or not paths:
+        return
+
+    registry = queryUtility(IRegistry)
+    if registry is None or not isCachePurgingEnabled(registry=registry):
+        return
+
+    settings = registry.forInterface(ICachePurgingSettings, check=False)
+    threshold = getBanThreshold(registry)
+    if (
+        not threshold
+        or not settings.cachingProxies
+        or len(paths) * len(settings.cachingProxies) <= threshold
+    ):
+        return
+
+    # Purge paths are rewritten for virtual hosting when they are queued
+    rewriter = IPurgePathRewriter(event.request, None)
+    prefixes = set()
+    for path in objectPaths:
+        prefixes.update([path] if rewriter is None else rewriter(path) or [])
+
+    paths, bans = planPurges(paths, prefixes)
+    if not bans:
+        return
+    annotations[KEY] = paths
+
+    def ban(success):
+        if success:
+            banPaths(bans, rewrite=False)
+
+    transaction.get().addAfterCommitHook(ban)
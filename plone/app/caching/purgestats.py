@@ -0,0 +1,161 @@
+"""Statistics on the purge requests sent to the caching proxies.
+
+The outcome and latency of each purge and ban request sent to a caching
+proxy are recorded. The ``IPurger`` utility registered by this package
+replaces the one of ``plone.cachepurging``, and records the requests it
+sends, synchronously or from its worker threads; other purgers are recorded
+when called through ``purgeSync()`` below.
+
+Statistics are kept in memory, separately for each Zope process.
+"""
+
+from bisect import bisect_left
+from plone.cachepurging.purger import DefaultPurger
+from traceback import format_exc
+from urllib.parse import urlparse
+
+import threading
+import time
+
+
+# Upper bounds of the latency histogram buckets, in seconds. A last bucket
+# counts the slower purges.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def getProxy(url):
+    """Return the caching proxy a purge URL is sent to"""
+    parts = urlparse(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def isSuccess(status):
+    """Tell whether a purge status means that the proxy accepted the purge.
+    Purging a URL that is not cached is fine.
+    """
+    return str(status).startswith("2") or status == 404
+
+
+class ProxyStatistics:
+    """The purges sent to a caching proxy"""
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+        self.lastStatus = None
+        self.lastError = None
+        self.lastErrorTime = None
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def asDict(self):
+        purges = self.successes + self.failures
+        return {
+            "successes": self.successes,
+            "failures": self.failures,
+            "lastStatus": self.lastStatus,
+            "lastError": self.lastError,
+            "lastErrorTime": self.lastErrorTime,
+            "averageTime": self.totalTime / purges if purges else None,
+            "maxTime": self.maxTime if purges else None,
+            "histogram": [
+                {"le": bound, "count": count}
+                for bound, count in zip(LATENCY_BUCKETS + (None,), self.histogram)
+            ],
+        }
+
+
+class PurgeStatistics:
+    """Counts, latencies and errors of the purges sent to each caching
+    proxy
+    """
+
+    def __init__(self):
+        self._proxies = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, status, seconds, error=None, now=None):
+        """Record the outcome of a purge of the given URL, which took
+        ``seconds`` to complete
+        """
+
+        if now is None:
+            now = time.time()
+
+        proxy = getProxy(url)
+        with self._lock:
+            stats = self._proxies.get(proxy)
+            if stats is None:
+                stats = self._proxies[proxy] = ProxyStatistics()
+
+            stats.lastStatus = status
+            if isSuccess(status):
+                stats.successes += 1
+            else:
+                stats.failures += 1
+                # Keep the last line of tracebacks only
+                if error and error.strip():
+                    error = error.strip().splitlines()[-1]
+                stats.lastError = f"{status} {error or ''}".strip()
+                stats.lastErrorTime = now
+
+            stats.totalTime += seconds
+            stats.maxTime = max(stats.maxTime, seconds)
+            stats.histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def getStatistics(self):
+        """Return a dictionary with the statistics of each caching proxy"""
+        with self._lock:
+            return {proxy: stats.asDict() for proxy, stats in self._proxies.items()}
+
+    def clear(self):
+        with self._lock:
+            self._proxies.clear()
+
+
+statistics = PurgeStatistics()
+
+
+def emptyStatistics():
+    """Return the statistics of a caching proxy that was not sent any purges"""
+    return ProxyStatistics().asDict()
+
+
+class RecordingPurger(DefaultPurger):
+    """The ``plone.cachepurging`` purger, recording the outcome of each
+    request it sends, including those sent by its worker threads
+    """
+
+    def purge(self, session, url, httpVerb="PURGE"):
+        start = time.time()
+        try:
+            resp, xcache, xerror = super().purge(session, url, httpVerb)
+        except Exception:
+            statistics.record(url, "ERROR", time.time() - start, format_exc())
+            raise
+        statistics.record(url, resp.status_code, time.time() - start, xerror)
+        return resp, xcache, xerror
+
+
+RECORDING_PURGER = RecordingPurger()
+
+
+def recordsOutcome(purger):
+    """Tell whether the given ``IPurger`` records the outcome of its purges"""
+    return isinstance(purger, RecordingPurger)
+
+
+def purgeSync(purger, url):
+    """Purge the given URL through the given ``IPurger``, and record the
+    outcome. Returns the status, ``X-Cache`` header and error, like
+    ``purger.purgeSync()``.
+    """
+
+    if recordsOutcome(purger):
+        return purger.purgeSync(url)
+
+    start = time.time()
+    status, xcache, xerror = purger.purgeSync(url)
+    statistics.record(url, status, time.time() - start, xerror)
+    return status, xcache, xerror
@@ -0,0 +1,164 @@
+"""Refresh-ahead for the hottest pages in the RAM cache.
+
+The caching operations record which URLs are served from the RAM cache most
+often, per ruleset. When a request changes content, the cache keys of many
+pages change with it, e.g. through the ``catalogCounter`` ETag component. At
+the end of such a request, the ``refreshAheadSize`` hottest URLs of each
+ruleset are requested again in the background, so that Zope renders and
+caches them before real visitors ask for them.
+
+The pages are requested from the address this Zope process itself listens
+on, with the ``Host`` header and path of the original requests, so that they
+get the same RAM cache keys. Caching proxies and load balancers, which might
+answer them or send them to another process, are bypassed.
+"""
+
+from plone.app.caching import rewarm
+from plone.registry.interfaces import IRegistry
+from Products.CMFCore.interfaces import IActionSucceededEvent
+from Products.CMFCore.interfaces import IContentish
+from urllib.parse import quote
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import queryUtility
+from zope.globalrequest import getRequest
+from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
+from ZPublisher.interfaces import IPubSuccess
+
+import threading
+
+
+KEY = "plone.app.caching.refresh"
+REFRESH_AHEAD_RECORD = (
+    "plone.app.caching.interfaces.IPloneCacheSettings.refreshAheadSize"
+)
+
+# Number of URLs tracked per ruleset, as a multiple of the number of URLs
+# that are refreshed
+TRACKED_FACTOR = 4
+
+
+class HotPages:
+    """Counts the RAM cache hits of URLs, per ruleset.
+
+    When more than ``TRACKED_FACTOR`` times the requested number of URLs are
+    tracked for a ruleset, only the hottest half of them is kept, and their
+    counts are halved, so that pages that are no longer visited drop out.
+    """
+
+    def __init__(self):
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def record(self, rulename, url, size):
+        with self._lock:
+            hits = self._hits.setdefault(rulename, {})
+            hits[url] = hits.get(url, 0) + 1
+            if len(hits) > size * TRACKED_FACTOR:
+                hottest = self._sorted(hits)[: size * TRACKED_FACTOR // 2]
+                self._hits[rulename] = {url: count // 2 for url, count in hottest}
+
+    def hottest(self, size):
+        """Return the ``size`` hottest URLs of each ruleset, as a dictionary"""
+
+        with self._lock:
+            return {
+                rulename: [url for url, count in self._sorted(hits)[:size]]
+                for rulename, hits in self._hits.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._hits.clear()
+
+    def _sorted(self, hits):
+        return sorted(hits.items(), key=lambda item: item[1], reverse=True)
+
+
+hotPages = HotPages()
+
+
+def getRefreshAheadSize():
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return 0
+    return registry.get(REFRESH_AHEAD_RECORD, None) or 0
+
+
+def recordHit(request, rulename):
+    """Record that the page for the given request was served from the RAM
+    cache, unless it was requested by the refresh itself.
+    """
+
+    size = getRefreshAheadSize()
+    if not size or request.get_header("User-Agent") == rewarm.USER_AGENT:
+        return
+
+    hotPages.record(
+        rulename, (getLocalURL(request), request.get_header("Host") or ""), size
+    )
+
+
+def getLocalURL(request):
+    """Return the URL of the given request at the address this Zope process
+    listens on, as opposed to the public URL, which may be answered by a
+    caching proxy or another process. Virtual hosting information in the
+    path is kept.
+    """
+
+    environ = request.environ
+    url = "{}://{}:{}{}".format(
+        environ.get("wsgi.url_scheme", "http"),
+        environ.get("SERVER_NAME", "localhost"),
+        environ.get("SERVER_PORT", "80"),
+        quote(environ.get("PATH_INFO", ""), safe="/@:;,=+$!*'()~"),
+    )
+    queryString = environ.get("QUERY_STRING", "")
+    if queryString:
+        url += "?" + queryString
+    return url
+
+
+def markContentChanged():
+    request = getRequest()
+    if request is None:
+        return
+
+    annotations = IAnnotations(request, None)
+    if annotations is not None:
+        annotations[KEY] = True
+
+
+@adapter(IContentish, IObjectModifiedEvent)
+def contentModified(object, event):
+    markContentChanged()
+
+
+@adapter(IContentish, IActionSucceededEvent)
+def contentTransitioned(object, event):
+    markContentChanged()
+
+
+@adapter(IContentish, IObjectMovedEvent)
+def contentMoved(object, event):
+    markContentChanged()
+
+
+@adapter(IPubSuccess)
+def refreshAhead(event):
+    """Request the hottest pages again once content changes are committed"""
+
+    annotations = IAnnotations(event.request, None)
+    if annotations is None or not annotations.get(KEY):
+        return
+
+    size = getRefreshAheadSize()
+    if not size:
+        return
+
+    urls = set()
+    for rulenameURLs in hotPages.hottest(size).values():
+        urls.update(rulenameURLs)
+    if urls:
+        rewarm.rewarmer.schedule(sorted(urls))
@@ -0,0 +1,242 @@
+"""Re-warming of purged pages.
+
+When a content item of one of the ``rewarmContentTypes`` is purged, the URL
+of the item, and of its parent if the item is the parent's default page, are
+requested again once the purge has been sent. This is done through the
+caching proxies if purging is enabled, or directly otherwise, so that the
+page is cached again before the next visitor asks for it.
+
+If the purges go through the purge outbox, a URL is requested again as soon
+as the caching proxy has accepted its purge. Otherwise, the purges are sent
+in the background without reporting back, and the URLs are requested
+``rewarmDelay`` seconds after the transaction has been committed.
+"""
+
+from Acquisition import aq_base
+from Acquisition import aq_parent
+from concurrent.futures import ThreadPoolExecutor
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.utils import getObjectDefaultView
+from plone.cachepurging.interfaces import ICachePurgingSettings
+from plone.cachepurging.interfaces import IPurgePathRewriter
+from plone.cachepurging.utils import getURLsToPurge
+from plone.cachepurging.utils import isCachePurgingEnabled
+from plone.registry.interfaces import IRegistry
+from z3c.caching.interfaces import IPurgeEvent
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import queryUtility
+from zope.globalrequest import getRequest
+from ZPublisher.interfaces import IPubSuccess
+
+import logging
+import threading
+import time
+import urllib.request
+
+
+logger = logging.getLogger("plone.app.caching")
+
+KEY = "plone.app.caching.rewarm"
+
+# Bounds for the background requests
+MAX_WORKERS = 2
+INTERVAL = 0.2
+TIMEOUT = 30
+MAX_QUEUED = 1000
+USER_AGENT = "plone.app.caching re-warm"
+
+
+class Rewarmer:
+    """Requests URLs in a bounded pool of background threads.
+
+    Requests start ``delay`` seconds after they are scheduled, and at most
+    one request is started every ``interval`` seconds. A URL that is already
+    scheduled is not scheduled again, and no more than ``maxQueued`` URLs
+    wait at a time.
+    """
+
+    def __init__(
+        self,
+        maxWorkers=MAX_WORKERS,
+        interval=INTERVAL,
+        timeout=TIMEOUT,
+        maxQueued=MAX_QUEUED,
+    ):
+        self.maxWorkers = maxWorkers
+        self.interval = interval
+        self.timeout = timeout
+        self.maxQueued = maxQueued
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._throttleLock = threading.Lock()
+        self._lastRequest = 0.0
+        self._executor = None
+
+    def schedule(self, urls, delay=0):
+        """Schedule the given URLs to be requested. Each item is a URL, or a
+        ``(url, host)`` pair to send the request with the given ``Host``
+        header. Returns the futures of the URLs that were not scheduled yet.
+        """
+
+        due = time.time() + delay
+        futures = []
+        dropped = 0
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.maxWorkers,
+                    thread_name_prefix="plone.app.caching re-warm",
+                )
+            for url in urls:
+                if url in self._pending:
+                    continue
+                if len(self._pending) >= self.maxQueued:
+                    dropped += 1
+                    continue
+                self._pending.add(url)
+                futures.append(self._executor.submit(self._warm, url, due))
+
+        if dropped:
+            logger.warning("Too many pages waiting, not re-warming %d more", dropped)
+        return futures
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _warm(self, url, due):
+        try:
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+            with self._throttleLock:
+                wait = self._lastRequest + self.interval - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                self._lastRequest = time.time()
+        finally:
+            # A new purge of this URL may schedule it again from here on
+            with self._lock:
+                self._pending.discard(url)
+
+        host = None
+        if isinstance(url, tuple):
+            url, host = url
+
+        try:
+            return self.fetch(url, host)
+        except Exception:
+            logger.warning("Could not re-warm %s", url, exc_info=True)
+            return None
+
+    def fetch(self, url, host=None):
+        """Request the given URL anonymously and return the status. If
+        ``host`` is given, it is sent as the ``Host`` header.
+        """
+
+        headers = {"User-Agent": USER_AGENT}
+        if host:
+            headers["Host"] = host
+        request = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+            return response.status
+
+
+rewarmer = Rewarmer()
+
+
+def scheduleRewarm(urls, delay=0):
+    """Schedule the given URLs to be requested again by the re-warmer of this
+    process.
+    """
+    return rewarmer.schedule(urls, delay=delay)
+
+
+def getRewarmObjects(object):
+    """Return the objects to request again after the given object was purged:
+    the object itself, and its parent if it is the parent's default page.
+    """
+
+    objects = [object]
+
+    parent = aq_parent(object)
+    if parent is not None and getObjectDefaultView(parent) == object.getId():
+        objects.append(parent)
+
+    return objects
+
+
+@adapter(IPurgeEvent)
+def queueRewarm(event):
+    """Find the URLs to re-warm for a purged object, and queue them until the
+    end of the request.
+    """
+
+    request = getRequest()
+    if request is None:
+        return
+
+    annotations = IAnnotations(request, None)
+    if annotations is None:
+        return
+
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return
+
+    settings = registry.forInterface(IPloneCacheSettings, check=False)
+    if not settings.rewarmContentTypes:
+        return
+
+    object = event.object
+    portal_type = getattr(aq_base(object), "portal_type", None)
+    if portal_type not in settings.rewarmContentTypes:
+        return
+
+    proxies = None
+    if isCachePurgingEnabled(registry=registry):
+        purgingSettings = registry.forInterface(ICachePurgingSettings, check=False)
+        proxies = purgingSettings.cachingProxies
+
+    objects = getRewarmObjects(object)
+    if proxies:
+        # Request the pages through the caching proxies
+        rewriter = IPurgePathRewriter(request, None)
+        urls = set()
+        for obj in objects:
+            path = "/" + obj.virtual_url_path()
+            rewrittenPaths = [path] if rewriter is None else rewriter(path) or []
+            for rewrittenPath in rewrittenPaths:
+                urls.update(getURLsToPurge(rewrittenPath, proxies))
+    else:
+        urls = {obj.absolute_url() for obj in objects}
+
+    annotations.setdefault(KEY, set()).update(urls)
+
+
+@adapter(IPubSuccess)
+def rewarm(event):
+    """Schedule the queued URLs, after the transaction has been committed.
+    URLs that were handed to the purge outbox are left to it.
+    """
+
+    annotations = IAnnotations(event.request, None)
+    if annotations is None:
+        return
+
+    urls = annotations.get(KEY, None)
+    if not urls:
+        return
+
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return
+
+    settings = registry.forInterface(IPloneCacheSettings, check=False)
+    scheduleRewarm(sorted(urls), delay=settings.rewarmDelay or 0)
@@ -0,0 +1,192 @@
+"""Snapshot of the page RAM cache across restarts.
+
+If a snapshot file is configured, the most frequently hit pages in the RAM
+cache are written to it when the process shuts down gracefully. On the next
+start, they are loaded back into the RAM cache by a background thread, so that
+the slowest pages do not have to be rendered again before the cache is warm::
+
+    <product-config plone.app.caching>
+        ramcache-snapshot /var/cache/plone/instance1/ramcache.snapshot
+        ramcache-snapshot-size 1000
+    </product-config>
+
+This works with the ``zope.ramcache`` storage that Plone installs as a local
+utility. Its storage is identified by an id that is persisted in the ZODB, so
+the pages of a site are loaded back into the storage of the same site. The
+keys of the pages contain the ETag and last-modified date of the page, so
+pages that have changed in the meantime are never served.
+"""
+
+from App.config import getConfiguration
+from plone.app.caching.diskcache import PRODUCT_CONFIG_NAME
+from plone.app.caching.operations.utils import PAGE_CACHE_KEY
+from zope.component import adapter
+from zope.processlifetime import IProcessStarting
+from zope.ramcache import ram
+
+import atexit
+import logging
+import marshal
+import os
+import threading
+import time
+
+
+logger = logging.getLogger("plone.app.caching")
+
+DEFAULT_SNAPSHOT_SIZE = 1000
+SNAPSHOT_VERSION = 1
+
+# Number of seconds to wait for the RAM cache storage of a site to be created
+# by the first request using it, and interval between two checks
+PRELOAD_TIMEOUT = 3600
+PRELOAD_INTERVAL = 5.0
+
+
+def getSnapshotSettings():
+    """Return the path of the snapshot file and the maximum number of pages
+    in it, or ``(None, 0)`` if no snapshot file is configured.
+    """
+
+    productConfig = getattr(getConfiguration(), "product_config", None) or {}
+    config = productConfig.get(PRODUCT_CONFIG_NAME) or {}
+
+    path = config.get("ramcache-snapshot")
+    if not path:
+        return None, 0
+
+    try:
+        size = int(config.get("ramcache-snapshot-size", DEFAULT_SNAPSHOT_SIZE))
+    except ValueError:
+        size = DEFAULT_SNAPSHOT_SIZE
+    return path, size
+
+
+def dumpSnapshot(path, size, caches=None, globalKey=PAGE_CACHE_KEY):
+    """Write the ``size`` pages with the most hits in all RAM cache storages
+    to the snapshot file at ``path``. Returns the number of pages written.
+    """
+
+    if caches is None:
+        caches = ram.caches
+
+    now = time.time()
+    entries = []
+    for cacheId, storage in list(caches.items()):
+        pages = getattr(storage, "_data", {}).get(globalKey, {})
+        for key, data in list(pages.items()):
+            value = data.value
+            if len(value) > 4 and value[4] < now:
+                continue
+            entries.append((data.access_count, cacheId, key, value))
+
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "globalKey": globalKey,
+        "entries": [entry[1:] for entry in entries[:size]],
+    }
+
+    try:
+        data = marshal.dumps(snapshot)
+    except ValueError:
+        logger.exception("Cannot write RAM cache snapshot")
+        return 0
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(snapshot["entries"])
+
+
+def loadSnapshot(path):
+    """Read the snapshot file at ``path``. Returns a list of
+    ``(cacheId, key, value)`` tuples, most frequently hit first, and the
+    global cache key of the pages.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            snapshot = marshal.load(f)
+    except FileNotFoundError:
+        return [], None
+    except (OSError, EOFError, ValueError, TypeError):
+        logger.warning("Ignoring unreadable RAM cache snapshot %s", path)
+        return [], None
+
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return [], None
+    return snapshot["entries"], snapshot["globalKey"]
+
+
+def preloadSnapshot(entries, globalKey, caches=None):
+    """Load the given snapshot entries into the RAM cache storages that
+    exist. Pages already cached are left alone. Returns the entries whose
+    storage does not exist yet.
+    """
+
+    if caches is None:
+        caches = ram.caches
+
+    now = time.time()
+    pending = []
+    for cacheId, key, value in entries:
+        storage = caches.get(cacheId)
+        if storage is None:
+            pending.append((cacheId, key, value))
+            continue
+        if len(value) > 4 and value[4] < now:
+            continue
+        if key in getattr(storage, "_data", {}).get(globalKey, {}):
+            continue
+        storage.setEntry(globalKey, key, value)
+    return pending
+
+
+def preloadInBackground(path, timeout=PRELOAD_TIMEOUT, interval=PRELOAD_INTERVAL):
+    """Start a daemon thread loading the snapshot file at ``path``.
+
+    The storage of a RAM cache is only created by the first request that uses
+    it, with the settings of the site. Pages are loaded into a storage as soon
+    as it exists.
+    """
+
+    def run():
+        entries, globalKey = loadSnapshot(path)
+        deadline = time.time() + timeout
+        while entries:
+            try:
+                entries = preloadSnapshot(entries, globalKey)
+            except Exception:
+                logger.exception("Error loading RAM cache snapshot")
+                return
+            if not entries or time.time() > deadline:
+                return
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="plone.app.caching RAM cache preload")
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+@adapter(IProcessStarting)
+def processStarting(event):
+    """Preload the snapshot and make sure a new one is written on shutdown"""
+
+    path, size = getSnapshotSettings()
+    if not path:
+        return
+
+    preloadInBackground(path)
+    atexit.register(_dumpOnExit, path, size)
+
+
+def _dumpOnExit(path, size):
+    try:
+        count = dumpSnapshot(path, size)
+    except Exception:
+        logger.exception("Error writing RAM cache snapshot")
+    else:
+        logger.info("Wrote %d pages to RAM cache snapshot %s", count, path)
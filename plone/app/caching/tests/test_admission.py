@@ -0,0 +1,131 @@
+from io import StringIO
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.operations import admission
+from plone.memoize.interfaces import ICacheChooser
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.interface import classImplements
+from zope.interface import implementer
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+import unittest
+
+
+class TestCountMinSketch(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def test_estimate(self):
+        sketch = admission.CountMinSketch(width=64)
+        self.assertEqual(0, sketch.estimate("foo"))
+
+        self.assertEqual(1, sketch.increment("foo"))
+        self.assertEqual(2, sketch.increment("foo"))
+        sketch.increment("bar")
+
+        self.assertGreaterEqual(sketch.estimate("foo"), 2)
+        self.assertGreaterEqual(sketch.estimate("bar"), 1)
+
+        sketch.clear()
+        self.assertEqual(0, sketch.estimate("foo"))
+
+    def test_saturate(self):
+        sketch = admission.CountMinSketch(width=64)
+        for i in range(20):
+            sketch.increment("foo")
+        self.assertEqual(admission.MAX_COUNT, sketch.estimate("foo"))
+
+    def test_aging(self):
+        sketch = admission.CountMinSketch(width=64, sampleSize=10)
+        for i in range(8):
+            sketch.increment("foo")
+        self.assertEqual(8, sketch.estimate("foo"))
+
+        # The tenth increment halves all counters
+        sketch.increment("foo")
+        sketch.increment("foo")
+        self.assertEqual(5, sketch.estimate("foo"))
+
+
+class TestAdmission(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+        classImplements(HTTPRequest, IAttributeAnnotatable)
+
+        self.registry = Registry()
+        self.registry.registerInterface(IPloneCacheSettings)
+        provideUtility(self.registry, IRegistry)
+
+        oldSketch = admission.sketch
+        admission.sketch = admission.CountMinSketch(width=64)
+        self.addCleanup(setattr, admission, "sketch", oldSketch)
+
+    def test_admit_disabled(self):
+        self.assertTrue(admission.admit("foo"))
+        admission.recordRequest("foo")
+        self.assertEqual(0, admission.sketch.estimate("foo"))
+
+    def test_admit(self):
+        self.registry.forInterface(
+            IPloneCacheSettings
+        ).ramCacheAdmissionThreshold = 2
+
+        self.assertFalse(admission.admit("foo"))
+        admission.recordRequest("foo")
+        self.assertFalse(admission.admit("foo"))
+        admission.recordRequest("foo")
+        self.assertTrue(admission.admit("foo"))
+
+    def test_storeResponseInRAMCache(self):
+        from plone.app.caching.operations.utils import fetchFromRAMCache
+        from plone.app.caching.operations.utils import storeResponseInRAMCache
+
+        self.registry.forInterface(
+            IPloneCacheSettings
+        ).ramCacheAdmissionThreshold = 2
+
+        cache = {}
+
+        @implementer(ICacheChooser)
+        class Chooser:
+            def __call__(self, key):
+                return cache
+
+        provideUtility(Chooser())
+
+        def makeRequest():
+            environ = {
+                "SERVER_NAME": "example.com",
+                "SERVER_PORT": "80",
+                "PATH_INFO": "/foo",
+                "QUERY_STRING": "",
+            }
+            request = HTTPRequest(StringIO(), environ, HTTPResponse())
+            IAnnotations(request)[
+                "plone.app.caching.operations.ramcache.key"
+            ] = "|etag||http://example.com/foo?"
+            return request
+
+        # The first request for the page is not enough
+        request = makeRequest()
+        self.assertIsNone(fetchFromRAMCache(request, etag="etag"))
+        storeResponseInRAMCache(request, request.response, "Body")
+        self.assertEqual({}, cache)
+
+        # The second one is, regardless of the ETag
+        request = makeRequest()
+        self.assertIsNone(fetchFromRAMCache(request, etag="other"))
+        storeResponseInRAMCache(request, request.response, "Body")
+        self.assertEqual(["|etag||http://example.com/foo?"], list(cache))
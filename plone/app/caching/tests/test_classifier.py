@@ -0,0 +1,259 @@
+from io import StringIO
+from plone.app.caching.interfaces import IETagValue
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.interfaces import IRequestClassifier
+from plone.app.caching.operations import classifier
+from plone.app.caching.operations.default import BaseCaching
+from plone.caching.interfaces import ICachingOperationType
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from Products.CMFCore.interfaces import IMembershipTool
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.interface import classImplements
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.interface import provider
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+import unittest
+
+
+class DummyPublished:
+    def __init__(self, parent=None):
+        self.__parent__ = parent
+
+
+@implementer(IMembershipTool)
+class DummyPortalMembership:
+    def __init__(self, anonymous):
+        self.anonymous = anonymous
+
+    def isAnonymousUser(self):
+        return self.anonymous
+
+
+class TestRequestClassifier(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(classifier.RequestClassifier)
+        classImplements(HTTPRequest, IAttributeAnnotatable)
+
+        self.registry = Registry()
+        self.registry.registerInterface(IPloneCacheSettings)
+        provideUtility(self.registry, IRegistry)
+
+    def makeRequest(self, method="GET", **form):
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "REQUEST_METHOD": method,
+        }
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+        request.form.update(form)
+        request.other.update(form)
+        return request
+
+    def test_classify(self):
+        provideUtility(DummyPortalMembership(False))
+        published = DummyPublished()
+
+        request = self.makeRequest()
+        self.assertEqual(
+            classifier.CACHEABLE,
+            classifier.classifyRequest(published, request, "testrule"),
+        )
+
+        request = self.makeRequest("HEAD")
+        self.assertEqual(
+            classifier.CACHEABLE,
+            classifier.classifyRequest(published, request, "testrule"),
+        )
+
+        request = self.makeRequest("POST")
+        self.assertEqual(
+            classifier.STOP,
+            classifier.classifyRequest(published, request, "testrule"),
+        )
+
+        request = self.makeRequest(SearchableText="foo")
+        self.assertEqual(
+            classifier.STOP,
+            classifier.classifyRequest(published, request, "testrule"),
+        )
+
+        request = self.makeRequest()
+        self.assertEqual(
+            classifier.PRIVATE,
+            classifier.classifyRequest(published, request, "testrule", anonOnly=True),
+        )
+
+    def test_classify_anonymous(self):
+        provideUtility(DummyPortalMembership(True))
+        request = self.makeRequest()
+        self.assertEqual(
+            classifier.CACHEABLE,
+            classifier.classifyRequest(
+                DummyPublished(), request, "testrule", anonOnly=True
+            ),
+        )
+
+    def test_classify_custom_classifier(self):
+        calls = []
+
+        @implementer(IRequestClassifier)
+        @adapter(DummyPublished, Interface)
+        class CustomClassifier:
+            def __init__(self, published, request):
+                pass
+
+            def __call__(self, rulename, anonOnly=False):
+                calls.append(rulename)
+                return classifier.STOP
+
+        provideAdapter(CustomClassifier, provides=IRequestClassifier)
+
+        published = DummyPublished()
+        request = self.makeRequest()
+        self.assertEqual(
+            classifier.STOP,
+            classifier.classifyRequest(published, request, "testrule"),
+        )
+
+        # The decision is remembered for the rest of the request
+        self.assertEqual(
+            classifier.STOP,
+            classifier.classifyRequest(published, request, "testrule"),
+        )
+        self.assertEqual(["testrule"], calls)
+
+    def test_interceptResponse_skips_validators(self):
+        calls = []
+
+        @implementer(IETagValue)
+        @adapter(Interface, Interface)
+        class Counter:
+            def __init__(self, published, request):
+                pass
+
+            def __call__(self):
+                calls.append(1)
+                return "1"
+
+        provideAdapter(Counter, name="counter")
+
+        @provider(ICachingOperationType)
+        class Caching(BaseCaching):
+            etags = ("counter",)
+
+        published = DummyPublished()
+
+        request = self.makeRequest("POST")
+        request.environ["HTTP_IF_NONE_MATCH"] = '"|1"'
+        operation = Caching(published, request)
+        self.assertIsNone(operation.interceptResponse("testrule", request.response))
+        self.assertEqual([], calls)
+
+        request = self.makeRequest()
+        request.environ["HTTP_IF_NONE_MATCH"] = '"|1"'
+        operation = Caching(published, request)
+        self.assertEqual("", operation.interceptResponse("testrule", request.response))
+        self.assertEqual(304, request.response.getStatus())
+        self.assertEqual([1], calls)
+
+        # HEAD requests are validated in the same way
+        request = self.makeRequest("HEAD")
+        request.environ["HTTP_IF_NONE_MATCH"] = '"|1"'
+        operation = Caching(published, request)
+        self.assertEqual("", operation.interceptResponse("testrule", request.response))
+        self.assertEqual(304, request.response.getStatus())
+
+    def test_modifyResponse_not_found(self):
+        from plone.registry import field
+        from plone.registry import Record
+
+        provideUtility(DummyPortalMembership(True))
+
+        @provider(ICachingOperationType)
+        class Caching(BaseCaching):
+            pass
+
+        prefix = "plone.app.caching.baseCaching"
+        self.registry.records[prefix + ".notFoundTTL"] = Record(field.Int(), 60)
+
+        published = DummyPublished()
+
+        request = self.makeRequest()
+        request.response.setStatus(404)
+        Caching(published, request).modifyResponse("testrule", request.response)
+        self.assertEqual(
+            "max-age=0, s-maxage=60, must-revalidate",
+            request.response.getHeader("Cache-Control"),
+        )
+
+        # Requests with cache stop variables are never cached
+        request = self.makeRequest(SearchableText="foo")
+        request.response.setStatus(404)
+        Caching(published, request).modifyResponse("testrule", request.response)
+        self.assertEqual(
+            "max-age=0, must-revalidate, private",
+            request.response.getHeader("Cache-Control"),
+        )
+
+        # Other responses use the normal settings
+        request = self.makeRequest()
+        Caching(published, request).modifyResponse("testrule", request.response)
+        self.assertNotIn("s-maxage", request.response.getHeader("Cache-Control"))
+
+    def test_modifyResponse_stop_skips_validators(self):
+        from plone.registry import field
+        from plone.registry import Record
+        from z3c.caching.interfaces import ILastModified
+
+        calls = []
+
+        @implementer(ILastModified)
+        @adapter(DummyPublished)
+        class LastModified:
+            def __init__(self, context):
+                pass
+
+            def __call__(self):
+                calls.append(1)
+                return None
+
+        provideAdapter(LastModified)
+
+        @provider(ICachingOperationType)
+        class Caching(BaseCaching):
+            pass
+
+        prefix = "plone.app.caching.baseCaching"
+        self.registry.records[prefix + ".maxage"] = Record(field.Int(), 60)
+        self.registry.records[prefix + ".lastModified"] = Record(field.Bool(), True)
+
+        published = DummyPublished()
+
+        # Without ETags, stopped requests are kept out of all caches
+        request = self.makeRequest("POST")
+        Caching(published, request).modifyResponse("testrule", request.response)
+        self.assertEqual(
+            "max-age=0, must-revalidate, private",
+            request.response.getHeader("Cache-Control"),
+        )
+        self.assertEqual([], calls)
+
+        request = self.makeRequest()
+        Caching(published, request).modifyResponse("testrule", request.response)
+        self.assertEqual([1], calls)
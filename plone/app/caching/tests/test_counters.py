@@ -0,0 +1,179 @@
+from io import StringIO
+from plone.app.caching import counters
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from Products.CMFCore.interfaces import IContentish
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import getGlobalSiteManager
+from zope.component import provideAdapter
+from zope.component import provideHandler
+from zope.component import provideUtility
+from zope.component.event import objectEventNotify
+from zope.component.hooks import setSite
+from zope.event import notify
+from zope.interface import implementer
+from zope.lifecycleevent import ObjectModifiedEvent
+from zope.lifecycleevent import ObjectMovedEvent
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+import unittest
+
+
+@implementer(IAttributeAnnotatable, IContentish)
+class DummySite:
+    def getPhysicalPath(self):
+        return ("", "plone")
+
+    def getSiteManager(self):
+        return getGlobalSiteManager()
+
+
+@implementer(IContentish)
+class DummyContent:
+    def __init__(self, path, parent=None):
+        self.path = path
+        self.__parent__ = parent
+
+    def getPhysicalPath(self):
+        return self.path
+
+
+class DummyPublished:
+    def __init__(self, parent=None):
+        self.__parent__ = parent
+
+
+class TestCounters(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+        provideUtility(Registry(), IRegistry)
+        self.site = DummySite()
+        setSite(self.site)
+
+    def tearDown(self):
+        setSite(None)
+
+    def test_counter(self):
+        self.assertEqual(0, counters.getCounter("foo"))
+        self.assertEqual(1, counters.incrementCounter("foo"))
+        self.assertEqual(2, counters.incrementCounter("foo"))
+        self.assertEqual(2, counters.getCounter("foo"))
+        self.assertEqual(0, counters.getCounter("bar"))
+
+    def test_section_counters(self):
+        news = ("", "plone", "news")
+        item = ("", "plone", "news", "2020", "item")
+        events = ("", "plone", "events", "party")
+
+        self.assertEqual("0.0", counters.getSectionCounterValue(DummyContent(news)))
+
+        counters.incrementSectionCounters(item)
+        self.assertEqual("0.1", counters.getSectionCounterValue(DummyContent(news)))
+        self.assertEqual("0.1", counters.getSectionCounterValue(DummyContent(item)))
+        self.assertEqual("0.0", counters.getSectionCounterValue(DummyContent(events)))
+
+        # The site root sees every change
+        root = DummyContent(("", "plone"))
+        self.assertEqual("0.1", counters.getSectionCounterValue(root))
+        counters.incrementSectionCounters(events)
+        self.assertEqual("0.2", counters.getSectionCounterValue(root))
+        self.assertEqual("0.1", counters.getSectionCounterValue(DummyContent(news)))
+
+        # Changes directly in the site root affect every section
+        counters.incrementSectionCounters(("", "plone", "about"))
+        self.assertEqual("1.1", counters.getSectionCounterValue(DummyContent(news)))
+        self.assertEqual("1.1", counters.getSectionCounterValue(DummyContent(events)))
+
+        # Content outside the site is ignored
+        counters.incrementSectionCounters(("", "other", "news"))
+        self.assertEqual("1.1", counters.getSectionCounterValue(DummyContent(news)))
+        self.assertIsNone(
+            counters.getSectionCounterValue(DummyContent(("", "other", "news")))
+        )
+
+    def test_section_counters_depth(self):
+        registry = self.site.registry = Registry()
+        provideUtility(registry, IRegistry)
+        registry.registerInterface(IPloneCacheSettings)
+        registry.forInterface(IPloneCacheSettings).sectionCounterDepth = 2
+
+        year = DummyContent(("", "plone", "news", "2020"))
+        otherYear = DummyContent(("", "plone", "news", "2021"))
+        news = DummyContent(("", "plone", "news"))
+
+        counters.incrementSectionCounters(("", "plone", "news", "2020", "item"))
+        self.assertEqual("0.1", counters.getSectionCounterValue(year))
+        self.assertEqual("0.0", counters.getSectionCounterValue(otherYear))
+        self.assertEqual("0.1", counters.getSectionCounterValue(news))
+
+    def test_event_handlers(self):
+        provideHandler(objectEventNotify)
+        provideHandler(counters.contentModified)
+        provideHandler(counters.contentMoved)
+
+        news = DummyContent(("", "plone", "news"))
+        events = DummyContent(("", "plone", "events"))
+        item = DummyContent(("", "plone", "news", "item"), news)
+
+        notify(ObjectModifiedEvent(item))
+        self.assertEqual("0.1", counters.getSectionCounterValue(news))
+        self.assertEqual("0.0", counters.getSectionCounterValue(events))
+
+        # Moving the item changes both the old and the new section
+        item.path = ("", "plone", "events", "item")
+        notify(ObjectMovedEvent(item, news, "item", events, "item"))
+        self.assertEqual("0.2", counters.getSectionCounterValue(news))
+        self.assertEqual("0.1", counters.getSectionCounterValue(events))
+
+    def test_SectionCounter_etag(self):
+        from plone.app.caching.operations.etags import SectionCounter
+
+        environ = {"SERVER_NAME": "example.com", "SERVER_PORT": "80"}
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+        context = DummyContent(("", "plone", "news"))
+        published = DummyPublished(context)
+
+        etag = SectionCounter(published, request)
+        self.assertEqual("0.0", etag())
+
+        counters.incrementSectionCounters(("", "plone", "news", "item"))
+        self.assertEqual("0.1", etag())
+
+        counters.incrementCounter(counters.SITE_COUNTER)
+        self.assertEqual("1.1", etag())
+
+    def test_purgeRAMCache(self):
+        from plone.app.caching.operations.utils import getRAMCacheKey
+        from plone.registry import field
+        from plone.registry import Record
+        from plone.registry.events import RecordModifiedEvent
+
+        environ = {"SERVER_NAME": "example.com", "SERVER_PORT": "80"}
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        self.assertEqual("|etag||http://example.com?", getRAMCacheKey(request, "etag"))
+
+        self.assertEqual(1, counters.purgeRAMCache())
+        self.assertEqual(
+            "|generation:1|||etag||http://example.com?",
+            getRAMCacheKey(request, "etag"),
+        )
+
+        # Changes to the theme purge the cache as well, other settings do not
+        record = Record(field.TextLine(), "foo")
+        record.__name__ = "plone.app.theming.interfaces.IThemeSettings.rules"
+        counters.themeSettingsModified(RecordModifiedEvent(record, "bar", "foo"))
+        self.assertEqual(2, counters.getCounter(counters.RAM_CACHE_GENERATION_COUNTER))
+
+        record.__name__ = "plone.app.caching.interfaces.IPloneCacheSettings.foo"
+        counters.themeSettingsModified(RecordModifiedEvent(record, "bar", "foo"))
+        self.assertEqual(2, counters.getCounter(counters.RAM_CACHE_GENERATION_COUNTER))
@@ -0,0 +1,184 @@
+from plone.app.caching import dependencies
+from plone.app.caching import invalidation
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.tests.test_invalidation import DummySite
+from plone.app.caching.tests.test_rewarm import AnnotatableRequest
+from plone.cachepurging.hooks import KEY
+from plone.cachepurging.interfaces import ICachePurgingSettings
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from plone.uuid.interfaces import IUUID
+from Products.PluginIndexes.FieldIndex.FieldIndex import FieldIndex
+from Products.ZCatalog.ZCatalog import ZCatalog
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAnnotations
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.component.hooks import setSite
+from zope.globalrequest import setRequest
+from zope.interface import implementer
+from zope.interface import Interface
+
+import transaction
+import unittest
+
+
+class DummyContent:
+    def __init__(self, uid):
+        self.UID = uid
+
+
+@implementer(IUUID)
+@adapter(Interface)
+def dummyUUID(context):
+    return getattr(context, "UID", None)
+
+
+class TestDependentPaths(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def test_record(self):
+        paths = dependencies.DependentPaths(maxUIDs=2, maxPaths=2)
+        paths.record("a", "/plone/listing")
+        paths.record("a", "/plone/news")
+        paths.record("a", "/plone/events")
+        paths.record("b", "/plone/listing")
+        paths.record("a", "/plone/listing")
+        paths.record("c", "/plone/listing")
+
+        # Paths beyond the maximum are ignored, and the oldest UIDs forgotten
+        self.assertEqual({"/plone/listing", "/plone/news"}, paths.pop("a"))
+        self.assertEqual(set(), paths.pop("b"))
+        self.assertEqual({"/plone/listing"}, paths.pop("c"))
+        self.assertEqual(set(), paths.pop("c"))
+
+
+class TestDependencyTracking(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(dummyUUID)
+
+        self.registry = Registry()
+        self.registry.registerInterface(IPloneCacheSettings)
+        self.registry.registerInterface(ICachePurgingSettings)
+        provideUtility(self.registry, IRegistry)
+        self.registry.forInterface(IPloneCacheSettings).trackDependencies = True
+
+        self.request = AnnotatableRequest()
+        self.request.update(
+            {
+                "REQUEST_METHOD": "GET",
+                "SERVER_URL": "http://example.com",
+                "ACTUAL_URL": "http://example.com/plone/news",
+            }
+        )
+        setRequest(self.request)
+        self.addCleanup(setRequest, None)
+        self.addCleanup(dependencies.stopTracking)
+
+        oldPaths = dependencies.dependentPaths
+        dependencies.dependentPaths = dependencies.DependentPaths()
+        self.addCleanup(setattr, dependencies, "dependentPaths", oldPaths)
+        self.addCleanup(invalidation.dependentPages.clear)
+
+    def test_tracking(self):
+        dependencies.startTracking(self.request, DummyContent("news"))
+        dependencies.recordDependency("a")
+        dependencies.recordDependency(None)
+        dependencies.finishTracking(self.request, True, "global", "page1")
+
+        # Nothing is recorded once tracking has finished
+        dependencies.recordDependency("b")
+
+        self.assertEqual(
+            {("global", "page1")}, invalidation.dependentPages.pop("uid:a")
+        )
+        self.assertEqual(
+            {("global", "page1")}, invalidation.dependentPages.pop("uid:news")
+        )
+        self.assertEqual(set(), invalidation.dependentPages.pop("uid:b"))
+        self.assertEqual({"/plone/news"}, dependencies.dependentPaths.pop("a"))
+
+    def test_tracking_failure(self):
+        dependencies.startTracking(self.request)
+        dependencies.recordDependency("a")
+        dependencies.finishTracking(self.request, False, "global", "page1")
+
+        self.assertEqual(set(), invalidation.dependentPages.pop("uid:a"))
+        self.assertEqual(set(), dependencies.dependentPaths.pop("a"))
+
+    def test_tracking_other_request(self):
+        # Tracking left over from an earlier request is dropped
+        dependencies.startTracking(AnnotatableRequest())
+        dependencies.recordDependency("a")
+        self.assertEqual(set(), dependencies.stopTracking())
+
+    def test_getPurgePath(self):
+        self.assertEqual("/plone/news", dependencies.getPurgePath(self.request))
+
+        self.request["QUERY_STRING"] = "b_start=20"
+        self.assertEqual(
+            "/plone/news?b_start=20", dependencies.getPurgePath(self.request)
+        )
+
+        self.request["REQUEST_METHOD"] = "POST"
+        self.assertIsNone(dependencies.getPurgePath(self.request))
+
+    def test_catalog(self):
+        dependencies.installCatalogHook()
+        dependencies.installCatalogHook()
+
+        catalog = ZCatalog("portal_catalog")
+        catalog.addColumn("UID")
+        catalog._catalog.addIndex("UID", FieldIndex("UID"))
+        catalog.catalog_object(DummyContent("a"), uid="/plone/a")
+        catalog.catalog_object(DummyContent("b"), uid="/plone/b")
+
+        # Brains are only recorded while tracking
+        self.assertEqual(1, len(list(catalog.searchResults(UID="a"))))
+
+        dependencies.startTracking(self.request)
+        results = catalog.searchResults(UID=["a", "b"])
+        self.assertEqual(2, len(results))
+        self.assertEqual(set(), dependencies.stopTracking(self.request))
+
+        dependencies.startTracking(self.request)
+        [brain.getPath() for brain in catalog.searchResults(UID=["a", "b"])]
+        self.assertEqual({"a", "b"}, dependencies.stopTracking(self.request))
+
+    def test_contentModified(self):
+        site = DummySite()
+        setSite(site)
+        self.addCleanup(setSite, None)
+
+        settings = self.registry.forInterface(ICachePurgingSettings)
+        settings.enabled = True
+        settings.cachingProxies = ("http://proxy1",)
+
+        dependencies.dependentPaths.record("a", "/plone/news")
+        dependencies.dependentPaths.record("a", "/plone/events")
+
+        transaction.begin()
+        dependencies.contentModified(DummyContent("a"), None)
+        self.assertEqual(
+            {"/plone/news", "/plone/events"}, IAnnotations(self.request)[KEY]
+        )
+        transaction.commit()
+
+        log, count = invalidation.getInvalidationLog(site)
+        self.assertEqual([(("uid:a", False),)], list(log.values()))
+
+    def test_disabled(self):
+        self.registry.forInterface(IPloneCacheSettings).trackDependencies = False
+        dependencies.dependentPaths.record("a", "/plone/news")
+
+        dependencies.contentModified(DummyContent("a"), None)
+        self.assertEqual({"/plone/news"}, dependencies.dependentPaths.pop("a"))
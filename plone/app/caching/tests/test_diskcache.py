@@ -0,0 +1,242 @@
+from plone.app.caching import diskcache
+from plone.testing.zca import UNIT_TESTING
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class TestDiskCache(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def makeCache(self, **kwargs):
+        cache = diskcache.DiskCache(self.directory, **kwargs)
+        # Write the pages by calling ``flush()`` in the tests
+        cache.start = lambda: None
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_get_set(self):
+        cache = self.makeCache()
+        self.assertIsNone(cache.get("foo"))
+        self.assertRaises(KeyError, cache.__getitem__, "foo")
+
+        cache["foo"] = (200, {"x-foo": "bar"}, b"Body", 0)
+        cache["bar"] = (200, {}, b"Other", 1)
+        cache["foo"] = (200, {"x-foo": "baz"}, b"New body", 0)
+
+        self.assertEqual(2, len(cache))
+        self.assertIn("foo", cache)
+        self.assertEqual((200, {"x-foo": "baz"}, b"New body", 0), cache["foo"])
+        self.assertEqual((200, {}, b"Other", 1), cache.get("bar"))
+
+    def test_pending(self):
+        cache = self.makeCache()
+        cache["foo"] = (200, {}, b"Body", 0)
+        cache["bar"] = (200, {}, b"Other", 0)
+        cache.discard("bar")
+
+        # Pages are served before they are written
+        self.assertEqual(0, cache.size())
+        self.assertEqual(1, len(cache))
+        self.assertEqual((200, {}, b"Body", 0), cache["foo"])
+        self.assertNotIn("bar", cache)
+
+        cache.flush()
+        self.assertGreater(cache.size(), 0)
+        self.assertEqual(1, len(cache))
+        self.assertEqual((200, {}, b"Body", 0), cache["foo"])
+        self.assertNotIn("bar", cache)
+
+    def test_writer(self):
+        cache = diskcache.DiskCache(self.directory)
+        self.addCleanup(cache.close)
+        cache["foo"] = (200, {}, b"Body", 0)
+
+        # The page is written in the background
+        deadline = time.time() + 5
+        while not cache.size() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertGreater(cache.size(), 0)
+        cache.close()
+
+        cache = self.makeCache()
+        self.assertEqual((200, {}, b"Body", 0), cache["foo"])
+
+    def test_reopen(self):
+        cache = self.makeCache()
+        cache["foo"] = (200, {"x-foo": "bar"}, b"Body", 0)
+        cache.close()
+
+        cache = self.makeCache()
+        self.assertEqual((200, {"x-foo": "bar"}, b"Body", 0), cache["foo"])
+
+    def test_discard(self):
+        cache = self.makeCache()
+        cache["foo"] = (200, {}, b"Body", 0)
+        cache["bar"] = (200, {}, b"Other", 0)
+        cache.discard("foo")
+        cache.discard("baz")
+
+        self.assertNotIn("foo", cache)
+        self.assertEqual(1, len(cache))
+        cache.close()
+
+        # The key stays removed
+        cache = self.makeCache()
+        self.assertIsNone(cache.get("foo"))
+        self.assertEqual((200, {}, b"Other", 0), cache["bar"])
+
+    def test_locked(self):
+        if diskcache.fcntl is None:
+            return
+
+        self.makeCache()
+        self.assertRaises(OSError, diskcache.DiskCache, self.directory)
+
+    def test_truncated(self):
+        cache = self.makeCache()
+        cache["foo"] = (200, {}, b"Body", 0)
+        cache["bar"] = (200, {}, b"Other", 0)
+        cache.flush()
+        size = cache.size()
+        cache.close()
+
+        # Simulate a crash while writing the last record
+        with open(os.path.join(self.directory, diskcache.SEGMENT_FILENAME), "r+b") as f:
+            f.truncate(size - 3)
+
+        cache = self.makeCache()
+        self.assertEqual((200, {}, b"Body", 0), cache["foo"])
+        self.assertNotIn("bar", cache)
+
+        cache["bar"] = (200, {}, b"Other", 0)
+        self.assertEqual((200, {}, b"Other", 0), cache["bar"])
+
+    def test_checksum(self):
+        cache = self.makeCache()
+        cache["foo"] = (200, {}, b"Body", 0)
+        cache.close()
+
+        with open(os.path.join(self.directory, diskcache.SEGMENT_FILENAME), "r+b") as f:
+            f.seek(-2, os.SEEK_END)
+            f.write(b"XX")
+
+        cache = self.makeCache()
+        self.assertIsNone(cache.get("foo"))
+
+    def test_expires(self):
+        cache = self.makeCache()
+        cache["foo"] = (302, {}, b"", 0, time.time() + 60)
+        cache["bar"] = (302, {}, b"", 0, time.time() - 60)
+
+        self.assertEqual(302, cache["foo"][0])
+        self.assertIsNone(cache.get("bar"))
+
+    def test_compact(self):
+        cache = self.makeCache(maxSize=1000)
+        for i in range(20):
+            cache[f"key{i}"] = (200, {}, b"x" * 50, 0)
+        cache.flush()
+
+        self.assertLessEqual(cache.size(), 1000)
+        self.assertLess(len(cache), 20)
+
+        # The most recently stored pages are kept
+        self.assertEqual((200, {}, b"x" * 50, 0), cache["key19"])
+        self.assertIsNone(cache.get("key0"))
+
+    def test_compact_large(self):
+        cache = self.makeCache(maxSize=1000)
+        for i in range(10):
+            cache[f"key{i}"] = (200, {}, b"x" * 50, 0)
+        cache.flush()
+
+        # A page filling more than half of the file replaces all others
+        cache["key9"] = (200, {}, b"y" * 700, 0)
+        cache.flush()
+        self.assertLessEqual(cache.size(), 1000)
+        self.assertEqual((200, {}, b"y" * 700, 0), cache["key9"])
+        self.assertIsNone(cache.get("key8"))
+
+        # A page larger than the file is not stored, and the page stored
+        # before is removed
+        cache["key9"] = (200, {}, b"z" * 2000, 0)
+        cache.flush()
+        self.assertLessEqual(cache.size(), 1000)
+        self.assertNotIn("key9", cache)
+
+    def test_compact_unlocked(self):
+        cache = self.makeCache(maxSize=1000)
+        read = cache._read
+        blocked = []
+
+        def tryLock():
+            if cache._lock.acquire(blocking=False):
+                cache._lock.release()
+                blocked.append(False)
+            else:
+                blocked.append(True)
+
+        def readAndTryLock(position, end=None, data=None):
+            thread = threading.Thread(target=tryLock)
+            thread.start()
+            thread.join()
+            return read(position, end, data)
+
+        cache._read = readAndTryLock
+        for i in range(20):
+            cache[f"key{i}"] = (200, {}, b"x" * 50, 0)
+        cache.flush()
+
+        # Readers are not blocked while the entries are copied
+        self.assertIn(False, blocked)
+        self.assertNotIn(True, blocked)
+        self.assertEqual((200, {}, b"x" * 50, 0), cache["key19"])
+
+    def test_clear(self):
+        cache = self.makeCache()
+        cache["foo"] = (200, {}, b"Body", 0)
+        cache.clear()
+
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.size())
+        self.assertIsNone(cache.get("foo"))
+
+    def test_getDiskCache(self):
+        from App.config import getConfiguration
+
+        self.addCleanup(diskcache.setDiskCache, None)
+
+        config = getConfiguration()
+        oldProductConfig = getattr(config, "product_config", None)
+        self.addCleanup(setattr, config, "product_config", oldProductConfig)
+
+        config.product_config = {}
+        diskcache.setDiskCache(None)
+        self.assertIsNone(diskcache.getDiskCache())
+
+        config.product_config = {
+            "plone.app.caching": {
+                "diskcache-directory": self.directory,
+                "diskcache-size": "1",
+            }
+        }
+
+        # The configuration is only read once
+        self.assertIsNone(diskcache.getDiskCache())
+
+        diskcache.setDiskCache(None)
+        cache = diskcache.getDiskCache()
+        self.addCleanup(cache.close)
+        self.assertEqual(self.directory, cache.directory)
+        self.assertEqual(1024 * 1024, cache.maxSize)
+        self.assertIs(cache, diskcache.getDiskCache())
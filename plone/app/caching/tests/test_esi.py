@@ -0,0 +1,272 @@
+from io import StringIO
+from plone.app.caching import esi
+from plone.app.caching.browser.esi import ESIFragment
+from plone.app.caching.interfaces import IETagValue
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.lookup import FragmentLookup
+from plone.app.caching.operations.default import BaseCaching
+from plone.app.caching.tests.test_rendercost import PublicView
+from plone.app.caching.tests.test_rendercost import Version
+from plone.caching.interfaces import ICachingOperationType
+from plone.portlets.manager import PortletManagerRenderer
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from Products.CMFCore.interfaces import IMembershipTool
+from Products.Five.viewlet.manager import ViewletManagerBase
+from zExceptions import NotFound
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.contentprovider.interfaces import IContentProvider
+from zope.interface import alsoProvides
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.interface import provider
+from zope.viewlet.interfaces import IViewlet
+from zope.viewlet.interfaces import IViewletManager
+from zope.viewlet.manager import ViewletManager
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+import unittest
+
+
+class DummyContent:
+    def absolute_url(self):
+        return "http://example.com/plone/news"
+
+
+class DummyViewlet:
+    __allow_access_to_unprotected_subobjects__ = True
+
+    def __init__(self, context, request, view, manager):
+        self.context = context
+        self.request = request
+        self.__parent__ = view
+        self.manager = manager
+
+    def update(self):
+        self.updated = True
+
+    def render(self):
+        return f"<p>{self.__name__}</p>"
+
+
+class PersonalBar(DummyViewlet):
+    __name__ = "plone.personal_bar"
+
+
+class Logo(DummyViewlet):
+    __name__ = "plone.logo"
+
+
+@implementer(IMembershipTool)
+class DummyMembershipTool:
+    def isAnonymousUser(self):
+        return False
+
+
+@implementer(IETagValue)
+@adapter(Interface, Interface)
+class UserID:
+    def __init__(self, published, request):
+        pass
+
+    def __call__(self):
+        return "member1"
+
+
+@provider(ICachingOperationType)
+class SharedCaching(BaseCaching):
+    options = ("etags", "lastModified", "ramCache", "anonOnly")
+    smaxage = 3600
+    etags = ("userid", "version")
+    vary = "X-Anonymous"
+
+
+class DummyPortletManager:
+    __name__ = "plone.rightcolumn"
+
+
+class DummyPortletManagerRenderer(PortletManagerRenderer):
+    def portletsToShow(self):
+        return []
+
+    def render(self):
+        return "<aside>Portlets</aside>"
+
+
+PortalTop = ViewletManager(
+    "plone.portaltop", IViewletManager, bases=(ViewletManagerBase,)
+)
+
+
+class TestESI(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+
+        self.registry = Registry()
+        self.registry.registerInterface(IPloneCacheSettings)
+        provideUtility(self.registry, IRegistry)
+        self.registry.forInterface(IPloneCacheSettings).esiFragments = (
+            "plone.portaltop/plone.personal_bar",
+            "plone.rightcolumn",
+        )
+
+        provideAdapter(
+            PersonalBar,
+            (Interface, Interface, Interface, IViewletManager),
+            IViewlet,
+            name="plone.personal_bar",
+        )
+        provideAdapter(
+            Logo,
+            (Interface, Interface, Interface, IViewletManager),
+            IViewlet,
+            name="plone.logo",
+        )
+        provideAdapter(
+            PortalTop,
+            (Interface, Interface, Interface),
+            IContentProvider,
+            name="plone.portaltop",
+        )
+
+        esi.installManagerHooks()
+        self.context = DummyContent()
+
+    def makeRequest(self, esi=True, **form):
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "PATH_INFO": "/plone/news",
+            "QUERY_STRING": "",
+        }
+        if esi:
+            environ["HTTP_SURROGATE_CAPABILITY"] = 'varnish="ESI/1.0"'
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        request.form.update(form)
+        alsoProvides(request, IAttributeAnnotatable)
+        return request
+
+    def test_getFragments(self):
+        self.assertEqual(
+            {"plone.portaltop/plone.personal_bar", "plone.rightcolumn"},
+            esi.getFragments(self.makeRequest()),
+        )
+
+        # Only if the caching proxy processes ESI
+        self.assertEqual(frozenset(), esi.getFragments(self.makeRequest(esi=False)))
+
+        request = self.makeRequest()
+        esi.renderFragmentsInline(request)
+        self.assertEqual(frozenset(), esi.getFragments(request))
+
+    def test_viewlets(self):
+        request = self.makeRequest()
+        manager = PortalTop(self.context, request, None)
+        manager.update()
+
+        self.assertEqual(
+            '<p>plone.logo</p>\n<esi:include src="http://example.com/plone/news'
+            '/@@esi-fragment?name=plone.portaltop%2Fplone.personal_bar" />',
+            manager.render(),
+        )
+        self.assertEqual(
+            'content="ESI/1.0"', request.response.getHeader("Surrogate-Control")
+        )
+
+    def test_viewlets_without_esi(self):
+        request = self.makeRequest(esi=False)
+        manager = PortalTop(self.context, request, None)
+        manager.update()
+
+        self.assertEqual(
+            "<p>plone.logo</p>\n<p>plone.personal_bar</p>", manager.render()
+        )
+        self.assertIsNone(request.response.getHeader("Surrogate-Control"))
+
+    def test_portlets(self):
+        renderer = DummyPortletManagerRenderer(
+            self.context, self.makeRequest(), None, DummyPortletManager()
+        )
+        renderer.update()
+        self.assertEqual(
+            '<esi:include src="http://example.com/plone/news'
+            '/@@esi-fragment?name=plone.rightcolumn" />',
+            renderer.render(),
+        )
+
+        renderer = DummyPortletManagerRenderer(
+            self.context, self.makeRequest(esi=False), None, DummyPortletManager()
+        )
+        renderer.update()
+        self.assertEqual("<aside>Portlets</aside>", renderer.render())
+
+    def test_fragment(self):
+        request = self.makeRequest(name="plone.portaltop/plone.personal_bar")
+        view = ESIFragment(self.context, request)
+        self.assertEqual("<p>plone.personal_bar</p>", view())
+
+    def test_fragment_not_configured(self):
+        request = self.makeRequest(name="plone.portaltop/plone.logo")
+        view = ESIFragment(self.context, request)
+        self.assertRaises(NotFound, view)
+
+    def test_fragment_lookup(self):
+        request = self.makeRequest(name="plone.portaltop/plone.personal_bar")
+        view = ESIFragment(self.context, request)
+        self.assertEqual("plone.content.fragment", FragmentLookup(view, request)())
+
+        settings = self.registry.forInterface(IPloneCacheSettings)
+        settings.templateRulesetMapping = {
+            "plone.portaltop/plone.personal_bar": "plone.personalBar"
+        }
+        self.assertEqual("plone.personalBar", FragmentLookup(view, request)())
+
+    def test_shared_shell(self):
+        provideAdapter(UserID, name="userid")
+        provideAdapter(Version, name="version")
+        provideUtility(DummyMembershipTool(), IMembershipTool)
+
+        # The shell of a page for an authenticated user is shared
+        request = self.makeRequest()
+        SharedCaching(PublicView(), request).modifyResponse(
+            "plone.content.itemView", request.response
+        )
+        self.assertEqual(
+            "max-age=0, s-maxage=3600, must-revalidate",
+            request.response.getHeader("Cache-Control"),
+        )
+        self.assertNotIn("member1", request.response.getHeader("ETag", literal=True))
+
+        # Complete pages and fragments are cached per user
+        request = self.makeRequest(esi=False)
+        SharedCaching(PublicView(), request).modifyResponse(
+            "plone.content.itemView", request.response
+        )
+        self.assertEqual(
+            "max-age=0, must-revalidate, private",
+            request.response.getHeader("Cache-Control"),
+        )
+
+        request = self.makeRequest()
+        view = ESIFragment(self.context, request)
+        view.__parent__ = None
+        view._View_Permission = ("Anonymous",)
+        SharedCaching(view, request).modifyResponse(
+            "plone.content.fragment", request.response
+        )
+        self.assertEqual(
+            "max-age=0, must-revalidate, private",
+            request.response.getHeader("Cache-Control"),
+        )
+        self.assertIn("member1", request.response.getHeader("ETag", literal=True))
@@ -395,3 +395,34 @@ class TestETags(unittest.TestCase):
         etag = Layout(published, request)
 
         self.assertEqual("hello_view", etag())
+
+    def test_EdgeSideIncludes(self):
+        from plone.app.caching.interfaces import IPloneCacheSettings
+        from plone.app.caching.operations.etags import EdgeSideIncludes
+        from plone.registry import Registry
+        from plone.registry.interfaces import IRegistry
+        from zope.annotation.attribute import AttributeAnnotations
+        from zope.annotation.interfaces import IAttributeAnnotatable
+        from zope.interface import alsoProvides
+
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+        registry = Registry()
+        registry.registerInterface(IPloneCacheSettings)
+        provideUtility(registry, IRegistry)
+        settings = registry.forInterface(IPloneCacheSettings)
+        settings.esiFragments = ("plone.portaltop/plone.personal_bar",)
+
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "HTTP_SURROGATE_CAPABILITY": 'varnish="ESI/1.0"',
+        }
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        alsoProvides(request, IAttributeAnnotatable)
+        self.assertEqual("1", EdgeSideIncludes(DummyPublished(), request)())
+
+        del environ["HTTP_SURROGATE_CAPABILITY"]
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        alsoProvides(request, IAttributeAnnotatable)
+        self.assertEqual("0", EdgeSideIncludes(DummyPublished(), request)())
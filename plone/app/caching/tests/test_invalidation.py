@@ -0,0 +1,236 @@
+from plone.app.caching import invalidation
+from plone.memoize.interfaces import ICacheChooser
+from plone.memoize.ram import RAMCacheAdapter
+from plone.testing.zca import UNIT_TESTING
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import getGlobalSiteManager
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.component.hooks import setSite
+from zope.interface import implementer
+from zope.ramcache.interfaces.ram import IRAMCache
+from zope.ramcache.ram import RAMCache
+
+import transaction
+import unittest
+
+
+@implementer(IAttributeAnnotatable)
+class DummySite:
+    def getPhysicalPath(self):
+        return ("", "plone")
+
+    def getSiteManager(self):
+        return getGlobalSiteManager()
+
+
+class DummyContent:
+    def __init__(self, parent, id):
+        self.__parent__ = parent
+        self.id = id
+
+    def getPhysicalPath(self):
+        return self.__parent__.getPhysicalPath() + (self.id,)
+
+
+class TestCachedPages(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def test_pop(self):
+        cachedPages = invalidation.CachedPages()
+        cachedPages.record("/plone/a", "global", "page1")
+        cachedPages.record("/plone/a", "global", "page2")
+        cachedPages.record("/plone/a/b", "global", "page3")
+        cachedPages.record("/plone/ab", "global", "page4")
+
+        self.assertEqual(
+            {("global", "page1"), ("global", "page2")},
+            cachedPages.pop("/plone/a"),
+        )
+        self.assertEqual(set(), cachedPages.pop("/plone/a"))
+        self.assertEqual(
+            {("global", "page3")}, cachedPages.pop("/plone/a", recursive=True)
+        )
+        self.assertEqual({("global", "page4")}, cachedPages.pop("/plone/ab"))
+
+    def test_maxPaths(self):
+        cachedPages = invalidation.CachedPages(maxPaths=2)
+        cachedPages.record("/plone/a", "global", "page1")
+        cachedPages.record("/plone/b", "global", "page2")
+        cachedPages.record("/plone/a", "global", "page3")
+        cachedPages.record("/plone/c", "global", "page4")
+
+        self.assertEqual(set(), cachedPages.pop("/plone/b"))
+        self.assertEqual(2, len(cachedPages.pop("/plone/a")))
+
+    def test_maxKeys(self):
+        cachedPages = invalidation.CachedPages(maxKeys=2)
+        for i in range(5):
+            cachedPages.record("uid:a", "global", f"page{i}")
+        cachedPages.record("uid:b", "global", "page1")
+
+        self.assertFalse(cachedPages.isComplete("uid:a"))
+        self.assertTrue(cachedPages.isComplete("uid:b"))
+        self.assertEqual(
+            {("global", "page0"), ("global", "page1")}, cachedPages.pop("uid:a")
+        )
+        self.assertEqual({("global", "page1")}, cachedPages.pop("uid:b"))
+        self.assertTrue(cachedPages.isComplete("uid:a"))
+
+    def test_dependentPages_capped(self):
+        for i in range(invalidation.MAX_PAGES_PER_UID + 10):
+            invalidation.dependentPages.record("uid:a", "global", f"page{i}")
+        self.addCleanup(invalidation.dependentPages.clear)
+
+        self.assertEqual(
+            invalidation.MAX_PAGES_PER_UID,
+            len(invalidation.dependentPages.pop("uid:a")),
+        )
+
+
+class TestInvalidation(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+
+        self.ramCache = RAMCache()
+        provideUtility(self.ramCache, IRAMCache)
+
+        @implementer(ICacheChooser)
+        class Chooser:
+            def __call__(self_, key):
+                return RAMCacheAdapter(self.ramCache, globalkey=key)
+
+        provideUtility(Chooser())
+
+        self.site = DummySite()
+        self.addCleanup(invalidation._processStates.clear)
+
+        oldCachedPages = invalidation.cachedPages
+        invalidation.cachedPages = invalidation.CachedPages()
+        self.addCleanup(setattr, invalidation, "cachedPages", oldCachedPages)
+
+    def store(self, path, key):
+        RAMCacheAdapter(self.ramCache, globalkey="global")[key] = "page"
+        invalidation.recordCachedPage(path, "global", key)
+
+    def cached(self, key):
+        return RAMCacheAdapter(self.ramCache, globalkey="global").get(key)
+
+    def test_applyInvalidations(self):
+        self.store("/plone/a", "page1")
+        self.store("/plone/a/b", "page2")
+        self.store("/plone/c", "page3")
+
+        # Nothing to do without a log
+        invalidation.applyInvalidations(self.site)
+
+        invalidation.logInvalidation([("/plone", False)], self.site)
+
+        # Entries from before the first lookup are ignored
+        invalidation.applyInvalidations(self.site)
+        self.assertEqual("page", self.cached("page1"))
+
+        invalidation.logInvalidation([("/plone/a", True)], self.site)
+        invalidation.applyInvalidations(self.site)
+        self.assertIsNone(self.cached("page1"))
+        self.assertIsNone(self.cached("page2"))
+        self.assertEqual("page", self.cached("page3"))
+
+        # Entries are only applied once
+        self.store("/plone/a", "page1")
+        invalidation.applyInvalidations(self.site)
+        self.assertEqual("page", self.cached("page1"))
+
+    def test_applyInvalidations_incomplete(self):
+        oldDependentPages = invalidation.dependentPages
+        invalidation.dependentPages = invalidation.CachedPages(maxKeys=1)
+        self.addCleanup(setattr, invalidation, "dependentPages", oldDependentPages)
+
+        self.store("/plone/c", "page3")
+        RAMCacheAdapter(self.ramCache, globalkey="global")["page1"] = "page"
+        RAMCacheAdapter(self.ramCache, globalkey="global")["page2"] = "page"
+        invalidation.dependentPages.record("uid:a", "global", "page1")
+        invalidation.dependentPages.record("uid:a", "global", "page2")
+        invalidation.logInvalidation([("/plone", False)], self.site)
+        invalidation.applyInvalidations(self.site)
+        self.assertEqual("page", self.cached("page3"))
+
+        # Not all pages showing the content are known, so all are evicted
+        invalidation.logInvalidation([("uid:a", False)], self.site)
+        invalidation.applyInvalidations(self.site)
+        self.assertIsNone(self.cached("page1"))
+        self.assertIsNone(self.cached("page2"))
+        self.assertIsNone(self.cached("page3"))
+        self.assertTrue(invalidation.dependentPages.isComplete("uid:a"))
+
+    def test_forgotten_paths_evicted(self):
+        invalidation.cachedPages.maxPaths = 1
+        self.store("/plone/a", "page1")
+        self.store("/plone/b", "page2")
+
+        # Pages that cannot be invalidated any more are evicted
+        self.assertIsNone(self.cached("page1"))
+        self.assertEqual("page", self.cached("page2"))
+
+    def test_evictCachedPage_adapter_key(self):
+        class KeyedAdapter(RAMCacheAdapter):
+            def _make_key(self, source):
+                return "hashed:" + source
+
+        @implementer(ICacheChooser)
+        class Chooser:
+            def __call__(self_, key):
+                return KeyedAdapter(self.ramCache, globalkey=key)
+
+        provideUtility(Chooser())
+
+        # The page is evicted under the key the adapter stored it with
+        KeyedAdapter(self.ramCache, globalkey="global")["page1"] = "page"
+        invalidation.evictCachedPage("global", "page1")
+        self.assertIsNone(KeyedAdapter(self.ramCache, globalkey="global").get("page1"))
+
+    def test_logInvalidation_drops_old_entries(self):
+        invalidation.logInvalidation([("/plone/a", False)], self.site)
+        log, count = invalidation.getInvalidationLog(self.site)
+        (key,) = list(log.keys())
+        log[(key[0] - invalidation.RETENTION - 1, key[1])] = log.pop(key)
+
+        # Old entries are dropped in batches, not in every transaction
+        invalidation.logInvalidation([("/plone/b", False)], self.site)
+        self.assertEqual(2, len(log))
+
+        (key, _) = list(log.keys())
+        log[(key[0] - invalidation.RETENTION - 1, key[1])] = log.pop(key)
+        invalidation.logInvalidation([("/plone/c", False)], self.site)
+        self.assertEqual(
+            [(("/plone/b", False),), (("/plone/c", False),)], list(log.values())
+        )
+        self.assertEqual(3, count())
+
+    def test_contentModified(self):
+        setSite(self.site)
+        self.addCleanup(setSite, None)
+
+        folder = DummyContent(self.site, "folder")
+        transaction.begin()
+        invalidation.contentModified(DummyContent(folder, "a"), None)
+        invalidation.contentModified(DummyContent(folder, "b"), None)
+        self.assertEqual((None, None), invalidation.getInvalidationLog(self.site))
+        transaction.commit()
+
+        log, count = invalidation.getInvalidationLog(self.site)
+        self.assertEqual(
+            [
+                (
+                    ("/plone/folder", False),
+                    ("/plone/folder/a", True),
+                    ("/plone/folder/b", True),
+                )
+            ],
+            list(log.values()),
+        )
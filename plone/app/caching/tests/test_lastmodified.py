@@ -35,6 +35,14 @@ class TestLastModified(unittest.TestCase):
         provideAdapter(lastmodified.CatalogableDublinCoreLastModified)
         provideAdapter(lastmodified.DCTimesLastModified)
         provideAdapter(lastmodified.ResourceLastModified)
+        provideAdapter(lastmodified.ContainerLastModified)
+
+        # Do not start the background thread of the filesystem watcher
+        from plone.app.caching.fsmtime import MTimeWatcher
+
+        oldWatcher = lastmodified.watcher
+        lastmodified.watcher = MTimeWatcher(interval=None)
+        self.addCleanup(setattr, lastmodified, "watcher", oldWatcher)
 
     def test_PageTemplateDelegateLastModified(self):
         from Acquisition import Explicit
@@ -142,6 +150,37 @@ class TestLastModified(unittest.TestCase):
         format = "%y%m%d%H%M%s"
         self.assertEqual(mod.strftime(format), ILastModified(dummy)().strftime(format))
 
+    def test_FSObjectLastModified_debug_mode(self):
+        from App.config import getConfiguration
+        from Products.CMFCore.FSFile import FSFile
+
+        import tempfile
+
+        fd, filepath = tempfile.mkstemp()
+        os.write(fd, b"foo")
+        os.close(fd)
+        self.addCleanup(os.remove, filepath)
+        os.utime(filepath, (1000000000, 1000000000))
+
+        # The watcher has no background thread, so that we can poll manually
+        watcher = lastmodified.watcher
+
+        config = getConfiguration()
+        oldDebugMode = config.debug_mode
+        config.debug_mode = True
+        self.addCleanup(setattr, config, "debug_mode", oldDebugMode)
+
+        dummy = FSFile("dummy", filepath)
+        self.assertEqual(1000000000, time.mktime(ILastModified(dummy)().timetuple()))
+
+        # Changes are not picked up by requests until the watcher has polled
+        os.utime(filepath, (1000000100, 1000000100))
+        self.assertEqual(1000000000, time.mktime(ILastModified(dummy)().timetuple()))
+
+        self.assertEqual([filepath], watcher.poll())
+        self.assertEqual(1000000100, time.mktime(ILastModified(dummy)().timetuple()))
+        self.assertEqual([], watcher.poll())
+
     def test_CatalogableDublinCoreLastModified(self):
         from Products.CMFCore.interfaces import ICatalogableDublinCore
         from zope.interface import implementer
@@ -219,3 +258,157 @@ class TestLastModified(unittest.TestCase):
         mod = datetime.datetime.fromtimestamp(modtime, tz=tzlocal())
 
         self.assertEqual(mod, ILastModified(r)())
+
+    def test_ContainerLastModified(self):
+        from plone.dexterity.interfaces import IDexterityContainer
+        from zope.annotation.attribute import AttributeAnnotations
+        from zope.annotation.interfaces import IAttributeAnnotatable
+        from zope.interface import implementer
+
+        provideAdapter(AttributeAnnotations)
+
+        @implementer(IDexterityContainer, IAttributeAnnotatable)
+        class Dummy:
+
+            _mod = None
+
+            def modified(self):
+                if self._mod is not None:
+                    return DateTime.DateTime(self._mod)
+                return None
+
+        d = Dummy()
+
+        self.assertIsNone(ILastModified(d)())
+
+        d._mod = datetime.datetime(2001, 4, 19, 12, 25, 21, 120000)
+        self.assertEqual(d._mod, ILastModified(d)())
+
+        # A change to a child is newer than the container itself
+        lastmodified.touchContainer(d)
+        self.assertGreater(
+            ILastModified(d)(), datetime.datetime(2001, 4, 20, tzinfo=tzlocal())
+        )
+
+        # But a newer change to the container itself wins
+        d._mod = datetime.datetime.now() + datetime.timedelta(days=1)
+        self.assertEqual(d._mod, ILastModified(d)())
+
+    def test_ContainerLastModified_same_second(self):
+        from plone.dexterity.interfaces import IDexterityContainer
+        from zope.annotation.attribute import AttributeAnnotations
+        from zope.annotation.interfaces import IAnnotations
+        from zope.annotation.interfaces import IAttributeAnnotatable
+        from zope.interface import implementer
+
+        provideAdapter(AttributeAnnotations)
+
+        @implementer(IDexterityContainer, IAttributeAnnotatable)
+        class Dummy:
+            pass
+
+        d = Dummy()
+        annotations = IAnnotations(d)
+
+        lastmodified.touchContainer(d, now=10.2)
+        timestamp = annotations[lastmodified.CHILDREN_MODIFIED_KEY]
+        self.assertEqual(10.2, timestamp.value)
+
+        # Changes within the same second are not written again
+        lastmodified.touchContainer(d, now=10.7)
+        self.assertEqual(10.2, timestamp.value)
+
+        # But a change less than a second later in the next second is, to
+        # the same object
+        lastmodified.touchContainer(d, now=11.1)
+        self.assertIs(timestamp, annotations[lastmodified.CHILDREN_MODIFIED_KEY])
+        self.assertEqual(11.1, timestamp.value)
+
+        # Plain numbers stored by earlier versions are replaced
+        annotations[lastmodified.CHILDREN_MODIFIED_KEY] = 12.5
+        lastmodified.touchContainer(d, now=12.9)
+        self.assertEqual(12.5, annotations[lastmodified.CHILDREN_MODIFIED_KEY])
+        lastmodified.touchContainer(d, now=13.0)
+        self.assertEqual(13.0, annotations[lastmodified.CHILDREN_MODIFIED_KEY].value)
+
+    def test_Timestamp_resolveConflict(self):
+        resolve = lastmodified.Timestamp(10.0)._p_resolveConflict
+
+        # Concurrent changes resolve to the latest time
+        self.assertEqual(
+            {"value": 12.0},
+            resolve({"value": 10.0}, {"value": 12.0}, {"value": 11.0}),
+        )
+        self.assertEqual(
+            {"value": 13.0},
+            resolve({"value": 10.0}, {"value": 12.0}, {"value": 13.0}),
+        )
+
+    def test_ContainerLastModified_children_events(self):
+        from plone.dexterity.interfaces import IDexterityContainer
+        from Products.CMFCore.interfaces import IContentish
+        from Products.CMFCore.WorkflowCore import ActionSucceededEvent
+        from zope.annotation.attribute import AttributeAnnotations
+        from zope.annotation.interfaces import IAnnotations
+        from zope.annotation.interfaces import IAttributeAnnotatable
+        from zope.component import provideHandler
+        from zope.component.event import objectEventNotify
+        from zope.container.contained import ContainerModifiedEvent
+        from zope.event import notify
+        from zope.interface import implementer
+        from zope.lifecycleevent import ObjectAddedEvent
+        from zope.lifecycleevent import ObjectModifiedEvent
+        from zope.lifecycleevent import ObjectMovedEvent
+        from zope.lifecycleevent import ObjectRemovedEvent
+
+        provideAdapter(AttributeAnnotations)
+        provideHandler(objectEventNotify)
+        provideHandler(lastmodified.childModified)
+        provideHandler(lastmodified.childTransitioned)
+        provideHandler(lastmodified.childMoved)
+
+        @implementer(IDexterityContainer, IAttributeAnnotatable, IContentish)
+        class Container:
+            def __init__(self, parent=None):
+                self.__parent__ = parent
+
+        @implementer(IContentish)
+        class Item:
+            def __init__(self, parent=None):
+                self.__parent__ = parent
+
+        def stamp(container):
+            return IAnnotations(container).get(lastmodified.CHILDREN_MODIFIED_KEY)
+
+        site = Container()
+        folder = Container(site)
+        other = Container(site)
+        item = Item(folder)
+
+        notify(ContainerModifiedEvent(folder))
+        self.assertIsNone(stamp(site))
+
+        notify(ObjectModifiedEvent(item))
+        self.assertIsNotNone(stamp(folder))
+        self.assertIsNone(stamp(site))
+
+        del IAnnotations(folder)[lastmodified.CHILDREN_MODIFIED_KEY]
+        notify(ObjectAddedEvent(item, folder, "item"))
+        self.assertIsNotNone(stamp(folder))
+
+        del IAnnotations(folder)[lastmodified.CHILDREN_MODIFIED_KEY]
+        notify(ObjectMovedEvent(item, folder, "item", other, "item"))
+        self.assertIsNotNone(stamp(folder))
+        self.assertIsNotNone(stamp(other))
+
+        del IAnnotations(other)[lastmodified.CHILDREN_MODIFIED_KEY]
+        notify(ObjectRemovedEvent(item, other, "item"))
+        self.assertIsNotNone(stamp(other))
+        self.assertIsNone(stamp(site))
+
+        # Publishing or retracting an item changes its container's listings
+        item = Item(folder)
+        del IAnnotations(folder)[lastmodified.CHILDREN_MODIFIED_KEY]
+        notify(ActionSucceededEvent(item, None, "publish", None))
+        self.assertIsNotNone(stamp(folder))
+        self.assertIsNone(stamp(site))
@@ -427,6 +427,46 @@ class ResponseInterceptorHelpersTest(unittest.TestCase):
         self.assertEqual("qux", response.getHeader("X-Bar"))
         self.assertEqual("||blah||", response.getHeader("ETag", literal=1))
 
+    def test_cachedResponse_head(self):
+        from plone.app.caching.operations.utils import cachedResponse
+
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "REQUEST_METHOD": "HEAD",
+        }
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+        published = DummyPublished()
+
+        headers = {"X-Foo": "bar", "Content-Length": "4"}
+
+        body = cachedResponse(published, request, response, 200, headers, "body")
+
+        self.assertEqual("", body)
+        self.assertEqual(200, response.getStatus())
+        self.assertEqual("bar", response.getHeader("X-Foo"))
+        self.assertEqual("4", response.getHeader("Content-Length"))
+
+    def test_cachedResponse_head_content_length(self):
+        from plone.app.caching.operations.utils import cachedResponse
+
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "REQUEST_METHOD": "HEAD",
+        }
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+        published = DummyPublished()
+
+        body = cachedResponse(published, request, response, 200, {}, b"cached body")
+
+        # The empty body does not reset the length of the cached one
+        response.setBody(body)
+        self.assertEqual(b"", response.body)
+        self.assertEqual("11", response.getHeader("Content-Length"))
+
     def test_cachedResponse_gzip_off(self):
         from plone.app.caching.operations.utils import cachedResponse
 
@@ -543,6 +583,94 @@ class CacheCheckHelpersTest(unittest.TestCase):
         provideAdapter(AttributeAnnotations)
         classImplements(HTTPRequest, IAttributeAnnotatable)
 
+    # cacheStop()
+
+    def _makeRegistry(self, variables):
+        from plone.app.caching.interfaces import IPloneCacheSettings
+        from plone.registry import Registry
+        from plone.registry.fieldfactory import persistentFieldAdapter
+        from plone.registry.interfaces import IRegistry
+
+        provideAdapter(persistentFieldAdapter)
+        registry = Registry()
+        registry.registerInterface(IPloneCacheSettings)
+        provideUtility(registry, IRegistry)
+
+        settings = registry.forInterface(IPloneCacheSettings)
+        settings.cacheStopRequestVariables = variables
+        return settings
+
+    def _makeRequest(self, method="GET", form=None, cookies=None):
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "REQUEST_METHOD": method,
+        }
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+        request.form.update(form or {})
+        request.cookies.update(cookies or {})
+        return request
+
+    def test_cacheStop_method(self):
+        from plone.app.caching.operations.utils import cacheStop
+
+        self._makeRegistry(("SearchableText",))
+        self.assertTrue(cacheStop(self._makeRequest("POST"), "testrule"))
+        self.assertFalse(cacheStop(self._makeRequest(), "testrule"))
+        self.assertFalse(cacheStop(self._makeRequest("HEAD"), "testrule"))
+        self.assertTrue(
+            cacheStop(self._makeRequest("HEAD", {"SearchableText": "x"}), "testrule")
+        )
+
+    def test_cacheStop_names(self):
+        from plone.app.caching.operations.utils import cacheStop
+
+        self._makeRegistry(("SearchableText", "statusmessages"))
+
+        request = self._makeRequest(form={"SearchableText": "foo"})
+        self.assertTrue(cacheStop(request, "testrule"))
+
+        request = self._makeRequest(cookies={"statusmessages": "foo"})
+        self.assertTrue(cacheStop(request, "testrule"))
+
+        request = self._makeRequest(form={"SearchableTextX": "foo"})
+        self.assertFalse(cacheStop(request, "testrule"))
+
+        # Feeds are exempt
+        request = self._makeRequest(form={"SearchableText": "foo"})
+        self.assertFalse(cacheStop(request, "plone.content.feed"))
+
+    def test_cacheStop_prefix_and_pattern(self):
+        from plone.app.caching.operations.utils import cacheStop
+
+        self._makeRegistry(("utm_*", r"re:ab_test_\d+$"))
+
+        request = self._makeRequest(form={"utm_source": "foo"})
+        self.assertTrue(cacheStop(request, "testrule"))
+
+        request = self._makeRequest(cookies={"ab_test_42": "1"})
+        self.assertTrue(cacheStop(request, "testrule"))
+
+        request = self._makeRequest(form={"ab_test_x": "1", "utm": "foo"})
+        self.assertFalse(cacheStop(request, "testrule"))
+
+    def test_cacheStop_record_modified(self):
+        from plone.app.caching.operations import utils
+        from plone.registry.interfaces import IRecordModifiedEvent
+        from zope.component import provideHandler
+
+        provideHandler(utils.cacheStopVariablesModified, (IRecordModifiedEvent,))
+        settings = self._makeRegistry(("foo",))
+
+        request = self._makeRequest(form={"bar": "1"})
+        self.assertFalse(utils.cacheStop(request, "testrule"))
+        self.assertEqual([("foo",)], list(utils._cacheStopMatchers))
+
+        settings.cacheStopRequestVariables = ("bar",)
+        self.assertEqual([], list(utils._cacheStopMatchers))
+        self.assertTrue(utils.cacheStop(request, "testrule"))
+
     # isModified()
 
     def test_isModified_no_headers_no_keys(self):
@@ -808,6 +936,15 @@ class CacheCheckHelpersTest(unittest.TestCase):
 
     # visibleToRole()
 
+    def _makeGlobalRequest(self):
+        from zope.globalrequest import setRequest
+
+        environ = {"SERVER_NAME": "example.com", "SERVER_PORT": "80"}
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        setRequest(request)
+        self.addCleanup(setRequest, None)
+        return request
+
     def test_visibleToRole_not_real(self):
         from plone.app.caching.operations.utils import visibleToRole
 
@@ -838,6 +975,92 @@ class CacheCheckHelpersTest(unittest.TestCase):
         )
         self.assertTrue(visibleToRole(s, role="Anonymous"))
 
+    def test_visibleToRole_memoized(self):
+        from plone.app.caching.operations.utils import SECURITY_CACHE_KEY
+        from plone.app.caching.operations.utils import visibleToRole
+
+        makeRequest = self._makeGlobalRequest
+        parent = SimpleItem()
+        parent.id = "parent"
+        s = SimpleItem().__of__(parent)
+        s.id = "s"
+        alsoProvides(s, IContentish)
+        published = DummyPublished(s)
+
+        request = makeRequest()
+        s.manage_permission("View", ("Member", "Manager", "Anonymous"))
+        self.assertTrue(visibleToRole(s, role="Anonymous"))
+        self.assertEqual(1, len(IAnnotations(request)[SECURITY_CACHE_KEY]))
+
+        # Other published objects have their own entry
+        self.assertTrue(visibleToRole(published, role="Anonymous"))
+        self.assertEqual(2, len(IAnnotations(request)[SECURITY_CACHE_KEY]))
+
+        # Results are kept for the current request only, so that changes
+        # made without an event are picked up by the next one
+        s.manage_permission("View", ("Member", "Manager"))
+        self.assertTrue(visibleToRole(s, role="Anonymous"))
+        makeRequest()
+        self.assertFalse(visibleToRole(s, role="Anonymous"))
+
+        # Acquired from the parent, and changed there
+        parent.manage_permission("View", ("Anonymous",), acquire=0)
+        s.manage_permission("View", (), acquire=1)
+        makeRequest()
+        self.assertTrue(visibleToRole(s, role="Anonymous"))
+
+        parent.manage_permission("View", ("Manager",), acquire=0)
+        makeRequest()
+        self.assertFalse(visibleToRole(s, role="Anonymous"))
+
+    # getRolesInContext()
+
+    def test_getRolesInContext_memoized(self):
+        from plone.app.caching.operations.utils import getRolesInContext
+        from zope.globalrequest import setRequest
+
+        makeRequest = self._makeGlobalRequest
+        calls = []
+
+        class DummyMember:
+            def __init__(self, id):
+                self.id = id
+
+            def getId(self):
+                return self.id
+
+            def getRolesInContext(self, context):
+                calls.append(self.id)
+                localRoles = context.__ac_local_roles__.get(self.id, [])
+                return ["Authenticated"] + localRoles
+
+        context = SimpleItem()
+        context.id = "foo"
+        context.__ac_local_roles__ = {"bob": ["Editor"]}
+
+        makeRequest()
+        member = DummyMember("bob")
+        roles = ("Authenticated", "Editor")
+        self.assertEqual(roles, getRolesInContext(member, context))
+        self.assertEqual(roles, getRolesInContext(member, context))
+        self.assertEqual(["bob"], calls)
+
+        getRolesInContext(DummyMember("jane"), context)
+        self.assertEqual(["bob", "jane"], calls)
+
+        # Local roles changed without an event, e.g. by manage_setLocalRoles,
+        # are picked up by the next request
+        context.__ac_local_roles__ = {"bob": ["Reader"]}
+        makeRequest()
+        roles = ("Authenticated", "Reader")
+        self.assertEqual(roles, getRolesInContext(member, context))
+        self.assertEqual(["bob", "jane", "bob"], calls)
+
+        # Without a request, nothing is memoized
+        setRequest(None)
+        getRolesInContext(member, context)
+        self.assertEqual(["bob", "jane", "bob", "bob"], calls)
+
 
 class MiscHelpersTest(unittest.TestCase):
 
@@ -885,6 +1108,79 @@ class MiscHelpersTest(unittest.TestCase):
         self.assertTrue(getContext(parent, marker=IDummy) is grandparent)
         self.assertTrue(getContext(published, marker=(IDummy,)) is grandparent)
 
+    # getCachingContext()
+
+    def test_getCachingContext(self):
+        from plone.app.caching.operations.utils import getCachingContext
+        from Products.CMFCore.interfaces import IMembershipTool
+
+        calls = []
+
+        @implementer(IMembershipTool)
+        class DummyPortalMembership:
+            def isAnonymousUser(self):
+                calls.append("isAnonymousUser")
+                return False
+
+            def getAuthenticatedMember(self):
+                calls.append("getAuthenticatedMember")
+                return "bob"
+
+        provideUtility(DummyPortalMembership())
+
+        @implementer(IContentish)
+        class Parent:
+            pass
+
+        environ = {"SERVER_NAME": "example.com", "SERVER_PORT": "80"}
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+        parent = Parent()
+        published = DummyPublished(parent)
+
+        cachingContext = getCachingContext(published, request)
+        self.assertTrue(cachingContext is getCachingContext(published, request))
+        self.assertTrue(cachingContext.context is parent)
+        self.assertIsNone(cachingContext.portal_state)
+
+        self.assertFalse(cachingContext.anonymous)
+        self.assertFalse(cachingContext.anonymous)
+        self.assertEqual("bob", cachingContext.member)
+        self.assertEqual("bob", cachingContext.member)
+        self.assertEqual(["isAnonymousUser", "getAuthenticatedMember"], calls)
+
+        # A different published object gets its own caching context
+        other = getCachingContext(DummyPublished(parent), request)
+        self.assertFalse(other is cachingContext)
+        self.assertFalse(other is getCachingContext(published, request))
+
+    def test_getCachingContext_anonymous_portal_state(self):
+        from plone.app.caching.operations.utils import getCachingContext
+
+        @implementer(IContentish)
+        class Parent:
+            pass
+
+        @adapter(Parent, Interface)
+        class DummyPortalState:
+            def __init__(self, context, request):
+                pass
+
+            def anonymous(self):
+                return True
+
+        provideAdapter(DummyPortalState, provides=Interface, name="plone_portal_state")
+
+        environ = {"SERVER_NAME": "example.com", "SERVER_PORT": "80"}
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+        published = DummyPublished(Parent())
+
+        cachingContext = getCachingContext(published, request)
+        self.assertIsNone(cachingContext.membership)
+        self.assertIsNone(cachingContext.member)
+        self.assertTrue(cachingContext.anonymous)
+
     # formatDateTime()
 
     def test_formatDateTime_utc(self):
@@ -1489,6 +1785,71 @@ class RAMCacheTest(unittest.TestCase):
 
     # fetchFromRAMCache()
 
+    def test_storeResponseInRAMCache_head(self):
+        from plone.app.caching.operations.utils import storeResponseInRAMCache
+
+        class Cache(dict):
+            pass
+
+        cache = Cache()
+
+        @implementer(ICacheChooser)
+        class Chooser:
+            def __call__(self, key):
+                assert key == "plone.app.caching.operations.ramcache"
+                return cache
+
+        provideUtility(Chooser())
+
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "REQUEST_METHOD": "HEAD",
+        }
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+
+        IAnnotations(request)["plone.app.caching.operations.ramcache.key"] = "foo"
+
+        storeResponseInRAMCache(request, response, "Body")
+
+        self.assertEqual(0, len(cache))
+
+    def test_storeResponseInRAMCache_expires(self):
+        from plone.app.caching.operations.utils import storeResponseInRAMCache
+
+        class Cache(dict):
+            pass
+
+        cache = Cache()
+
+        @implementer(ICacheChooser)
+        class Chooser:
+            def __call__(self, key):
+                assert key == "plone.app.caching.operations.ramcache"
+                return cache
+
+        provideUtility(Chooser())
+
+        environ = {"SERVER_NAME": "example.com", "SERVER_PORT": "80"}
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+
+        response.redirect("http://example.com/bar")
+
+        annotations = IAnnotations(request)
+        annotations["plone.app.caching.operations.ramcache.key"] = "foo"
+        annotations["plone.app.caching.operations.ramcache.key.expires"] = 1000.0
+
+        # Redirects have no body, but are cached anyway
+        storeResponseInRAMCache(request, response, "")
+
+        self.assertEqual(1, len(cache))
+        cached = normalize_response_cache(cache["foo"])
+        self.assertEqual(302, cached[0])
+        self.assertEqual("http://example.com/bar", cached[1]["location"])
+        self.assertEqual(("", 0, 1000.0), cached[2:])
+
     def test_fetchFromRAMCache_no_cache(self):
         from plone.app.caching.operations.utils import fetchFromRAMCache
 
@@ -1649,3 +2010,88 @@ class RAMCacheTest(unittest.TestCase):
             fetchFromRAMCache(request, etag="|foo", default=marker)
         )
         self.assertIs(cached, marker)
+
+    def test_fetchFromRAMCache_expires(self):
+        from plone.app.caching.operations.utils import fetchFromRAMCache
+
+        class Cache(dict):
+            pass
+
+        cache = Cache()
+
+        @implementer(ICacheChooser)
+        class Chooser:
+            def __call__(self, key):
+                assert key == "plone.app.caching.operations.ramcache"
+                return cache
+
+        provideUtility(Chooser())
+
+        environ = {"SERVER_NAME": "example.com", "SERVER_PORT": "80"}
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+
+        request.environ["PATH_INFO"] = "/foo/bar"
+        request.environ["QUERY_STRING"] = ""
+
+        key = "http://example.com/foo/bar?"
+        headers = {"location": "http://example.com/bar"}
+
+        cache[key] = (302, headers, "", 0, time.time() + 60)
+        cached = normalize_response_cache(fetchFromRAMCache(request))
+        self.assertEqual((302, headers, "", 0), cached)
+
+        cache[key] = (302, headers, "", 0, time.time() - 60)
+        self.assertIsNone(fetchFromRAMCache(request))
+
+    def test_fetchFromRAMCache_disk(self):
+        from plone.app.caching import diskcache
+        from plone.app.caching.operations.utils import fetchFromRAMCache
+        from plone.app.caching.operations.utils import storeResponseInRAMCache
+
+        import shutil
+        import tempfile
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        diskCache = diskcache.DiskCache(directory)
+        self.addCleanup(diskCache.close)
+        diskcache.setDiskCache(diskCache)
+        self.addCleanup(diskcache.setDiskCache, None)
+
+        class Cache(dict):
+            pass
+
+        cache = Cache()
+
+        @implementer(ICacheChooser)
+        class Chooser:
+            def __call__(self, key):
+                assert key == "plone.app.caching.operations.ramcache"
+                return cache
+
+        provideUtility(Chooser())
+
+        environ = {"SERVER_NAME": "example.com", "SERVER_PORT": "80"}
+        response = HTTPResponse()
+        request = HTTPRequest(StringIO(), environ, response)
+
+        request.environ["PATH_INFO"] = "/foo/bar"
+        request.environ["QUERY_STRING"] = ""
+
+        key = "http://example.com/foo/bar?"
+        IAnnotations(request)["plone.app.caching.operations.ramcache.key"] = key
+        response.setHeader("X-Foo", "bar")
+
+        storeResponseInRAMCache(request, response, b"Body")
+        self.assertEqual(1, len(diskCache))
+
+        # Pages evicted from RAM are read from disk, and copied back into RAM
+        cache.clear()
+        cached = normalize_response_cache(fetchFromRAMCache(request))
+        self.assertEqual((200, {"x-foo": "bar"}, b"Body", 0), cached)
+        self.assertIn(key, cache)
+
+        diskCache.clear()
+        cache.clear()
+        self.assertIsNone(fetchFromRAMCache(request))
@@ -0,0 +1,294 @@
+from plone.app.caching import outbox
+from plone.app.caching import rewarm
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.tests.test_rewarm import AnnotatableRequest
+from plone.cachepurging.hooks import KEY
+from plone.cachepurging.interfaces import ICachePurgingSettings
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAnnotations
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from ZPublisher.pubevents import PubBeforeCommit
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import transaction
+import unittest
+
+
+class FauxPurger:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.purged = []
+        self.event = threading.Event()
+
+    def purgeSync(self, url, httpVerb="PURGE"):
+        if outbox.getProxy(url) in self.failing:
+            return "ERROR", "", "Connection refused"
+        self.purged.append(url)
+        self.event.set()
+        return 200, "", ""
+
+
+class TestPurgeOutbox(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def makeOutbox(self, purger, directory=None, start=False):
+        box = outbox.PurgeOutbox(directory, purger=purger)
+        self.addCleanup(box.close)
+        if not start:
+            # Drive the outbox by calling ``process()`` in the tests
+            box.start = lambda: None
+        return box
+
+    def test_add_dedupes(self):
+        box = self.makeOutbox(FauxPurger())
+        box.add(["http://proxy1/a", "http://proxy1/b"])
+        box.add(["http://proxy1/a", "http://proxy2/a"])
+        self.assertEqual(
+            ["http://proxy1/a", "http://proxy1/b", "http://proxy2/a"],
+            box.pending(),
+        )
+
+    def test_process(self):
+        purger = FauxPurger()
+        box = self.makeOutbox(purger)
+        box.add(["http://proxy1/a", "http://proxy2/a"])
+
+        self.assertIsNone(box.process())
+        self.assertEqual(["http://proxy1/a", "http://proxy2/a"], purger.purged)
+        self.assertEqual([], box.pending())
+
+    def test_added_while_purging(self):
+        purger = FauxPurger()
+        box = self.makeOutbox(purger)
+        box.add(["http://proxy1/a"], now=1000.0)
+
+        # The content changes again while the purge is being sent
+        purgeSync = purger.purgeSync
+
+        def purgeAndAdd(url, httpVerb="PURGE"):
+            box.add([url], now=1000.0)
+            return purgeSync(url, httpVerb)
+
+        purger.purgeSync = purgeAndAdd
+        box.process(now=1000.0)
+        self.assertEqual(["http://proxy1/a"], purger.purged)
+        self.assertEqual(["http://proxy1/a"], box.pending())
+
+        purger.purgeSync = purgeSync
+        self.assertIsNone(box.process(now=1000.0))
+        self.assertEqual(["http://proxy1/a", "http://proxy1/a"], purger.purged)
+        self.assertEqual([], box.pending())
+
+    def test_rewarm(self):
+        scheduled = []
+
+        class DummyRewarmer:
+            def schedule(self, urls, delay=0):
+                scheduled.append(urls)
+
+        oldRewarmer = rewarm.rewarmer
+        rewarm.rewarmer = DummyRewarmer()
+        self.addCleanup(setattr, rewarm, "rewarmer", oldRewarmer)
+
+        purger = FauxPurger(failing=["http://proxy2"])
+        box = self.makeOutbox(purger)
+        box.add(
+            ["http://proxy1/a", "http://proxy1/b", "http://proxy2/a"],
+            rewarm=["http://proxy1/a", "http://proxy2/a"],
+        )
+
+        # Pages are re-warmed once their purge succeeded, and only then
+        box.process()
+        self.assertEqual([["http://proxy1/a"]], scheduled)
+
+        purger.failing = set()
+        box.process(now=time.time() + 10)
+        self.assertEqual([["http://proxy1/a"], ["http://proxy2/a"]], scheduled)
+
+    def test_backoff(self):
+        purger = FauxPurger(failing=["http://proxy1"])
+        box = self.makeOutbox(purger)
+        box.add(["http://proxy1/a", "http://proxy1/b", "http://proxy2/a"], now=1000.0)
+
+        # The failing proxy is tried once, the other one is purged
+        self.assertEqual(1.0, box.process(now=1000.0))
+        self.assertEqual(["http://proxy2/a"], purger.purged)
+        status = box.getStatus()
+        self.assertEqual(["http://proxy1"], list(status))
+        self.assertEqual(2, status["http://proxy1"]["pending"])
+        self.assertEqual(1, status["http://proxy1"]["failures"])
+        self.assertEqual(
+            "ERROR Connection refused", status["http://proxy1"]["lastError"]
+        )
+
+        # Not retried before the delay is over, then waiting twice as long
+        self.assertEqual(0.5, box.process(now=1000.5))
+        self.assertEqual(2.0, box.process(now=1001.0))
+        self.assertEqual(4.0, box.process(now=1003.0))
+        self.assertEqual(3, box.getStatus()["http://proxy1"]["failures"])
+
+        # The delay is capped
+        box._proxies["http://proxy1"].failures = 20
+        self.assertEqual(outbox.MAX_DELAY, box.process(now=1007.0))
+
+        purger.failing.clear()
+        self.assertIsNone(box.process(now=2000.0))
+        self.assertEqual(
+            ["http://proxy2/a", "http://proxy1/a", "http://proxy1/b"], purger.purged
+        )
+        self.assertEqual({}, box.getStatus())
+
+    def test_debounce(self):
+        purger = FauxPurger()
+        box = self.makeOutbox(purger)
+        box.add(["http://proxy1/a"], window=10, maxDelay=25, now=1000.0)
+        self.assertEqual(10.0, box.process(now=1000.0))
+
+        # Adding the URL again extends the window, up to the maximum delay
+        box.add(["http://proxy1/a", "http://proxy1/b"], window=10, now=1008.0)
+        self.assertEqual(2.0, box.process(now=1016.0))
+        box.add(["http://proxy1/a"], window=10, now=1020.0)
+        self.assertEqual([], purger.purged)
+
+        self.assertEqual(7.0, box.process(now=1018.0))
+        self.assertEqual(["http://proxy1/b"], purger.purged)
+        self.assertIsNone(box.process(now=1025.0))
+        self.assertEqual(["http://proxy1/b", "http://proxy1/a"], purger.purged)
+
+    def test_journal(self):
+        purger = FauxPurger(failing=["http://proxy1"])
+        box = self.makeOutbox(purger, self.directory)
+        box.add(["http://proxy1/a", "http://proxy2/a"])
+        box.process()
+        box.close()
+
+        # Pending purges survive a restart
+        box = self.makeOutbox(purger, self.directory)
+        self.assertEqual(["http://proxy1/a"], box.pending())
+
+        # An incomplete last line is ignored
+        with open(os.path.join(self.directory, outbox.JOURNAL_FILENAME), "a") as f:
+            f.write("+ http://proxy1/b")
+        box.close()
+        box = self.makeOutbox(purger, self.directory)
+        self.assertEqual(["http://proxy1/a"], box.pending())
+
+    def test_worker(self):
+        purger = FauxPurger()
+        box = self.makeOutbox(purger, start=True)
+        box.add(["http://proxy1/a"])
+        self.assertTrue(purger.event.wait(5))
+
+        for i in range(50):
+            if not box.pending():
+                break
+            time.sleep(0.1)
+        self.assertEqual([], box.pending())
+
+        # The worker waits for new purges
+        purger.event.clear()
+        box.add(["http://proxy1/b"])
+        self.assertTrue(purger.event.wait(5))
+        self.assertEqual(["http://proxy1/a", "http://proxy1/b"], purger.purged)
+
+
+class TestQueueInOutbox(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+
+        self.registry = Registry()
+        self.registry.registerInterface(ICachePurgingSettings)
+        self.registry.registerInterface(IPloneCacheSettings)
+        provideUtility(self.registry, IRegistry)
+        settings = self.registry.forInterface(ICachePurgingSettings)
+        settings.enabled = True
+        settings.cachingProxies = ("http://proxy1", "http://proxy2")
+
+        self.box = outbox.PurgeOutbox(purger=FauxPurger())
+        self.box.start = lambda: None
+        outbox.setPurgeOutbox(self.box)
+        self.addCleanup(outbox.setPurgeOutbox, None)
+
+    def test_queueInOutbox(self):
+        request = AnnotatableRequest()
+        IAnnotations(request)[KEY] = {"/foo"}
+
+        transaction.begin()
+        outbox.queueInOutbox(PubBeforeCommit(request))
+
+        # plone.cachepurging has nothing left to purge
+        self.assertNotIn(KEY, IAnnotations(request))
+        self.assertEqual([], self.box.pending())
+
+        transaction.commit()
+        self.assertEqual(["http://proxy1/foo", "http://proxy2/foo"], self.box.pending())
+
+    def test_queueInOutbox_rewarm(self):
+        request = AnnotatableRequest()
+        IAnnotations(request)[KEY] = {"/foo"}
+        IAnnotations(request)[rewarm.KEY] = {
+            "http://proxy1/foo",
+            "http://proxy1/foo/view",
+        }
+
+        transaction.begin()
+        outbox.queueInOutbox(PubBeforeCommit(request))
+        transaction.commit()
+
+        # Purged pages are re-warmed by the outbox, the others after a delay
+        self.assertEqual({"http://proxy1/foo"}, self.box._rewarm)
+        self.assertEqual({"http://proxy1/foo/view"}, IAnnotations(request)[rewarm.KEY])
+
+    def test_queueInOutbox_aborted(self):
+        request = AnnotatableRequest()
+        IAnnotations(request)[KEY] = {"/foo"}
+
+        transaction.begin()
+        outbox.queueInOutbox(PubBeforeCommit(request))
+        transaction.abort()
+        self.assertEqual([], self.box.pending())
+
+    def test_queueInOutbox_not_configured(self):
+        outbox.setPurgeOutbox(outbox._NOT_CONFIGURED)
+
+        request = AnnotatableRequest()
+        IAnnotations(request)[KEY] = {"/foo"}
+        outbox.queueInOutbox(PubBeforeCommit(request))
+        self.assertEqual({"/foo"}, IAnnotations(request)[KEY])
+
+    def test_queueInOutbox_debounce(self):
+        outbox.setPurgeOutbox(outbox._NOT_CONFIGURED)
+        self.registry.forInterface(IPloneCacheSettings).purgeDebounceWindow = 10
+
+        request = AnnotatableRequest()
+        IAnnotations(request)[KEY] = {"/foo"}
+
+        transaction.begin()
+        outbox.queueInOutbox(PubBeforeCommit(request))
+        transaction.commit()
+
+        # Without a directory, the purges wait in memory
+        box = outbox.getPurgeOutbox(create=True)
+        box.stop()
+        self.assertIsNot(self.box, box)
+        self.assertEqual(["http://proxy1/foo", "http://proxy2/foo"], box.pending())
+        self.assertIsNone(outbox.getPurgeOutbox())
+        self.assertGreater(box.process(), 5.0)
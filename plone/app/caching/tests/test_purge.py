@@ -1,12 +1,21 @@
 from Acquisition import aq_base
 from Acquisition import Explicit
+from io import StringIO
 from os.path import dirname
 from os.path import join
 from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.purge import bulkPurging
+from plone.app.caching.purge import CatalogBrainPurgePaths
 from plone.app.caching.purge import ContentPurgePaths
 from plone.app.caching.purge import DiscussionItemPurgePaths
+from plone.app.caching.purge import getBulkPurgeRoots
+from plone.app.caching.purge import isBulkPurging
+from plone.app.caching.purge import planPurgeRequests
+from plone.app.caching.purge import planPurges
+from plone.app.caching.purge import PURGED_OBJECTS_KEY
 from plone.app.caching.purge import purgeOnModified
 from plone.app.caching.purge import purgeOnMovedOrRemoved
+from plone.app.caching.purge import recordMovedObject
 from plone.app.caching.purge import ScalesPurgePaths
 from plone.app.caching.testing import PLONE_APP_CACHING_FUNCTIONAL_TESTING
 from plone.app.contenttypes.behaviors.leadimage import ILeadImageBehavior
@@ -25,8 +34,10 @@ from plone.testing.zca import UNIT_TESTING
 from Products.CMFCore.interfaces import IContentish
 from Products.CMFCore.interfaces import IDiscussionResponse
 from Products.CMFDynamicViewFTI.interfaces import IBrowserDefault
+from Products.ZCatalog.interfaces import ICatalogBrain
 from z3c.caching.interfaces import IPurgeEvent
 from z3c.caching.interfaces import IPurgePaths
+from z3c.caching.purge import Purge
 from zope.component import adapter
 from zope.component import getUtility
 from zope.component import provideAdapter
@@ -41,6 +52,8 @@ from zope.lifecycleevent import ObjectAddedEvent
 from zope.lifecycleevent import ObjectModifiedEvent
 from zope.lifecycleevent import ObjectMovedEvent
 from zope.lifecycleevent import ObjectRemovedEvent
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
 
 import unittest
 
@@ -140,10 +153,14 @@ class TestPurgeRedispatch(unittest.TestCase):
 
     def test_added(self):
         context = FauxContent("new").__of__(FauxContent())
+        setRequest(FauxRequest())
+        self.addCleanup(setRequest, None)
 
+        # Cached not found responses for the new URLs are purged
         notify(ObjectAddedEvent(context, context.__parent__, "new"))
 
-        self.assertEqual(0, len(self.handler.invocations))
+        self.assertEqual(2, len(self.handler.invocations))
+        self.assertEqual(context, self.handler.invocations[0].object)
 
     def test_moved(self):
         context = FauxContent("new").__of__(FauxContent())
@@ -181,6 +198,399 @@ class TestPurgeRedispatch(unittest.TestCase):
         self.assertEqual(context, self.handler.invocations[0].object)
 
 
+class TestPurgeOldPaths(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        from plone.cachepurging.interfaces import ICachePurgingSettings
+        from zope.annotation.attribute import AttributeAnnotations
+        from zope.annotation.interfaces import IAttributeAnnotatable
+
+        provideHandler(objectEventNotify)
+        provideHandler(purgeOnMovedOrRemoved)
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(ContentPurgePaths, adapts=(FauxContent,), name="content")
+
+        registry = Registry()
+        registry.registerInterface(IPloneCacheSettings)
+        registry.registerInterface(ICachePurgingSettings)
+        provideUtility(registry, IRegistry)
+        registry.forInterface(IPloneCacheSettings).purgedContentTypes = ("testtype",)
+        registry.forInterface(ICachePurgingSettings).enabled = True
+
+        @implementer(IAttributeAnnotatable)
+        class AnnotatableRequest(FauxRequest):
+            pass
+
+        self.request = AnnotatableRequest()
+        setRequest(self.request)
+
+    def tearDown(self):
+        setRequest(None)
+
+    def test_moved(self):
+        from plone.cachepurging.hooks import KEY
+        from zope.annotation.interfaces import IAnnotations
+
+        context = FauxContent("new").__of__(FauxContent("folder"))
+        notify(
+            ObjectMovedEvent(
+                context, FauxContent("other"), "old", context.__parent__, "new"
+            )
+        )
+
+        self.assertEqual(
+            {
+                "/other/old",
+                "/other/old/",
+                "/other/old/view",
+                "/other/old/default-view",
+            },
+            IAnnotations(self.request)[KEY],
+        )
+
+    def test_added(self):
+        from plone.cachepurging.hooks import KEY
+        from zope.annotation.interfaces import IAnnotations
+
+        context = FauxContent("new").__of__(FauxContent("folder"))
+        notify(ObjectAddedEvent(context, context.__parent__, "new"))
+
+        self.assertNotIn(KEY, IAnnotations(self.request))
+
+
+    def test_redirections(self):
+        from plone.app.caching import purge
+        from plone.app.redirector.storage import RedirectionStorage
+        from plone.cachepurging.hooks import KEY
+        from zope.annotation.interfaces import IAnnotations
+
+        for name in ("add", "__setitem__", "remove", "__delitem__"):
+            method = RedirectionStorage.__dict__[name]
+            self.addCleanup(setattr, RedirectionStorage, name, method)
+        purge.installRedirectionHooks()
+        purge.installRedirectionHooks()
+
+        storage = RedirectionStorage()
+        storage.add("/folder/old/", "/folder/new")
+        self.assertEqual({"/folder/old"}, IAnnotations(self.request)[KEY])
+
+        IAnnotations(self.request)[KEY].clear()
+        storage["/folder/alias"] = "/folder/new"
+        del storage["/folder/old"]
+        self.assertEqual(
+            {"/folder/alias", "/folder/old"}, IAnnotations(self.request)[KEY]
+        )
+
+
+class TestBulkPurging(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        from plone.cachepurging.interfaces import ICachePurgingSettings
+        from plone.cachepurging.interfaces import IPurger
+
+        self.handler = Handler()
+        provideHandler(self.handler.handler)
+        provideHandler(objectEventNotify)
+        provideHandler(purgeOnModified)
+        provideHandler(purgeOnMovedOrRemoved)
+        provideAdapter(persistentFieldAdapter)
+
+        registry = Registry()
+        registry.registerInterface(IPloneCacheSettings)
+        registry.registerInterface(ICachePurgingSettings)
+        provideUtility(registry, IRegistry)
+        registry.forInterface(IPloneCacheSettings).purgedContentTypes = ("testtype",)
+        settings = registry.forInterface(ICachePurgingSettings)
+        settings.enabled = True
+        settings.cachingProxies = ("http://proxy1", "http://proxy2")
+
+        self.purged = []
+
+        @implementer(IPurger)
+        class FauxPurger:
+            def purgeAsync(self_, url, httpVerb="PURGE"):
+                self.purged.append((httpVerb, url))
+
+        provideUtility(FauxPurger())
+
+        self.site = FauxContent("plone")
+
+    def makeContent(self, name, parent):
+        content = FauxContent(name)
+        content.__parent__ = parent
+        return content
+
+    def test_bulkPurging(self):
+        import transaction
+
+        folder = self.makeContent("folder", self.site)
+        other = self.makeContent("other", self.site)
+
+        transaction.begin()
+        with bulkPurging(self.site):
+            self.assertTrue(isBulkPurging())
+            notify(ObjectModifiedEvent(folder))
+            notify(ObjectModifiedEvent(self.makeContent("a", folder)))
+            notify(ObjectModifiedEvent(self.makeContent("b", folder)))
+            item = self.makeContent("c", other)
+            notify(ObjectMovedEvent(item, folder, "c", other, "c"))
+
+        self.assertFalse(isBulkPurging())
+        self.assertEqual([], self.handler.invocations)
+        self.assertEqual([], self.purged)
+
+        transaction.commit()
+        self.assertEqual(
+            [
+                ("BAN", "http://proxy1/plone/folder"),
+                ("BAN", "http://proxy2/plone/folder"),
+                ("BAN", "http://proxy1/plone/other"),
+                ("BAN", "http://proxy2/plone/other"),
+            ],
+            self.purged,
+        )
+
+    def test_bulkPurging_site(self):
+        import transaction
+
+        transaction.begin()
+        with bulkPurging(self.site, maxRoots=1):
+            notify(ObjectModifiedEvent(self.makeContent("a", self.site)))
+            notify(ObjectModifiedEvent(self.makeContent("b", self.site)))
+        transaction.commit()
+
+        self.assertEqual(
+            [("BAN", "http://proxy1/plone"), ("BAN", "http://proxy2/plone")],
+            self.purged,
+        )
+
+    def test_bulkPurging_commit_inside(self):
+        import transaction
+
+        transaction.begin()
+        with bulkPurging(self.site):
+            notify(ObjectModifiedEvent(self.makeContent("a", self.site)))
+            transaction.commit()
+            self.assertEqual(
+                [("BAN", "http://proxy1/plone/a"), ("BAN", "http://proxy2/plone/a")],
+                self.purged,
+            )
+            del self.purged[:]
+
+            # Transactions without changes send nothing
+            transaction.commit()
+            self.assertEqual([], self.purged)
+
+            notify(ObjectModifiedEvent(self.makeContent("b", self.site)))
+        transaction.commit()
+
+        self.assertEqual(
+            [("BAN", "http://proxy1/plone/b"), ("BAN", "http://proxy2/plone/b")],
+            self.purged,
+        )
+
+    def test_bulkPurging_aborted(self):
+        import transaction
+
+        transaction.begin()
+        with bulkPurging(self.site):
+            notify(ObjectModifiedEvent(self.makeContent("a", self.site)))
+        transaction.abort()
+
+        self.assertEqual([], self.purged)
+
+    def test_getBulkPurgeRoots(self):
+        self.assertEqual(
+            ["/plone/a", "/plone/a-b", "/plone/ab"],
+            getBulkPurgeRoots(
+                ["/plone/a/b", "/plone/ab", "/plone/a", "/plone/a-b", "/plone/a"]
+            ),
+        )
+        self.assertEqual(["/"], getBulkPurgeRoots(["/plone", "/"]))
+
+
+class TestPurgePlanner(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        from plone.app.caching.tests.test_rewarm import AnnotatableRequest
+        from plone.cachepurging.interfaces import ICachePurgingSettings
+        from plone.cachepurging.interfaces import IPurger
+        from zope.annotation.attribute import AttributeAnnotations
+
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+
+        self.registry = Registry()
+        self.registry.registerInterface(IPloneCacheSettings)
+        self.registry.registerInterface(ICachePurgingSettings)
+        provideUtility(self.registry, IRegistry)
+        settings = self.registry.forInterface(ICachePurgingSettings)
+        settings.enabled = True
+        settings.cachingProxies = ("http://proxy1", "http://proxy2")
+
+        self.purged = []
+
+        @implementer(IPurger)
+        class FauxPurger:
+            def purgeAsync(self_, url, httpVerb="PURGE"):
+                self.purged.append((httpVerb, url))
+
+        provideUtility(FauxPurger())
+
+        self.request = AnnotatableRequest()
+        setRequest(self.request)
+        self.addCleanup(setRequest, None)
+
+    def test_planPurges(self):
+        paths, bans = planPurges(
+            {
+                "/plone/a/",
+                "/plone/a/view",
+                "/plone/a/@@images/image/thumb",
+                "/plone/ab/view",
+                "/plone/b/view",
+                "/plone/folder",
+                "/plone/folder/",
+            },
+            ["/plone/a", "/plone/b"],
+        )
+        self.assertEqual(["/plone/a"], bans)
+        self.assertEqual(
+            {"/plone/ab/view", "/plone/b/view", "/plone/folder", "/plone/folder/"},
+            paths,
+        )
+
+    def purge(self, path, paths):
+        from plone.cachepurging.hooks import KEY
+        from zope.annotation.interfaces import IAnnotations
+
+        recordMovedObject(FauxContent(path), FauxContent("old"), path)
+        IAnnotations(self.request).setdefault(KEY, set()).update(paths)
+
+    def test_planPurgeRequests(self):
+        from plone.cachepurging.hooks import KEY
+        from zope.annotation.interfaces import IAnnotations
+        from ZPublisher.pubevents import PubBeforeCommit
+
+        import transaction
+
+        self.registry.forInterface(IPloneCacheSettings).purgeBanThreshold = 8
+
+        transaction.begin()
+        self.purge("a", ["/a/", "/a/view", "/a/@@images/image/thumb", "/folder"])
+        planPurgeRequests(PubBeforeCommit(self.request))
+
+        # Below the threshold, nothing changes
+        self.assertEqual(4, len(IAnnotations(self.request)[KEY]))
+
+        self.purge("b", ["/b/", "/b/view"])
+        planPurgeRequests(PubBeforeCommit(self.request))
+        self.assertEqual({"/folder"}, IAnnotations(self.request)[KEY])
+        self.assertEqual([], self.purged)
+
+        transaction.commit()
+        self.assertEqual(
+            [
+                ("BAN", "http://proxy1/a"),
+                ("BAN", "http://proxy2/a"),
+                ("BAN", "http://proxy1/b"),
+                ("BAN", "http://proxy2/b"),
+            ],
+            self.purged,
+        )
+
+    def test_planPurges_site_root(self):
+        paths, bans = planPurges(
+            {"/", "", "/view", "/news", "/news/view", "/news/item"},
+            {"/", "", "/news"},
+        )
+        self.assertEqual(["/news"], bans)
+        self.assertEqual({"/", "", "/view"}, paths)
+
+    def test_recordMovedObject(self):
+        from Products.CMFCore.interfaces import ISiteRoot
+        from zope.annotation.interfaces import IAnnotations
+        from zope.interface import alsoProvides
+
+        self.registry.forInterface(IPloneCacheSettings).purgeBanThreshold = 8
+
+        # Objects without a virtual URL path cannot be banned
+        recordMovedObject(object(), FauxContent("old"), "a")
+        self.assertNotIn(PURGED_OBJECTS_KEY, IAnnotations(self.request))
+
+        # The site root is never banned
+        site = FauxContent("")
+        alsoProvides(site, ISiteRoot)
+        recordMovedObject(site, FauxContent(""), "")
+        self.assertNotIn(PURGED_OBJECTS_KEY, IAnnotations(self.request))
+
+        recordMovedObject(FauxContent("a"), FauxContent("old"), "b")
+        self.assertEqual(
+            {"/a", "/old/b"}, IAnnotations(self.request)[PURGED_OBJECTS_KEY]
+        )
+
+    def test_purgeOnMovedOrRemoved_renamed(self):
+        from zope.annotation.interfaces import IAnnotations
+
+        self.registry.forInterface(IPloneCacheSettings).purgedContentTypes = (
+            "testtype",
+        )
+        self.registry.forInterface(IPloneCacheSettings).purgeBanThreshold = 8
+
+        folder = FauxContent("folder")
+        item = FauxContent("new").__of__(folder)
+        event = ObjectMovedEvent(item, folder, "old", folder, "new")
+        purgeOnMovedOrRemoved(item, event)
+
+        # Only the moved item is banned, not its parent
+        self.assertEqual(
+            {"/folder/new", "/folder/old"},
+            IAnnotations(self.request)[PURGED_OBJECTS_KEY],
+        )
+
+    def test_purgeOnMovedOrRemoved_root_level_item_removed(self):
+        from plone.cachepurging.hooks import KEY
+        from zope.annotation.interfaces import IAnnotations
+        from ZPublisher.pubevents import PubBeforeCommit
+
+        self.registry.forInterface(IPloneCacheSettings).purgedContentTypes = (
+            "testtype",
+        )
+        self.registry.forInterface(IPloneCacheSettings).purgeBanThreshold = 1
+        self.request.URL = "http://nohost/item/delete_confirmation"
+
+        site = FauxContent("")
+        item = FauxContent("item").__of__(site)
+        purgeOnMovedOrRemoved(item, ObjectRemovedEvent(item, site, "item"))
+
+        # The site root and the removed item are purged, not banned
+        annotations = IAnnotations(self.request)
+        self.assertNotIn(PURGED_OBJECTS_KEY, annotations)
+        annotations[KEY] = {"/", "/view", "/item", "/item/view"}
+        planPurgeRequests(PubBeforeCommit(self.request))
+        self.assertEqual({"/", "/view", "/item", "/item/view"}, annotations[KEY])
+        self.assertEqual([], self.purged)
+
+    def test_planPurgeRequests_disabled(self):
+        from plone.cachepurging.hooks import KEY
+        from zope.annotation.interfaces import IAnnotations
+        from ZPublisher.pubevents import PubBeforeCommit
+
+        self.purge("a", ["/a/", "/a/view", "/a/@@images/image/thumb"])
+        planPurgeRequests(PubBeforeCommit(self.request))
+
+        annotations = IAnnotations(self.request)
+        self.assertNotIn(PURGED_OBJECTS_KEY, annotations)
+        self.assertEqual(3, len(annotations[KEY]))
+
+
 class TestContentPurgePaths(unittest.TestCase):
 
     layer = UNIT_TESTING
@@ -229,6 +639,127 @@ class TestContentPurgePaths(unittest.TestCase):
         self.assertEqual([], list(purger.getAbsolutePaths()))
 
 
+@implementer(ICatalogBrain)
+class FauxBrain(Explicit):
+
+    portal_type = "testtype"
+
+    def __init__(self, path, **metadata):
+        self.path = path
+        self.__dict__.update(metadata)
+
+    def getPath(self):
+        return self.path
+
+
+class FauxTypeInfo:
+    default_view = "listing_view"
+    view_methods = ("listing_view", "@@summary_view")
+
+
+class FauxTypesTool:
+    def getTypeInfo(self, portal_type):
+        return FauxTypeInfo() if portal_type == "testtype" else None
+
+
+class FauxCatalog(Explicit):
+    portal_types = FauxTypesTool()
+
+
+class TestCatalogBrainPurgePaths(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        from plone.registry import field
+        from plone.registry.record import Record
+
+        registry = Registry()
+        registry.records["plone.allowed_sizes"] = Record(
+            field.List(value_type=field.TextLine()), ["large 768:768", "thumb 128:128"]
+        )
+        provideUtility(registry, IRegistry)
+
+    def getPaths(self, brain):
+        return list(CatalogBrainPurgePaths(brain).getRelativePaths())
+
+    def test_metadata(self):
+        brain = FauxBrain(
+            "/plone/bar/foo", getLayout="@@default-view", is_default_page=False
+        )
+        self.assertEqual(
+            ["/plone/bar/foo/", "/plone/bar/foo/view", "/plone/bar/foo/default-view"],
+            self.getPaths(brain),
+        )
+
+        brain = FauxBrain("/plone/bar/foo", getDefaultPage="page", getLayout="view")
+        self.assertEqual(
+            [
+                "/plone/bar/foo/",
+                "/plone/bar/foo/view",
+                "/plone/bar/foo/page",
+                "/plone/bar",
+                "/plone/bar/",
+                "/plone/bar/view",
+                "/plone/bar/@comments",
+            ],
+            self.getPaths(brain),
+        )
+
+    def test_type_views(self):
+        # Without layout metadata, all views of the type are included
+        brain = FauxBrain("/plone/foo", is_default_page=False).__of__(FauxCatalog())
+        self.assertEqual(
+            [
+                "/plone/foo/",
+                "/plone/foo/view",
+                "/plone/foo/listing_view",
+                "/plone/foo/summary_view",
+            ],
+            self.getPaths(brain),
+        )
+
+    def test_image_scales(self):
+        brain = FauxBrain(
+            "/plone/image",
+            is_default_page=False,
+            getLayout="image_view",
+            image_scales={"image": [{"filename": "test.jpg", "scales": {}}]},
+        )
+        self.assertEqual(
+            [
+                "/plone/image/",
+                "/plone/image/view",
+                "/plone/image/image_view",
+                "/plone/image/images/image/large",
+                "/plone/image/@@images/image/large",
+                "/plone/image/images/image/thumb",
+                "/plone/image/@@images/image/thumb",
+                "/plone/image/download/image",
+                "/plone/image/@@download/image",
+                "/plone/image/download/image/test.jpg",
+                "/plone/image/@@download/image/test.jpg",
+            ],
+            self.getPaths(brain),
+        )
+
+    def test_virtual_hosting(self):
+        request = HTTPRequest(
+            StringIO(),
+            {"SERVER_NAME": "example.com", "SERVER_PORT": "80"},
+            HTTPResponse(),
+        )
+        request.other["VirtualRootPhysicalPath"] = ("", "plone")
+        setRequest(request)
+        self.addCleanup(setRequest, None)
+
+        brain = FauxBrain("/plone/foo", is_default_page=True, getLayout="view")
+        self.assertEqual(
+            ["/foo/", "/foo/view", "/", "", "/view", "/@comments"],
+            self.getPaths(brain),
+        )
+
+
 class TestDiscussionItemPurgePaths(unittest.TestCase):
 
     layer = UNIT_TESTING
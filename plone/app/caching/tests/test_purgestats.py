@@ -0,0 +1,214 @@
+from io import StringIO
+from plone.app.caching import outbox
+from plone.app.caching import purgestats
+from plone.app.caching.browser.controlpanel import PurgeStatistics
+from plone.cachepurging.interfaces import ICachePurgingSettings
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+import json
+import unittest
+
+
+class FauxPurger:
+    def __init__(self, status=200, error=""):
+        self.status = status
+        self.error = error
+
+    def purgeSync(self, url, httpVerb="PURGE"):
+        return self.status, "", self.error
+
+
+class TestPurgeStatistics(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def test_record(self):
+        statistics = purgestats.PurgeStatistics()
+        statistics.record("http://proxy1/a", 200, 0.02)
+        statistics.record("http://proxy1/b", 404, 0.005)
+        statistics.record("http://proxy1/c", 503, 20.0, "Unavailable", now=1000.0)
+        statistics.record("http://proxy2/a", 200, 0.2)
+
+        stats = statistics.getStatistics()
+        self.assertEqual(["http://proxy1", "http://proxy2"], sorted(stats))
+
+        proxy1 = stats["http://proxy1"]
+        self.assertEqual(2, proxy1["successes"])
+        self.assertEqual(1, proxy1["failures"])
+        self.assertEqual("503 Unavailable", proxy1["lastError"])
+        self.assertEqual(1000.0, proxy1["lastErrorTime"])
+        self.assertAlmostEqual(20.025 / 3, proxy1["averageTime"])
+        self.assertEqual(20.0, proxy1["maxTime"])
+        self.assertEqual(
+            [1, 1, 0, 0, 0, 0, 0, 0, 0, 1],
+            [bucket["count"] for bucket in proxy1["histogram"]],
+        )
+        self.assertEqual(0.01, proxy1["histogram"][0]["le"])
+        self.assertIsNone(proxy1["histogram"][-1]["le"])
+
+        statistics.clear()
+        self.assertEqual({}, statistics.getStatistics())
+
+    def test_record_traceback(self):
+        statistics = purgestats.PurgeStatistics()
+        statistics.record(
+            "http://proxy1/a",
+            "ERROR",
+            3.0,
+            "Traceback (most recent call last):\n  ...\nConnectionError: refused\n",
+        )
+        self.assertEqual(
+            "ERROR ConnectionError: refused",
+            statistics.getStatistics()["http://proxy1"]["lastError"],
+        )
+
+    def test_emptyStatistics(self):
+        stats = purgestats.emptyStatistics()
+        self.assertEqual(0, stats["successes"])
+        self.assertIsNone(stats["averageTime"])
+        self.assertEqual(len(purgestats.LATENCY_BUCKETS) + 1, len(stats["histogram"]))
+
+    def test_purgeSync(self):
+        oldStatistics = purgestats.statistics
+        purgestats.statistics = purgestats.PurgeStatistics()
+        self.addCleanup(setattr, purgestats, "statistics", oldStatistics)
+
+        self.assertEqual(
+            ("ERROR", "", "refused"),
+            purgestats.purgeSync(FauxPurger("ERROR", "refused"), "http://proxy1/a"),
+        )
+        self.assertEqual(
+            1, purgestats.statistics.getStatistics()["http://proxy1"]["failures"]
+        )
+
+
+class FauxResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.reason = ""
+        self.headers = {}
+
+
+class FauxSession:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.requests = []
+
+    def request(self, httpVerb, url, timeout=None):
+        self.requests.append((httpVerb, url))
+        if self.status_code is None:
+            raise ConnectionError("refused")
+        return FauxResponse(self.status_code)
+
+
+class TestRecordingPurger(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        oldStatistics = purgestats.statistics
+        purgestats.statistics = purgestats.PurgeStatistics()
+        self.addCleanup(setattr, purgestats, "statistics", oldStatistics)
+
+        self.purger = purgestats.RecordingPurger()
+
+    def test_purge(self):
+        # The worker threads send purges and bans through ``purge()``
+        self.purger.purge(FauxSession(), "http://proxy1/a")
+        self.purger.purge(FauxSession(503), "http://proxy1/b")
+        self.purger.purge(FauxSession(200), "http://proxy2/plone", "BAN")
+        self.assertRaises(
+            ConnectionError, self.purger.purge, FauxSession(None), "http://proxy2/a"
+        )
+
+        stats = purgestats.statistics.getStatistics()
+        self.assertEqual(1, stats["http://proxy1"]["successes"])
+        self.assertEqual(1, stats["http://proxy1"]["failures"])
+        self.assertEqual(503, stats["http://proxy1"]["lastStatus"])
+        self.assertEqual(1, stats["http://proxy2"]["successes"])
+        self.assertEqual(1, stats["http://proxy2"]["failures"])
+        self.assertEqual(
+            "ERROR ConnectionError: refused", stats["http://proxy2"]["lastError"]
+        )
+
+    def test_purgeSync(self):
+        # Purges through the recording purger are recorded once
+        self.assertTrue(purgestats.recordsOutcome(self.purger))
+        self.assertFalse(purgestats.recordsOutcome(FauxPurger()))
+
+        status, xcache, xerror = purgestats.purgeSync(
+            self.purger, "http://127.0.0.1:1/a"
+        )
+        self.assertEqual("ERROR", status)
+        stats = purgestats.statistics.getStatistics()["http://127.0.0.1:1"]
+        self.assertEqual(1, stats["failures"])
+
+
+class TestPurgeStatisticsView(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+
+        registry = Registry()
+        registry.registerInterface(ICachePurgingSettings)
+        provideUtility(registry, IRegistry)
+        settings = registry.forInterface(ICachePurgingSettings)
+        settings.enabled = True
+        settings.cachingProxies = ("http://proxy1", "http://proxy2:8080/")
+
+        oldStatistics = purgestats.statistics
+        purgestats.statistics = purgestats.PurgeStatistics()
+        self.addCleanup(setattr, purgestats, "statistics", oldStatistics)
+
+        self.box = outbox.PurgeOutbox(purger=FauxPurger(503, "Unavailable"))
+        self.box.start = lambda: None
+        outbox.setPurgeOutbox(self.box)
+        self.addCleanup(outbox.setPurgeOutbox, None)
+
+    def makeView(self):
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "PATH_INFO": "/plone/@@caching-purge-statistics.json",
+            "QUERY_STRING": "",
+        }
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        return PurgeStatistics(None, request)
+
+    def test_getStatistics(self):
+        self.box.add(["http://proxy1/a", "http://proxy1/b"], now=1000.0)
+        self.box.process(now=1000.0)
+
+        statistics = self.makeView().getStatistics()
+        self.assertEqual(["http://proxy1", "http://proxy2:8080"], sorted(statistics))
+
+        # Failed purges are recorded, and stay queued in the outbox
+        proxy1 = statistics["http://proxy1"]
+        self.assertEqual(1, proxy1["failures"])
+        self.assertEqual("503 Unavailable", proxy1["lastError"])
+        self.assertEqual(2, proxy1["queued"])
+        self.assertEqual(1001.0, proxy1["retryAt"])
+
+        proxy2 = statistics["http://proxy2:8080"]
+        self.assertEqual(0, proxy2["failures"])
+        self.assertEqual(0, proxy2["queued"])
+        self.assertIsNone(proxy2["retryAt"])
+
+    def test_json(self):
+        self.box.add(["http://proxy1/a"], now=1000.0)
+
+        view = self.makeView()
+        statistics = json.loads(view.json())
+        self.assertEqual(1, statistics["http://proxy1"]["queued"])
+        self.assertEqual(
+            "application/json", view.request.response.getHeader("Content-Type")
+        )
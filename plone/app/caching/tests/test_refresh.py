@@ -0,0 +1,242 @@
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from io import StringIO
+from plone.app.caching import refresh
+from plone.app.caching import rewarm
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.operations.utils import getRAMCacheKey
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from urllib.parse import unquote
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.globalrequest import setRequest
+from zope.interface import classImplements
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+from ZPublisher.pubevents import PubSuccess
+
+import threading
+import unittest
+
+
+class TestHotPages(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def test_hottest(self):
+        hotPages = refresh.HotPages()
+        for url, hits in (("/a", 3), ("/b", 5), ("/c", 1)):
+            for i in range(hits):
+                hotPages.record("rule1", url, 2)
+        hotPages.record("rule2", "/d", 2)
+
+        self.assertEqual(
+            {"rule1": ["/b", "/a"], "rule2": ["/d"]},
+            hotPages.hottest(2),
+        )
+
+        hotPages.clear()
+        self.assertEqual({}, hotPages.hottest(2))
+
+    def test_decay(self):
+        hotPages = refresh.HotPages()
+        for i in range(10):
+            hotPages.record("rule1", "/old", 1)
+        for url in ("/a", "/b", "/c", "/d"):
+            hotPages.record("rule1", url, 1)
+
+        # Only twice the requested number of URLs is kept, with halved counts
+        self.assertEqual(["/old"], hotPages.hottest(1)["rule1"])
+        self.assertEqual(2, len(hotPages.hottest(10)["rule1"]))
+
+        for i in range(6):
+            hotPages.record("rule1", "/new", 1)
+        self.assertEqual(["/new"], hotPages.hottest(1)["rule1"])
+
+
+class TestRefreshAhead(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+        classImplements(HTTPRequest, IAttributeAnnotatable)
+
+        self.registry = Registry()
+        self.registry.registerInterface(IPloneCacheSettings)
+        provideUtility(self.registry, IRegistry)
+        self.registry.forInterface(IPloneCacheSettings).refreshAheadSize = 2
+
+        oldHotPages = refresh.hotPages
+        refresh.hotPages = refresh.HotPages()
+        self.addCleanup(setattr, refresh, "hotPages", oldHotPages)
+
+        self.scheduled = []
+
+        class DummyRewarmer:
+            def schedule(self_, urls, delay=0):
+                self.scheduled.append(urls)
+
+        oldRewarmer = rewarm.rewarmer
+        rewarm.rewarmer = DummyRewarmer()
+        self.addCleanup(setattr, rewarm, "rewarmer", oldRewarmer)
+
+    def makeRequest(
+        self, path, query="", userAgent="Mozilla", server=("zope1", "8080")
+    ):
+        environ = {
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": server[1],
+            "HTTP_HOST": "www.example.com",
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "HTTP_USER_AGENT": userAgent,
+        }
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        request.other["ACTUAL_URL"] = "http://www.example.com" + path
+        return request
+
+    def test_recordHit(self):
+        refresh.recordHit(self.makeRequest("/a"), "rule1")
+        refresh.recordHit(self.makeRequest("/b", "x=1"), "rule1")
+        refresh.recordHit(self.makeRequest("/b", "x=1"), "rule1")
+
+        # Hits by the refresh itself do not count
+        request = self.makeRequest("/c", userAgent=rewarm.USER_AGENT)
+        refresh.recordHit(request, "rule1")
+        refresh.recordHit(request, "rule1")
+        refresh.recordHit(request, "rule1")
+
+        # Pages are requested from this process, for the original host
+        self.assertEqual(
+            {
+                "rule1": [
+                    ("http://zope1:8080/b?x=1", "www.example.com"),
+                    ("http://zope1:8080/a", "www.example.com"),
+                ]
+            },
+            refresh.hotPages.hottest(2),
+        )
+
+    def test_recordHit_disabled(self):
+        self.registry.forInterface(IPloneCacheSettings).refreshAheadSize = 0
+        refresh.recordHit(self.makeRequest("/a"), "rule1")
+        self.assertEqual({}, refresh.hotPages.hottest(2))
+
+    def test_refreshAhead(self):
+        refresh.recordHit(self.makeRequest("/a"), "rule1")
+        refresh.recordHit(self.makeRequest("/b"), "rule2")
+
+        # Nothing changed
+        request = self.makeRequest("/edit")
+        refresh.refreshAhead(PubSuccess(request))
+        self.assertEqual([], self.scheduled)
+
+        setRequest(request)
+        self.addCleanup(setRequest, None)
+        refresh.contentModified(None, None)
+
+        refresh.refreshAhead(PubSuccess(request))
+        self.assertEqual(
+            [
+                [
+                    ("http://zope1:8080/a", "www.example.com"),
+                    ("http://zope1:8080/b", "www.example.com"),
+                ]
+            ],
+            self.scheduled,
+        )
+
+    def test_getLocalURL(self):
+        path = "/VirtualHostBase/https/www.example.com:443/plone/VirtualHostRoot/ä"
+        request = self.makeRequest(path, "b_start=20")
+        self.assertEqual(
+            "http://zope1:8080/VirtualHostBase/https/www.example.com:443"
+            "/plone/VirtualHostRoot/%C3%A4?b_start=20",
+            refresh.getLocalURL(request),
+        )
+
+
+class LocalZope(BaseHTTPRequestHandler):
+    """Stands in for this Zope process, and computes the RAM cache key of the
+    requests it gets
+    """
+
+    keys = []
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        environ = {
+            "SERVER_NAME": "127.0.0.1",
+            "SERVER_PORT": str(self.server.server_address[1]),
+            "HTTP_HOST": self.headers["Host"],
+            "PATH_INFO": unquote(path),
+            "QUERY_STRING": query,
+        }
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        self.keys.append(getRAMCacheKey(request, etag="|abc"))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRefreshAheadLocal(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+        classImplements(HTTPRequest, IAttributeAnnotatable)
+
+        registry = Registry()
+        registry.registerInterface(IPloneCacheSettings)
+        provideUtility(registry, IRegistry)
+        registry.forInterface(IPloneCacheSettings).refreshAheadSize = 2
+
+        oldHotPages = refresh.hotPages
+        refresh.hotPages = refresh.HotPages()
+        self.addCleanup(setattr, refresh, "hotPages", oldHotPages)
+
+        oldRewarmer = rewarm.rewarmer
+        rewarm.rewarmer = rewarm.Rewarmer(interval=0)
+        self.addCleanup(setattr, rewarm, "rewarmer", oldRewarmer)
+        self.addCleanup(rewarm.rewarmer.shutdown)
+
+        LocalZope.keys = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), LocalZope)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_refreshAhead_same_key(self):
+        environ = {
+            "SERVER_NAME": "127.0.0.1",
+            "SERVER_PORT": str(self.server.server_address[1]),
+            "HTTP_HOST": "www.example.com",
+            "PATH_INFO": "/plone/news",
+            "QUERY_STRING": "b_start=20",
+        }
+        request = HTTPRequest(StringIO(), environ, HTTPResponse())
+        refresh.recordHit(request, "rule1")
+
+        setRequest(request)
+        self.addCleanup(setRequest, None)
+        refresh.contentModified(None, None)
+        refresh.refreshAhead(PubSuccess(request))
+        rewarm.rewarmer.shutdown()
+
+        # The refresh gets the key of the page cached for the original
+        # request, so it replaces that entry in this process's RAM cache
+        self.assertEqual([getRAMCacheKey(request, etag="|abc")], LocalZope.keys)
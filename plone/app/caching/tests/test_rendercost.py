@@ -0,0 +1,245 @@
+from io import StringIO
+from plone.app.caching.interfaces import IETagValue
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.interfaces import IRAMCached
+from plone.app.caching.operations import rendercost
+from plone.app.caching.operations.default import BaseCaching
+from plone.app.caching.operations.ramcache import Store
+from plone.caching.interfaces import ICachingOperationType
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from Products.CMFCore.interfaces import IMembershipTool
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import adapter
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.interface import classImplements
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.interface import provider
+from ZPublisher.HTTPRequest import HTTPRequest
+from ZPublisher.HTTPResponse import HTTPResponse
+
+import unittest
+
+
+class DummyView:
+    __name__ = "expensive-view"
+
+
+class PublicView(DummyView):
+    __parent__ = None
+    _View_Permission = ("Anonymous",)
+
+
+@implementer(IETagValue)
+@adapter(Interface, Interface)
+class Version:
+    def __init__(self, published, request):
+        pass
+
+    def __call__(self):
+        return "1"
+
+
+@implementer(IMembershipTool)
+class DummyMembershipTool:
+    anonymous = True
+
+    def isAnonymousUser(self):
+        return self.anonymous
+
+
+class TestRenderCostStatistics(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def test_getCost(self):
+        statistics = rendercost.RenderCostStatistics()
+        statistics.record("foo", 0.1, 2048)
+        statistics.record("foo", 0.1, 2048)
+        self.assertIsNone(statistics.getCost("foo"))
+
+        statistics.record("foo", 0.1, 2048)
+        self.assertAlmostEqual(50.0, statistics.getCost("foo"))
+
+        # Small responses count as one kilobyte
+        for i in range(3):
+            statistics.record("bar", 0.01, 10)
+        self.assertAlmostEqual(10.0, statistics.getCost("bar"))
+
+        self.assertEqual(
+            ["foo", "bar"], [stats["view"] for stats in statistics.getStatistics()]
+        )
+        self.assertEqual(
+            {"view": "bar", "renders": 3, "size": 10},
+            {
+                key: value
+                for key, value in statistics.getStatistics()[1].items()
+                if key in ("view", "renders", "size")
+            },
+        )
+
+        statistics.clear()
+        self.assertEqual([], statistics.getStatistics())
+
+    def test_maxViews(self):
+        statistics = rendercost.RenderCostStatistics(maxViews=2)
+        statistics.record("foo", 0.1, 1024)
+        statistics.record("foo", 0.1, 1024)
+        statistics.record("bar", 0.1, 1024)
+        statistics.record("baz", 0.1, 1024)
+
+        self.assertEqual(
+            ["baz", "foo"],
+            sorted(stats["view"] for stats in statistics.getStatistics()),
+        )
+
+    def test_getViewName(self):
+        self.assertEqual("expensive-view", rendercost.getViewName(DummyView()))
+
+        class Content:
+            def getId(self):
+                return "front-page"
+
+        self.assertEqual("front-page", rendercost.getViewName(Content()))
+        self.assertEqual("object", rendercost.getViewName(object()))
+
+
+class TestRenderCost(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(AttributeAnnotations)
+        provideAdapter(persistentFieldAdapter)
+        classImplements(HTTPRequest, IAttributeAnnotatable)
+
+        self.registry = Registry()
+        self.registry.registerInterface(IPloneCacheSettings)
+        provideUtility(self.registry, IRegistry)
+
+        oldStatistics = rendercost.statistics
+        rendercost.statistics = rendercost.RenderCostStatistics()
+        self.addCleanup(setattr, rendercost, "statistics", oldStatistics)
+
+    def makeRequest(self):
+        environ = {
+            "SERVER_NAME": "example.com",
+            "SERVER_PORT": "80",
+            "PATH_INFO": "/foo",
+            "QUERY_STRING": "",
+        }
+        return HTTPRequest(StringIO(), environ, HTTPResponse())
+
+    def test_isExpensive(self):
+        view = DummyView()
+        for i in range(3):
+            rendercost.statistics.record("expensive-view", 0.1, 1024)
+
+        # Disabled by default
+        self.assertFalse(rendercost.isExpensive(view))
+
+        settings = self.registry.forInterface(IPloneCacheSettings)
+        settings.ramCacheCostThreshold = 100.0
+        self.assertTrue(rendercost.isExpensive(view))
+
+        settings.ramCacheCostThreshold = 200.0
+        self.assertFalse(rendercost.isExpensive(view))
+
+    def test_store_records_render_cost(self):
+        view = DummyView()
+        request = self.makeRequest()
+        request.response.setStatus(200)
+
+        # Nothing is recorded unless the caching operations saw the request
+        Store(view, request).transformBytes(b"x" * 2048, "utf-8")
+        self.assertEqual([], rendercost.statistics.getStatistics())
+
+        rendercost.markRenderStart(request)
+        annotations = IAnnotations(request)
+        annotations[rendercost.RENDER_START_ANNOTATION_KEY] -= 1.0
+        Store(view, request).transformUnicode("x" * 2048, "utf-8")
+
+        statistics = rendercost.statistics.getStatistics()
+        self.assertEqual(1, len(statistics))
+        self.assertEqual("expensive-view", statistics[0]["view"])
+        self.assertEqual(2048, statistics[0]["size"])
+        self.assertGreaterEqual(statistics[0]["time"], 1000.0)
+
+        # Errors are not recorded
+        request.response.setStatus(500)
+        Store(view, request).transformBytes(b"x", "utf-8")
+        self.assertEqual(1, rendercost.statistics.getStatistics()[0]["renders"])
+
+    def test_store_does_not_encode(self):
+        class Text(str):
+            def encode(self, encoding):
+                raise AssertionError("encoded")
+
+        request = self.makeRequest()
+        request.response.setStatus(200)
+
+        # Pages that are neither RAM cached nor measured are left alone
+        store = Store(DummyView(), request)
+        self.assertIsNone(store.transformUnicode(Text("x"), "utf-8"))
+
+    def test_store_iterable(self):
+        view = DummyView()
+        request = self.makeRequest()
+        request.response.setStatus(200)
+        rendercost.markRenderStart(request)
+
+        # Streamed responses are not consumed just to measure them
+        self.assertIsNone(Store(view, request).transformIterable([b"x"], "utf-8"))
+        self.assertEqual([], rendercost.statistics.getStatistics())
+
+    def test_interceptResponse_marks_render_start(self):
+        @provider(ICachingOperationType)
+        class Caching(BaseCaching):
+            pass
+
+        request = self.makeRequest()
+        Caching(DummyView(), request).interceptResponse("testrule", request.response)
+        self.assertIn(rendercost.RENDER_START_ANNOTATION_KEY, IAnnotations(request))
+
+    def test_expensive_cached_in_RAM(self):
+        @provider(ICachingOperationType)
+        class Caching(BaseCaching):
+            etags = ("version",)
+
+        provideAdapter(Version, name="version")
+        membership = DummyMembershipTool()
+        provideUtility(membership, IMembershipTool)
+
+        settings = self.registry.forInterface(IPloneCacheSettings)
+        settings.ramCacheCostThreshold = 100.0
+        for i in range(3):
+            rendercost.statistics.record("expensive-view", 0.5, 1024)
+
+        request = self.makeRequest()
+        Caching(PublicView(), request).modifyResponse("testrule", request.response)
+        self.assertTrue(IRAMCached.providedBy(request))
+
+        # Pages rendered for authenticated users are never stored, since the
+        # ETag does not tell users apart
+        membership.anonymous = False
+        request = self.makeRequest()
+        Caching(PublicView(), request).modifyResponse("testrule", request.response)
+        self.assertFalse(IRAMCached.providedBy(request))
+
+        # Nor are responses setting cookies or marked private
+        membership.anonymous = True
+        request = self.makeRequest()
+        request.response.setCookie("__ac", "secret")
+        Caching(PublicView(), request).modifyResponse("testrule", request.response)
+        self.assertFalse(IRAMCached.providedBy(request))
+
+        request = self.makeRequest()
+        request.response.setHeader("Cache-Control", "private")
+        Caching(PublicView(), request).modifyResponse("testrule", request.response)
+        self.assertFalse(IRAMCached.providedBy(request))
@@ -0,0 +1,193 @@
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from plone.app.caching import rewarm
+from plone.app.caching.interfaces import IPloneCacheSettings
+from plone.app.caching.tests.test_purge import FauxContent
+from plone.app.caching.tests.test_purge import FauxRequest
+from plone.cachepurging.interfaces import ICachePurgingSettings
+from plone.registry import Registry
+from plone.registry.fieldfactory import persistentFieldAdapter
+from plone.registry.interfaces import IRegistry
+from plone.testing.zca import UNIT_TESTING
+from z3c.caching.purge import Purge
+from zope.annotation.attribute import AttributeAnnotations
+from zope.annotation.interfaces import IAnnotations
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import provideAdapter
+from zope.component import provideUtility
+from zope.globalrequest import setRequest
+from zope.interface import implementer
+from ZPublisher.pubevents import PubSuccess
+
+import threading
+import time
+import unittest
+
+
+@implementer(IAttributeAnnotatable)
+class AnnotatableRequest(FauxRequest):
+    pass
+
+
+class FauxFolder(FauxContent):
+    def defaultView(self):
+        return "front-page"
+
+    def absolute_url(self):
+        return "http://nohost/" + self.virtual_url_path()
+
+
+class FauxPage(FauxContent):
+    def absolute_url(self):
+        return "http://nohost/" + self.virtual_url_path()
+
+
+class StandIn(BaseHTTPRequestHandler):
+
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((time.time(), self.path, self.headers["User-Agent"]))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRewarmer(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        StandIn.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def test_schedule(self):
+        rewarmer = rewarm.Rewarmer(interval=0.05)
+        self.addCleanup(rewarmer.shutdown)
+
+        futures = rewarmer.schedule(
+            [self.url + "/foo", self.url + "/bar", self.url + "/foo"], delay=0.1
+        )
+        # Scheduled URLs are not scheduled again
+        futures += rewarmer.schedule([self.url + "/bar"])
+
+        self.assertEqual([200, 200], [future.result() for future in futures])
+        self.assertEqual(
+            ["/bar", "/foo"], sorted(path for _, path, _ in StandIn.requests)
+        )
+        self.assertEqual({rewarm.USER_AGENT}, {ua for _, _, ua in StandIn.requests})
+
+        # Requests are throttled
+        times = sorted(t for t, _, _ in StandIn.requests)
+        self.assertGreaterEqual(times[1] - times[0], 0.04)
+
+        # Once done, a URL can be scheduled again
+        futures = rewarmer.schedule([self.url + "/foo"])
+        self.assertEqual([200], [future.result() for future in futures])
+
+    def test_schedule_bounded(self):
+        rewarmer = rewarm.Rewarmer(interval=0, maxQueued=2)
+        self.addCleanup(rewarmer.shutdown)
+
+        futures = rewarmer.schedule(
+            [self.url + "/foo", self.url + "/bar", self.url + "/baz"], delay=0.1
+        )
+        self.assertEqual([200, 200], [future.result() for future in futures])
+        self.assertEqual(
+            ["/bar", "/foo"], sorted(path for _, path, _ in StandIn.requests)
+        )
+
+    def test_schedule_error(self):
+        rewarmer = rewarm.Rewarmer(interval=0)
+        self.addCleanup(rewarmer.shutdown)
+
+        self.server.shutdown()
+        self.server.server_close()
+
+        futures = rewarmer.schedule([self.url + "/foo"])
+        self.assertEqual([None], [future.result() for future in futures])
+
+
+class TestRewarmQueue(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        provideAdapter(persistentFieldAdapter)
+        provideAdapter(AttributeAnnotations)
+
+        self.registry = Registry()
+        self.registry.registerInterface(IPloneCacheSettings)
+        self.registry.registerInterface(ICachePurgingSettings)
+        provideUtility(self.registry, IRegistry)
+
+        settings = self.registry.forInterface(IPloneCacheSettings)
+        settings.rewarmContentTypes = ("testtype",)
+        settings.rewarmDelay = 5
+
+        self.request = AnnotatableRequest()
+        setRequest(self.request)
+        self.addCleanup(setRequest, None)
+
+        self.scheduled = []
+
+        class DummyRewarmer:
+            def schedule(self_, urls, delay=0):
+                self.scheduled.append((urls, delay))
+
+        oldRewarmer = rewarm.rewarmer
+        rewarm.rewarmer = DummyRewarmer()
+        self.addCleanup(setattr, rewarm, "rewarmer", oldRewarmer)
+
+    def test_direct(self):
+        page = FauxPage("front-page").__of__(FauxFolder("section"))
+        rewarm.queueRewarm(Purge(page))
+
+        other = FauxPage("other").__of__(FauxFolder("section"))
+        rewarm.queueRewarm(Purge(other))
+
+        rewarm.rewarm(PubSuccess(self.request))
+        self.assertEqual(
+            [
+                (
+                    [
+                        "http://nohost/section",
+                        "http://nohost/section/front-page",
+                        "http://nohost/section/other",
+                    ],
+                    5,
+                )
+            ],
+            self.scheduled,
+        )
+
+    def test_proxies(self):
+        purgingSettings = self.registry.forInterface(ICachePurgingSettings)
+        purgingSettings.enabled = True
+        purgingSettings.cachingProxies = ("http://proxy:6081",)
+
+        page = FauxPage("other").__of__(FauxFolder("section"))
+        rewarm.queueRewarm(Purge(page))
+
+        self.assertEqual(
+            {"http://proxy:6081/section/other"},
+            IAnnotations(self.request)[rewarm.KEY],
+        )
+
+    def test_other_type(self):
+        page = FauxPage("other").__of__(FauxFolder("section"))
+        page.portal_type = "othertype"
+        rewarm.queueRewarm(Purge(page))
+
+        rewarm.rewarm(PubSuccess(self.request))
+        self.assertEqual([], self.scheduled)
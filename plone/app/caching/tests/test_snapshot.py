@@ -0,0 +1,101 @@
+from plone.app.caching import snapshot
+from plone.app.caching.operations.utils import PAGE_CACHE_KEY
+from plone.testing.zca import UNIT_TESTING
+from zope.ramcache.ram import Storage
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestSnapshot(unittest.TestCase):
+
+    layer = UNIT_TESTING
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "ramcache.snapshot")
+
+    def makeStorage(self, **pages):
+        storage = Storage()
+        for name, (value, hits) in pages.items():
+            key = (("key", name.encode("utf-8")),)
+            storage.setEntry(PAGE_CACHE_KEY, key, value)
+            for i in range(hits):
+                storage.getEntry(PAGE_CACHE_KEY, key)
+        return storage
+
+    def test_dump_and_load(self):
+        caches = {
+            "cache1": self.makeStorage(
+                hot=((200, {}, b"Hot", 0), 10),
+                cold=((200, {}, b"Cold", 0), 1),
+                expired=((302, {}, b"", 0, time.time() - 10), 20),
+            ),
+            "cache2": self.makeStorage(warm=((200, {}, b"Warm", 0), 5)),
+        }
+        caches["cache1"].setEntry("other", (("key", b"x"),), "Other")
+
+        self.assertEqual(2, snapshot.dumpSnapshot(self.path, 2, caches=caches))
+
+        entries, globalKey = snapshot.loadSnapshot(self.path)
+        self.assertEqual(PAGE_CACHE_KEY, globalKey)
+        self.assertEqual(
+            [
+                ("cache1", (("key", b"hot"),), (200, {}, b"Hot", 0)),
+                ("cache2", (("key", b"warm"),), (200, {}, b"Warm", 0)),
+            ],
+            entries,
+        )
+
+    def test_load_missing_or_damaged(self):
+        self.assertEqual(([], None), snapshot.loadSnapshot(self.path))
+
+        with open(self.path, "wb") as f:
+            f.write(b"garbage")
+        self.assertEqual(([], None), snapshot.loadSnapshot(self.path))
+
+    def test_preload(self):
+        storage = self.makeStorage(hot=((200, {}, b"Newer", 0), 1))
+        caches = {"cache1": storage}
+        entries = [
+            ("cache1", (("key", b"hot"),), (200, {}, b"Hot", 0)),
+            ("cache1", (("key", b"warm"),), (200, {}, b"Warm", 0)),
+            ("cache2", (("key", b"cold"),), (200, {}, b"Cold", 0)),
+        ]
+
+        pending = snapshot.preloadSnapshot(entries, PAGE_CACHE_KEY, caches=caches)
+
+        # Pages for storages that do not exist yet are kept for later
+        self.assertEqual([entries[2]], pending)
+
+        # Pages cached in the meantime are not replaced
+        self.assertEqual(
+            (200, {}, b"Newer", 0),
+            storage.getEntry(PAGE_CACHE_KEY, (("key", b"hot"),)),
+        )
+        self.assertEqual(
+            (200, {}, b"Warm", 0),
+            storage.getEntry(PAGE_CACHE_KEY, (("key", b"warm"),)),
+        )
+
+    def test_settings(self):
+        from App.config import getConfiguration
+
+        config = getConfiguration()
+        oldProductConfig = getattr(config, "product_config", None)
+        self.addCleanup(setattr, config, "product_config", oldProductConfig)
+
+        config.product_config = {}
+        self.assertEqual((None, 0), snapshot.getSnapshotSettings())
+
+        config.product_config = {
+            "plone.app.caching": {"ramcache-snapshot": self.path},
+        }
+        self.assertEqual((self.path, 1000), snapshot.getSnapshotSettings())
+
+        config.product_config["plone.app.caching"]["ramcache-snapshot-size"] = "50"
+        self.assertEqual((self.path, 50), snapshot.getSnapshotSettings())
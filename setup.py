@@ -43,6 +43,8 @@ setup(
         "zope.component",
         "zope.publisher",
         "zope.pagetemplate",
+        "zope.processlifetime",
+        "zope.ramcache",
         "plone.memoize",
         "plone.protect",
         "plone.registry >= 1.0b4",